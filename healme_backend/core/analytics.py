@@ -0,0 +1,177 @@
+# core/analytics.py - Mood and sleep trend analytics
+#
+# Series are loaded with values_list and laid out as a (users x days) NumPy
+# grid, NaN where nothing was logged. Every metric is computed on the whole
+# grid at once, so analysing a therapist's caseload costs the same handful of
+# array operations as analysing one patient.
+import datetime
+from operator import itemgetter
+
+import numpy as np
+from django.db import connections
+
+from .models import Humeur, Sommeil
+
+
+def load_series(model, value_field, user_ids, start, end):
+    """Return (patient ids, day ordinals, values) arrays of the entries between start and end"""
+    queryset = model.objects.filter(
+        patient_id__in=user_ids,
+        date__gte=start,
+        date__lte=end
+    ).values_list('patient_id', 'date', value_field).order_by()
+
+    # Straight from the cursor: the drivers already return ints, dates and
+    # floats, Django's per-row conversion doubles the cost of big series
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    # One column at a time, iterated in C by map/fromiter
+    count = len(rows)
+    return (
+        np.fromiter(map(itemgetter(0), rows), dtype=np.int64, count=count),
+        np.fromiter(map(datetime.date.toordinal, map(itemgetter(1), rows)), dtype=np.int64, count=count),
+        np.fromiter(map(itemgetter(2), rows), dtype=np.float64, count=count),
+    )
+
+
+def build_grid(patient_ids, ordinals, values, user_ids, start, days):
+    """Daily mean per user as a (users x days) array, NaN on days without entries"""
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    order = np.argsort(user_ids)
+    rows = order[np.searchsorted(user_ids, patient_ids, sorter=order)]
+    columns = ordinals - start.toordinal()
+
+    flat = rows * days + columns
+    size = len(user_ids) * days
+    sums = np.bincount(flat, weights=values, minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).reshape(len(user_ids), days)
+
+
+def rolling(grid, window):
+    """
+    Mean and standard deviation over the last `window` days (today included),
+    ignoring missing days; NaN where the window holds no entry
+    """
+    valid = ~np.isnan(grid)
+    values = np.where(valid, grid, 0.0)
+    zeros = np.zeros((grid.shape[0], 1))
+    value_sums = np.hstack([zeros, np.cumsum(values, axis=1)])
+    square_sums = np.hstack([zeros, np.cumsum(values ** 2, axis=1)])
+    counts = np.hstack([zeros, np.cumsum(valid, axis=1)])
+
+    upper = np.arange(1, grid.shape[1] + 1)
+    lower = np.maximum(upper - window, 0)
+    total = value_sums[:, upper] - value_sums[:, lower]
+    squares = square_sums[:, upper] - square_sums[:, lower]
+    n = counts[:, upper] - counts[:, lower]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        variance = np.where(n > 0, squares / n - mean ** 2, np.nan)
+    return mean, np.sqrt(np.clip(variance, 0, None))
+
+
+def correlation(first, second):
+    """Pearson correlation per row over the days both series have a value"""
+    both = ~np.isnan(first) & ~np.isnan(second)
+    n = both.sum(axis=1)
+    x = np.where(both, first, 0.0)
+    y = np.where(both, second, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = x.sum(axis=1) / n
+        mean_y = y.sum(axis=1) / n
+        dx = np.where(both, x - mean_x[:, None], 0.0)
+        dy = np.where(both, y - mean_y[:, None], 0.0)
+        r = (dx * dy).sum(axis=1) / np.sqrt((dx ** 2).sum(axis=1) * (dy ** 2).sum(axis=1))
+    # Fewer than 3 shared days says nothing
+    return np.where(n >= 3, r, np.nan)
+
+
+def detect_drops(grid, window, min_drop=2.0, z_score=2.0):
+    """
+    Days whose value falls well below the previous `window` days: at least
+    min_drop under their mean, or z_score standard deviations under it
+    """
+    mean, std = rolling(grid, window)
+    previous_mean = np.hstack([np.full((grid.shape[0], 1), np.nan), mean[:, :-1]])
+    previous_std = np.hstack([np.full((grid.shape[0], 1), np.nan), std[:, :-1]])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drop = previous_mean - grid
+        unusual = (previous_std > 0) & (drop / previous_std >= z_score)
+    return (drop >= min_drop) | unusual
+
+
+def streaks(logged):
+    """Longest and current (ending on the last day) run of logged days per row"""
+    users, days = logged.shape
+    padded = np.zeros((users, days + 2), dtype=np.int8)
+    padded[:, 1:-1] = logged
+    edges = np.diff(padded, axis=1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)
+    # argwhere walks row by row, so the n-th start pairs with the n-th end
+    lengths = ends[:, 1] - starts[:, 1]
+
+    longest = np.zeros(users, dtype=np.int64)
+    np.maximum.at(longest, starts[:, 0], lengths)
+    current = np.zeros(users, dtype=np.int64)
+    running = ends[:, 1] == days
+    current[starts[running, 0]] = lengths[running]
+    return longest, current
+
+
+def compute_metrics(mood, sleep, window=7):
+    """All metrics for (users x days) mood and sleep grids"""
+    mood_average, _ = rolling(mood, window)
+    sleep_average, _ = rolling(sleep, window)
+    longest, current = streaks(~np.isnan(mood))
+    return {
+        'mood_moving_average': mood_average,
+        'sleep_moving_average': sleep_average,
+        'mood_sleep_correlation': correlation(mood, sleep),
+        'mood_drops': detect_drops(mood, window),
+        'longest_streak': longest,
+        'current_streak': current,
+    }
+
+
+def to_list(values, digits=2):
+    """Rounded floats with None for NaN, converted by NumPy"""
+    rounded = np.round(values, digits).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+def analyze_users(user_ids, start, end, window=7):
+    """Trend analytics for a batch of users between two dates, keyed by user id"""
+    days = (end - start).days + 1
+    mood = build_grid(*load_series(Humeur, 'niveau', user_ids, start, end), user_ids, start, days)
+    sleep = build_grid(*load_series(Sommeil, 'dureeHeures', user_ids, start, end), user_ids, start, days)
+    metrics = compute_metrics(mood, sleep, window)
+
+    dates = [(start + datetime.timedelta(days=offset)).isoformat() for offset in range(days)]
+    results = {}
+    for row, user_id in enumerate(user_ids):
+        correlation_value = metrics['mood_sleep_correlation'][row]
+        results[user_id] = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'window': window,
+            'dates': dates,
+            'mood_moving_average': to_list(metrics['mood_moving_average'][row]),
+            'sleep_moving_average': to_list(metrics['sleep_moving_average'][row]),
+            'mood_sleep_correlation': None if np.isnan(correlation_value) else round(float(correlation_value), 3),
+            'mood_drops': [dates[day] for day in np.flatnonzero(metrics['mood_drops'][row])],
+            'streaks': {
+                'current': int(metrics['current_streak'][row]),
+                'longest': int(metrics['longest_streak'][row]),
+            },
+        }
+    return results
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Tombstones for deleted synced rows, profile cache invalidation,
+        # conversation summaries, versions of the HTTP cached lists
+        from . import conversations, httpcache, profiles, sync  # noqa: F401
@@ -0,0 +1,151 @@
+# core/authentication.py - Signed bearer tokens for the API
+#
+# Tokens are signed with SECRET_KEY (django.core.signing) and carry the user
+# id and user_type, so a request is authenticated without reading the session
+# table. Access tokens are short lived; a refresh token buys a new pair.
+# Revocations are stored in the database, so every worker sees them and they
+# survive restarts: a RevokedToken row per revoked token until it would have
+# expired anyway (prune_revoked_tokens deletes the older ones), and
+# User.tokens_revoked_before for "log out everywhere". Checking both is one
+# indexed query per request.
+import datetime
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import Exists
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+
+from .models import RevokedToken, User
+
+ACCESS_SALT = 'core.authentication.access'
+REFRESH_SALT = 'core.authentication.refresh'
+
+
+def token_settings():
+    return (
+        getattr(settings, 'HEALME_ACCESS_TOKEN_TTL', 15 * 60),
+        getattr(settings, 'HEALME_REFRESH_TOKEN_TTL', 14 * 24 * 60 * 60),
+    )
+
+
+def issue_tokens(user):
+    """New access and refresh tokens for the user"""
+    access_ttl, _ = token_settings()
+    claims = {'uid': user.pk, 'typ': user.user_type, 'iat': time.time()}
+    return {
+        'access': signing.dumps({**claims, 'jti': uuid.uuid4().hex}, salt=ACCESS_SALT),
+        'refresh': signing.dumps({**claims, 'jti': uuid.uuid4().hex}, salt=REFRESH_SALT),
+        'token_type': 'Bearer',
+        'expires_in': access_ttl,
+    }
+
+
+def read_token(token, salt):
+    """Return the claims of a valid, unrevoked token, raises AuthenticationFailed otherwise"""
+    access_ttl, refresh_ttl = token_settings()
+    try:
+        claims = signing.loads(token, salt=salt, max_age=access_ttl if salt == ACCESS_SALT else refresh_ttl)
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed('Token expired.')
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+
+    # One query for both revocations; tokens of deleted or inactive users are refused too
+    user = User.objects.filter(pk=claims['uid'], is_active=True).annotate(
+        revoked=Exists(RevokedToken.objects.filter(jti=claims['jti']))
+    ).values('revoked', 'tokens_revoked_before').first()
+    if user is None:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    revoked_before = user['tokens_revoked_before']
+    if user['revoked'] or (revoked_before is not None and claims['iat'] <= revoked_before.timestamp()):
+        raise exceptions.AuthenticationFailed('Token revoked.')
+    return claims
+
+
+def revoke_token(claims, salt):
+    """Revoke the token, False if it already was"""
+    access_ttl, refresh_ttl = token_settings()
+    lifetime = access_ttl if salt == ACCESS_SALT else refresh_ttl
+    expires_at = datetime.datetime.fromtimestamp(claims['iat'] + lifetime, tz=datetime.timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=claims['jti'], expires_at=expires_at)
+    except IntegrityError:
+        return False
+    return True
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to the user so far (log out everywhere)"""
+    User.objects.filter(pk=user_id).update(tokens_revoked_before=timezone.now())
+
+
+def refresh_tokens(refresh_token):
+    """Trade a refresh token for a new pair, the old refresh token is revoked"""
+    claims = read_token(refresh_token, REFRESH_SALT)
+    # Revoking is the claim: of two refreshes with the same token only one
+    # inserts the row, on any worker
+    if not revoke_token(claims, REFRESH_SALT):
+        raise exceptions.AuthenticationFailed('Token revoked.')
+    # Deleted and deactivated accounts stop here, a new user_type goes in the new tokens
+    user = User.objects.filter(pk=claims['uid'], is_active=True).first()
+    if user is None:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return issue_tokens(user)
+
+
+class TokenUser:
+    """
+    request.user of token requests. id and user_type come from the token, any
+    other attribute loads the User row on first use.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.id = self.pk = claims['uid']
+        self.user_type = claims['typ']
+        self.claims = claims
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_user':
+            raise AttributeError(name)
+        if '_user' not in self.__dict__:
+            self._user = User.objects.get(pk=self.id)
+        return getattr(self._user, name)
+
+    def __str__(self):
+        return f"TokenUser {self.id}"
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """Authorization: Bearer <access token from /api/token/>"""
+    keyword = 'Bearer'
+
+    def bearer_header(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if header and header[0].lower() == self.keyword.lower().encode():
+            return header
+        return None
+
+    def authenticate(self, request):
+        header = self.bearer_header(request)
+        if header is None:
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Invalid Authorization header.')
+
+        try:
+            token = header[1].decode()
+        except UnicodeDecodeError:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        claims = read_token(token, ACCESS_SALT)
+        return TokenUser(claims), claims
+
+    def authenticate_header(self, request):
+        # 401 for token clients, the others keep the 403 of session auth
+        return self.keyword if self.bearer_header(request) else None
@@ -0,0 +1,76 @@
+# core/bulk.py - Bulk writes of Journal/Humeur/Sommeil entries
+#
+# Offline clients replay a batch of entries in one request. The entries are
+# written with one bulk_create (and one bulk_update when upserting) inside a
+# single transaction instead of an INSERT per request.
+#
+# Several entries may share a day (two moods on a Monday), so nothing in the
+# schema makes (patient, date) unique. Upserts lock the patients' User rows
+# before matching the existing entries instead: concurrent or retried
+# batches for a patient run one after the other and see each other's rows.
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SyncCounter
+from .rollups import lock_patients
+
+
+def bulk_save_entries(model, items, upsert=False):
+    """
+    Save validated entries, items being (index, validated_data) pairs.
+
+    With upsert, an entry replaces the existing entry of the same patient and
+    date (the latest one if there are several), and later items of the batch
+    replace earlier ones for the same day. Returns the per-item results and
+    the (patient id, date) pairs that changed.
+    """
+    keys = {(data['patient'].pk, data['date']) for _, data in items}
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    with transaction.atomic():
+        existing = {}
+        if upsert and keys:
+            lock_patients({patient_id for patient_id, _ in keys})
+            matches = model.objects.filter(
+                patient_id__in={patient_id for patient_id, _ in keys},
+                date__in={day for _, day in keys}
+            ).order_by('id')
+            for instance in matches:
+                existing[instance.patient_id, instance.date] = instance
+
+        created, updated, results = [], {}, []
+        for index, data in items:
+            key = (data['patient'].pk, data['date'])
+            instance = existing.get(key) if upsert else None
+            if instance is None:
+                instance = model(**data)
+                created.append(instance)
+                status = 'created'
+            else:
+                for field, value in data.items():
+                    setattr(instance, field, value)
+                if instance.pk is not None:
+                    updated[instance.pk] = instance
+                status = 'updated'
+            existing[key] = instance
+            results.append((index, status, instance))
+
+        # bulk_create/bulk_update skip save(): number the rows for sync here,
+        # once they are written as the counter is the last lock (see SyncCounter)
+        written = created + list(updated.values())
+        now = timezone.now()
+        for instance in written:
+            instance.updated_at = now
+        model.objects.bulk_create(created)
+        if updated:
+            model.objects.bulk_update(list(updated.values()), fields)
+        if written:
+            last = SyncCounter.allocate(len(written))
+            for seq, instance in enumerate(written, start=last - len(written) + 1):
+                instance.change_seq = seq
+            model.objects.bulk_update(written, ['change_seq'])
+
+    results = [
+        {'index': index, 'status': status, 'id': instance.pk}
+        for index, status, instance in results
+    ]
+    return results, keys
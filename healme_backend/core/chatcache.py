@@ -0,0 +1,230 @@
+# core/chatcache.py - Reuse of AI chat replies for repeated short messages
+#
+# Much of the chat traffic is the same few short messages ("I feel anxious",
+# "I can't sleep"). Replies are kept in an in-process LRU (HEALME_CHAT_CACHE_SIZE
+# entries, HEALME_CHAT_CACHE_TTL seconds) keyed by the normalised message:
+# case, accents, punctuation and spacing do not matter. Messages longer than
+# HEALME_CHAT_CACHE_MAX_CHARS are never cached.
+#
+# With HEALME_CHAT_CACHE_SIMILARITY set (0.9 is a good start, 0 turns it off)
+# a miss also looks for a near duplicate: each message is a hashed vector of
+# its words and character trigrams, compared by cosine similarity against
+# every cached message at once with NumPy. Messages that differ in a negation
+# ("I feel anxious" / "I don't feel anxious") never match.
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .llm import agenerate_text, generate_text
+from .prompts import build_chat_prompt
+
+VECTOR_SIZE = 512
+NEGATIONS = frozenset({
+    'not', 'no', 'never', 'nothing', 'nobody', 'dont', 'doesnt', 'didnt', 'cant', 'cannot',
+    'wont', 'isnt', 'arent', 'wasnt', 'havent', 'ne', 'pas', 'jamais', 'rien', 'personne', 'plus',
+})
+
+
+def normalize(text):
+    """Lower case words without accents or punctuation ("I can't  sleep!" -> "i cant sleep")"""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"['’`]", '', text)
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def features(key):
+    """Words and character trigrams of a normalised message"""
+    words = key.split()
+    padded = f' {key} '
+    return words + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def embed(key):
+    """Unit vector of the hashed features (feature hashing, no model needed)"""
+    vector = np.zeros(VECTOR_SIZE, dtype=np.float32)
+    for feature in features(key):
+        # hash() is salted per process, the vectors never leave it
+        vector[hash(feature) % VECTOR_SIZE] += 1
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def negations(key):
+    return NEGATIONS.intersection(key.split())
+
+
+class ChatReplyCache:
+    def __init__(self, max_entries=1000, ttl=3600, max_chars=280, similarity=0.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.similarity = similarity
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> (expires, reply, slot in the vector matrix)
+        self.entries = OrderedDict()
+        self.vectors = np.zeros((max(max_entries, 1), VECTOR_SIZE), dtype=np.float32)
+        self.slot_keys = [None] * max(max_entries, 1)
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.stats = dict.fromkeys((
+            'exact_hits', 'similar_hits', 'misses', 'bypassed', 'stored', 'evicted', 'expired',
+        ), 0)
+        self.lookup_time = 0.0
+        self.lookup_max = 0.0
+        self.lookups = 0
+        self.miss_time = 0.0
+
+    def cacheable(self, message):
+        return self.max_entries > 0 and len(message) <= self.max_chars
+
+    def drop(self, key):
+        _, _, slot = self.entries.pop(key)
+        self.vectors[slot] = 0
+        self.slot_keys[slot] = None
+        self.free_slots.append(slot)
+
+    def live_reply(self, key, now):
+        """Reply stored under this key, expired entries are dropped"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            self.drop(key)
+            self.stats['expired'] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def find_similar(self, key, now):
+        if not self.similarity or not self.entries:
+            return None
+        scores = self.vectors @ embed(key)
+        for slot in np.argsort(scores)[::-1]:
+            if scores[slot] < self.similarity:
+                break
+            other = self.slot_keys[slot]
+            if other is None or negations(other) != negations(key):
+                continue
+            # An expired match does not hide the next best one
+            reply = self.live_reply(other, now)
+            if reply is not None:
+                return reply
+        return None
+
+    def get(self, message):
+        """The cached reply to this message or a near duplicate, None on a miss"""
+        if not self.cacheable(message):
+            with self.lock:
+                self.stats['bypassed'] += 1
+            return None
+
+        started = time.perf_counter()
+        key = normalize(message)
+        with self.lock:
+            now = self.clock()
+            kind, reply = 'exact_hits', self.live_reply(key, now)
+            if reply is None:
+                kind, reply = 'similar_hits', self.find_similar(key, now)
+            self.stats[kind if reply is not None else 'misses'] += 1
+            elapsed = time.perf_counter() - started
+            self.lookups += 1
+            self.lookup_time += elapsed
+            self.lookup_max = max(self.lookup_max, elapsed)
+        return reply
+
+    def set(self, message, reply):
+        if not self.cacheable(message) or not reply:
+            return
+        key = normalize(message)
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            while not self.free_slots:
+                self.drop(next(iter(self.entries)))
+                self.stats['evicted'] += 1
+            slot = self.free_slots.pop()
+            self.vectors[slot] = embed(key) if self.similarity else 0
+            self.slot_keys[slot] = key
+            self.entries[key] = (self.clock() + self.ttl, reply, slot)
+            self.stats['stored'] += 1
+
+    def record_miss_time(self, seconds):
+        with self.lock:
+            self.miss_time += seconds
+
+    def metrics(self):
+        with self.lock:
+            hits = self.stats['exact_hits'] + self.stats['similar_hits']
+            looked_up = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self.entries),
+                'hit_rate': round(hits / looked_up, 3) if looked_up else None,
+                'lookup_avg_us': round(self.lookup_time / self.lookups * 1e6, 1) if self.lookups else None,
+                'lookup_max_us': round(self.lookup_max * 1e6, 1),
+                # Time of the LLM calls the hits saved, estimated from the misses
+                'miss_avg_ms': round(self.miss_time / self.stats['misses'] * 1000, 1) if self.stats['misses'] else None,
+            }
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self.drop(key)
+
+
+_chat_cache = None
+_chat_cache_lock = threading.Lock()
+
+
+def get_chat_cache():
+    global _chat_cache
+    if _chat_cache is None:
+        with _chat_cache_lock:
+            if _chat_cache is None:
+                _chat_cache = ChatReplyCache(
+                    max_entries=getattr(settings, 'HEALME_CHAT_CACHE_SIZE', 1000),
+                    ttl=getattr(settings, 'HEALME_CHAT_CACHE_TTL', 3600),
+                    max_chars=getattr(settings, 'HEALME_CHAT_CACHE_MAX_CHARS', 280),
+                    similarity=getattr(settings, 'HEALME_CHAT_CACHE_SIMILARITY', 0.0),
+                )
+    return _chat_cache
+
+
+def set_chat_cache(chat_cache):
+    """Use this cache, None builds a new one from the settings"""
+    global _chat_cache
+    with _chat_cache_lock:
+        _chat_cache = chat_cache
+
+
+def chat_reply(user_message):
+    """Reply to a chat message, from the cache when possible. Returns (reply, cached)"""
+    chat_cache = get_chat_cache()
+    reply = chat_cache.get(user_message)
+    if reply is not None:
+        return reply, True
+    started = time.perf_counter()
+    reply = generate_text(build_chat_prompt(user_message))
+    if chat_cache.cacheable(user_message):
+        chat_cache.record_miss_time(time.perf_counter() - started)
+    chat_cache.set(user_message, reply)
+    return reply, False
+
+
+async def achat_reply(user_message):
+    chat_cache = get_chat_cache()
+    reply = chat_cache.get(user_message)
+    if reply is not None:
+        return reply, True
+    started = time.perf_counter()
+    reply = await agenerate_text(build_chat_prompt(user_message))
+    if chat_cache.cacheable(user_message):
+        chat_cache.record_miss_time(time.perf_counter() - started)
+    chat_cache.set(user_message, reply)
+    return reply, False
@@ -0,0 +1,56 @@
+# core/consumers.py - WebSocket endpoint for live conversation updates
+import asyncio
+import json
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .pubsub import conversation_channel, get_pubsub
+
+CONVERSATION_PATH = re.compile(r'^/ws/conversation/(?P<patient_id>\d+)/(?P<therapist_id>\d+)/$')
+
+
+async def conversation_socket(scope, receive, send):
+    """
+    ASGI websocket app: ws/conversation/<patient_id>/<therapist_id>/
+    Every message sent in the conversation is pushed as a JSON text frame.
+    """
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = CONVERSATION_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    subscription = get_pubsub().subscribe(
+        conversation_channel(match['patient_id'], match['therapist_id'])
+    )
+    await send({'type': 'websocket.accept'})
+
+    receive_task = asyncio.ensure_future(receive())
+    publish_task = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {receive_task, publish_task},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if publish_task in done:
+                await send({
+                    'type': 'websocket.send',
+                    'text': json.dumps(publish_task.result(), cls=DjangoJSONEncoder)
+                })
+                publish_task = asyncio.ensure_future(subscription.get())
+
+            if receive_task in done:
+                # Frames sent by the client are ignored, we only watch for disconnects
+                if receive_task.result()['type'] == 'websocket.disconnect':
+                    break
+                receive_task = asyncio.ensure_future(receive())
+    finally:
+        subscription.close()
+        receive_task.cancel()
+        publish_task.cancel()
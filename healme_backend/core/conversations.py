@@ -0,0 +1,143 @@
+# core/conversations.py - Unread badges and last messages of conversations
+#
+# Each patient/therapist conversation has two ConversationSummary rows, one
+# per side. Sending a message bumps the reader's unread_count with an F()
+# update in the sender's transaction; marking messages read locks the
+# messages and then the reader's row, marks them and subtracts the number
+# marked. Updates and deletes of single messages recompute the conversation
+# from the table.
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .httpcache import bump_versions, inbox_scope
+from .models import ConversationSummary, Message, Patient, SyncCounter
+
+SIDES = ('patient', 'therapeute')
+PREVIEW_LENGTH = 100
+
+
+def other_side(side):
+    return 'therapeute' if side == 'patient' else 'patient'
+
+
+def last_message_fields(message):
+    if message is None:
+        return {'last_message': None, 'last_message_preview': '', 'last_sender_type': None, 'last_activity': None}
+    return {
+        'last_message': message,
+        'last_message_preview': message.contenu[:PREVIEW_LENGTH],
+        'last_sender_type': message.sender_type,
+        'last_activity': message.date,
+    }
+
+
+def inbox_changed(patient_id):
+    """New ETag for the patient's therapist list (see core/httpcache.py)"""
+    user_id = Patient.objects.filter(pk=patient_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        bump_versions(inbox_scope(user_id))
+
+
+def summary_rows(patient_id, therapist_id):
+    return ConversationSummary.objects.filter(patient_id=patient_id, therapeute_id=therapist_id)
+
+
+def record_message(message):
+    """Count a new message in both summaries of its conversation"""
+    fields = last_message_fields(message)
+    with transaction.atomic():
+        for side in SIDES:
+            unread = 1 if side != message.sender_type else 0
+            rows = summary_rows(message.patient_id, message.therapeute_id).filter(side=side)
+            if rows.update(unread_count=F('unread_count') + unread, **fields):
+                continue
+            try:
+                with transaction.atomic():
+                    ConversationSummary.objects.create(
+                        patient_id=message.patient_id, therapeute_id=message.therapeute_id,
+                        side=side, unread_count=unread, **fields
+                    )
+            except IntegrityError:
+                # Created by a concurrent first message
+                rows.update(unread_count=F('unread_count') + unread, **fields)
+    inbox_changed(message.patient_id)
+
+
+def refresh_summaries(patient_id, therapist_id, create=True):
+    """
+    Recompute both summaries of a conversation from the message table.
+    Deletes only update existing rows: in a cascade the summaries may already
+    be gone with the patient or therapist.
+    """
+    messages = Message.objects.filter(patient_id=patient_id, therapeute_id=therapist_id)
+    fields = last_message_fields(messages.order_by('-date', '-id').first())
+    with transaction.atomic():
+        for side in SIDES:
+            rows = summary_rows(patient_id, therapist_id).filter(side=side)
+            if fields['last_message'] is None:
+                rows.delete()
+                continue
+            values = {
+                'unread_count': messages.filter(sender_type=other_side(side), is_read=False).count(),
+                **fields,
+            }
+            if not rows.update(**values) and create:
+                ConversationSummary.objects.create(
+                    patient_id=patient_id, therapeute_id=therapist_id, side=side, **values
+                )
+    inbox_changed(patient_id)
+
+
+def mark_read(patient_id, therapist_id, reader, up_to=None):
+    """
+    Mark the messages the reader received in the conversation as read, up to
+    a message id if given. Returns (messages marked, unread left).
+    """
+    with transaction.atomic():
+        # Message rows, then the summary, then the sync counter (see SyncCounter)
+        unread = Message.objects.filter(
+            patient_id=patient_id, therapeute_id=therapist_id,
+            sender_type=other_side(reader), is_read=False
+        )
+        if up_to is not None:
+            unread = unread.filter(id__lte=up_to)
+        messages = list(unread.select_for_update().order_by('id').only('id'))
+
+        summary = summary_rows(patient_id, therapist_id).select_for_update().filter(side=reader).first()
+        if summary is None:
+            return 0, 0
+        if not messages:
+            return 0, summary.unread_count
+
+        summary.unread_count = max(summary.unread_count - len(messages), 0)
+        summary.save(update_fields=['unread_count'])
+        inbox_changed(patient_id)
+
+        # One UPDATE for all of them, on rows locked above; they still get
+        # their own sync numbers, taken last
+        last = SyncCounter.allocate(len(messages))
+        now = timezone.now()
+        for seq, message in enumerate(messages, start=last - len(messages) + 1):
+            message.is_read, message.change_seq, message.updated_at = True, seq, now
+        Message.objects.bulk_update(messages, ['is_read', 'change_seq', 'updated_at'])
+        return len(messages), summary.unread_count
+
+
+def message_saved(sender, instance, created, **kwargs):
+    if not (instance.patient_id and instance.therapeute_id):
+        return
+    if created:
+        record_message(instance)
+    else:
+        refresh_summaries(instance.patient_id, instance.therapeute_id)
+
+
+def message_deleted(sender, instance, **kwargs):
+    if instance.patient_id and instance.therapeute_id:
+        refresh_summaries(instance.patient_id, instance.therapeute_id, create=False)
+
+
+post_save.connect(message_saved, sender=Message, dispatch_uid='conversation_summary_save')
+post_delete.connect(message_deleted, sender=Message, dispatch_uid='conversation_summary_delete')
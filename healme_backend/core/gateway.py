@@ -0,0 +1,466 @@
+# core/gateway.py - Limits in front of the LLM client
+#
+# Every LLM call made through core.llm goes through one LLMGateway per process:
+#
+# - single flight: concurrent calls with the same prompt share one Gemini call
+#   (a double tap, two dashboards of the same user loading together)
+# - a token bucket caps the call rate (HEALME_LLM_RATE per second, bursts of
+#   HEALME_LLM_BURST), a slot limit caps the calls running at once
+#   (HEALME_LLM_MAX_CONCURRENCY); callers wait up to HEALME_LLM_QUEUE_TIMEOUT
+#   for both, then get LLMRateLimited
+# - each call gets HEALME_LLM_TIMEOUT seconds
+# - after HEALME_LLM_BREAKER_FAILURES failures in a row (errors or timeouts)
+#   the circuit opens: calls fail fast with LLMCircuitOpen for
+#   HEALME_LLM_BREAKER_RESET seconds, then one trial call decides whether it
+#   closes again
+#
+# metrics() gives the counters, latencies and circuit state.
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+
+class LLMUnavailable(Exception):
+    """The gateway did not get an answer from the LLM, retry after `retry_after` seconds"""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimited(LLMUnavailable):
+    pass
+
+
+class LLMCircuitOpen(LLMUnavailable):
+    pass
+
+
+class LLMTimeout(LLMUnavailable):
+    pass
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `capacity` saved for bursts"""
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token, returns how long to wait before using it, or None (and
+        nothing taken) if that is more than max_wait
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            # Waiting callers hold their token in advance, in arrival order
+            self.tokens -= 1
+            return wait
+
+
+class ConcurrencyLimit:
+    """Counting semaphore usable from threads and event loops alike
+
+    Waiters queue in arrival order; release() hands its slot straight to the
+    first one, waking a thread with an event or a coroutine through its loop.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.lock = threading.Lock()
+        self.waiters = deque()
+
+    def try_acquire(self):
+        with self.lock:
+            return self.take_free_slot()
+
+    def take_free_slot(self):
+        # Called with the lock held; queued waiters go first
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        return False
+
+    def acquire(self, timeout):
+        with self.lock:
+            if self.take_free_slot():
+                return True
+            waiter = SlotWaiter(event=threading.Event())
+            self.waiters.append(waiter)
+        if waiter.event.wait(timeout):
+            return True
+        return self.leave_queue(waiter)
+
+    async def aacquire(self, timeout):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.take_free_slot():
+                return True
+            waiter = SlotWaiter(loop=loop, future=loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.leave_queue(waiter)
+        except asyncio.CancelledError:
+            if self.leave_queue(waiter):
+                self.release()
+            raise
+
+    def leave_queue(self, waiter):
+        """Gives up waiting; True if a slot was handed over in the meantime"""
+        with self.lock:
+            if waiter.granted:
+                return True
+            self.waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self.lock:
+            if not self.waiters:
+                self.active -= 1
+                return
+            # The slot passes to the first waiter, active stays the same
+            waiter = self.waiters.popleft()
+            waiter.granted = True
+        if waiter.event is not None:
+            waiter.event.set()
+            return
+        try:
+            waiter.loop.call_soon_threadsafe(resolve_waiter, waiter.future)
+        except RuntimeError:
+            # Its loop is closed, nobody will take the slot: pass it on
+            self.release()
+
+
+class SlotWaiter:
+    __slots__ = ('event', 'loop', 'future', 'granted')
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+
+def resolve_waiter(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Raise LLMCircuitOpen unless a call may go through now"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self.trial_running:
+                # One trial call, the others keep failing fast until it is done
+                self.trial_running = True
+                return
+            retry_after = max(1, round(self.reset_timeout - (self.clock() - self.opened_at)))
+            raise LLMCircuitOpen('The AI service is unavailable, try again later.', retry_after=retry_after)
+
+    def cancel(self):
+        """The call allowed last did not run (rate limited)"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class LLMGateway:
+    def __init__(self, rate=10, burst=20, max_concurrency=16, timeout=30, queue_timeout=10,
+                 failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.slots = ConcurrencyLimit(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, clock)
+        # Runs the blocking client calls so callers can stop waiting on time
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='healme-llm')
+        self.lock = threading.Lock()
+        self.inflight = {}
+        # Async calls only share work within their event loop
+        self.loop_inflight = weakref.WeakKeyDictionary()
+        self.counters = dict.fromkeys((
+            'requests', 'calls', 'coalesced', 'succeeded', 'failed', 'timeouts',
+            'rate_limited', 'circuit_rejected', 'streams',
+        ), 0)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latency_total += seconds
+            self.latency_max = max(self.latency_max, seconds)
+
+    def metrics(self):
+        with self.lock:
+            calls = self.counters['calls'] + self.counters['streams']
+            return {
+                **self.counters,
+                'in_flight': self.slots.active,
+                'latency_avg_ms': round(self.latency_total / calls * 1000, 1) if calls else None,
+                'latency_max_ms': round(self.latency_max * 1000, 1),
+                'circuit': self.breaker.state,
+            }
+
+    @staticmethod
+    def key(prompt):
+        return hashlib.sha256(str(prompt).encode()).hexdigest()
+
+    def admit(self):
+        """Breaker and rate limit checks, returns the wait before calling"""
+        try:
+            self.breaker.allow()
+        except LLMCircuitOpen:
+            self.count('circuit_rejected')
+            raise
+        wait = self.bucket.reserve(self.queue_timeout)
+        if wait is None:
+            self.breaker.cancel()
+            self.count('rate_limited')
+            raise LLMRateLimited('Too many AI requests, try again shortly.', retry_after=self.queue_timeout)
+        return wait
+
+    def no_slot(self):
+        self.breaker.cancel()
+        self.count('rate_limited')
+        return LLMRateLimited('Too many AI requests in progress, try again shortly.', retry_after=self.queue_timeout)
+
+    def finished(self, started, error=None):
+        self.record_latency(time.monotonic() - started)
+        if error is None:
+            self.count('succeeded')
+            self.breaker.record_success()
+        else:
+            self.count('timeouts' if isinstance(error, LLMTimeout) else 'failed')
+            self.breaker.record_failure()
+
+    def generate(self, prompt, call):
+        """Run call() (a blocking LLM call for this prompt) through the limits"""
+        self.count('requests')
+        key = self.key(prompt)
+        with self.lock:
+            shared = self.inflight.get(key)
+            if shared is None:
+                shared = self.inflight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            self.count('coalesced')
+            try:
+                return shared.result(timeout=self.timeout + self.queue_timeout)
+            except FutureTimeoutError:
+                raise LLMTimeout('The AI service took too long to answer.')
+
+        try:
+            result = self.call(call)
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def call(self, call):
+        time.sleep(self.admit())
+        if not self.slots.acquire(self.queue_timeout):
+            raise self.no_slot()
+
+        self.count('calls')
+        started = time.monotonic()
+        task = self.executor.submit(call)
+        # The slot is held until the client call really ends, even after a timeout
+        task.add_done_callback(lambda _: self.slots.release())
+        try:
+            result = task.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            error = LLMTimeout('The AI service took too long to answer.')
+            self.finished(started, error)
+            raise error
+        except Exception as e:
+            self.finished(started, e)
+            raise
+        self.finished(started)
+        return result
+
+    async def agenerate(self, prompt, call):
+        """Async generate(), call() returns the awaitable of the LLM call"""
+        self.count('requests')
+        loop = asyncio.get_running_loop()
+        key = self.key(prompt)
+        with self.lock:
+            inflight = self.loop_inflight.setdefault(loop, {})
+            shared = inflight.get(key)
+            if shared is None:
+                shared = inflight[key] = loop.create_task(self.acall(call))
+                shared.add_done_callback(functools.partial(self.forget, inflight, key))
+            else:
+                self.counters['coalesced'] += 1
+        # A caller going away must not cancel the call of the others
+        return await asyncio.shield(shared)
+
+    def forget(self, inflight, key, task):
+        with self.lock:
+            inflight.pop(key, None)
+        if not task.cancelled():
+            # Retrieved here so an unawaited failure is not logged as lost
+            task.exception()
+
+    async def acall(self, call):
+        await asyncio.sleep(self.admit())
+        if not await self.slots.aacquire(self.queue_timeout):
+            raise self.no_slot()
+
+        self.count('calls')
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            error = LLMTimeout('The AI service took too long to answer.')
+            self.finished(started, error)
+            raise error
+        except Exception as e:
+            self.finished(started, e)
+            raise
+        finally:
+            self.slots.release()
+        self.finished(started)
+        return result
+
+    @contextmanager
+    def stream(self):
+        """
+        Limits around a streamed reply: the slot is held until the stream is
+        closed. Streams are not coalesced and have no overall timeout.
+        """
+        self.count('requests')
+        time.sleep(self.admit())
+        if not self.slots.acquire(self.queue_timeout):
+            raise self.no_slot()
+        self.count('streams')
+        started = time.monotonic()
+        try:
+            yield
+        except GeneratorExit:
+            # Consumer went away, not the service's fault
+            self.record_latency(time.monotonic() - started)
+            raise
+        except Exception as e:
+            self.finished(started, e)
+            raise
+        else:
+            self.finished(started)
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def astream(self):
+        self.count('requests')
+        await asyncio.sleep(self.admit())
+        if not await self.slots.aacquire(self.queue_timeout):
+            raise self.no_slot()
+        self.count('streams')
+        started = time.monotonic()
+        try:
+            yield
+        except (GeneratorExit, asyncio.CancelledError):
+            self.record_latency(time.monotonic() - started)
+            raise
+        except Exception as e:
+            self.finished(started, e)
+            raise
+        else:
+            self.finished(started)
+        finally:
+            self.slots.release()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def build_gateway():
+    return LLMGateway(
+        rate=getattr(settings, 'HEALME_LLM_RATE', 10),
+        burst=getattr(settings, 'HEALME_LLM_BURST', 20),
+        max_concurrency=getattr(settings, 'HEALME_LLM_MAX_CONCURRENCY', 16),
+        timeout=getattr(settings, 'HEALME_LLM_TIMEOUT', 30),
+        queue_timeout=getattr(settings, 'HEALME_LLM_QUEUE_TIMEOUT', 10),
+        failure_threshold=getattr(settings, 'HEALME_LLM_BREAKER_FAILURES', 5),
+        reset_timeout=getattr(settings, 'HEALME_LLM_BREAKER_RESET', 30),
+    )
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = build_gateway()
+    return _gateway
+
+
+def set_gateway(gateway):
+    """Use this gateway, None builds a new one from the settings"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
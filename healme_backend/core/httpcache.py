@@ -0,0 +1,218 @@
+# core/httpcache.py - ETag/Last-Modified for the dashboard lists
+#
+# Each cached list depends on a few data scopes ("mood:12", "patients",
+# "inbox:3"...). A scope's version is a DataVersion row, changed in the
+# writing transaction (signals for single rows, explicit calls for bulk
+# updates), so every worker sees it when the write commits and it survives
+# restarts and cache evictions. The `conditional` decorator turns the
+# versions of a request into an ETag and a Last-Modified date with one
+# primary key lookup, and answers If-None-Match/If-Modified-Since with a 304
+# before the view runs. Optionally the response data is kept in a small
+# in-process LRU keyed by the ETag, so repeat loads by clients without a copy
+# skip the queries and serializers too.
+#
+# The versions change when the primary commits, so they are read from the
+# primary and a conditional response is always built from it: a lagging
+# replica would put old rows under the new ETag.
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import DataVersion, Humeur, Journal, Patient, Sommeil, Therapeute, User
+from .routers import stop_replica_reads
+
+# Kind of the per-user history scopes, as in insights.INSIGHT_MODELS
+ENTRY_SCOPES = {Humeur: 'mood', Sommeil: 'sleep', Journal: 'journal'}
+
+
+def entries_scope(kind, user_id):
+    return f"{kind}:{user_id}"
+
+
+def inbox_scope(user_id):
+    """Conversation summaries of the patient with this user id (therapist list badges)"""
+    return f"inbox:{user_id}"
+
+
+def user_entries(kind):
+    """Scopes of the history views taking a user_id"""
+    def scopes(request, user_id, *args, **kwargs):
+        return [entries_scope(kind, user_id)]
+    return scopes
+
+
+def get_versions(scopes):
+    """
+    (version, change timestamp) of each scope, read from the primary. A
+    scope without a row yet starts now.
+    """
+    rows = DataVersion.objects.using(DEFAULT_DB_ALIAS)
+    versions = {
+        scope: (version, changed_at.timestamp())
+        for scope, version, changed_at in rows.filter(scope__in=scopes).values_list('scope', 'version', 'changed_at')
+    }
+    missing = [scope for scope in scopes if scope not in versions]
+    if missing:
+        now = timezone.now()
+        rows.bulk_create(
+            [DataVersion(scope=scope, version=uuid.uuid4().hex, changed_at=now) for scope in missing],
+            ignore_conflicts=True,
+        )
+        versions.update(
+            (scope, (version, changed_at.timestamp()))
+            for scope, version, changed_at in rows.filter(scope__in=missing).values_list('scope', 'version', 'changed_at')
+        )
+    return [versions[scope] for scope in scopes]
+
+
+def bump_versions(*scopes):
+    """Mark the scopes as changed, in the writing transaction (see SyncCounter for the lock order)"""
+    now = timezone.now()
+    DataVersion.objects.bulk_create(
+        [DataVersion(scope=scope, version=uuid.uuid4().hex, changed_at=now) for scope in sorted(set(scopes))],
+        update_conflicts=True, unique_fields=['scope'], update_fields=['version', 'changed_at'],
+    )
+
+
+class ResponseCache:
+    """Thread safe LRU of response data by ETag, entries expire after ttl seconds"""
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, data):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    getattr(settings, 'HEALME_RESPONSE_CACHE_SIZE', 0),
+                    getattr(settings, 'HEALME_RESPONSE_CACHE_TTL', 60),
+                )
+    return _response_cache
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        # Weak comparison, as for GET
+        return etag in {tag.removeprefix('W/') for tag in parse_etags(if_none_match)} or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def conditional(scopes):
+    """
+    Validators for a read-only view. `scopes(request, *args, **kwargs)`
+    returns the data scopes the response is built from (None: not cached).
+    Put it under @api_view so the request is authenticated first. The view
+    reads from the primary, whatever its replica routing.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            names = scopes(request, *args, **kwargs)
+            if names is None:
+                return view(request, *args, **kwargs)
+
+            versions = get_versions(names)
+            user_id = request.user.pk if request.user.is_authenticated else ''
+            raw = '|'.join([
+                view.__qualname__, request.get_full_path(), request.headers.get('Accept', ''),
+                str(user_id), *names, *(version for version, _ in versions)
+            ])
+            etag = '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+            last_modified = max(changed_at for _, changed_at in versions)
+            headers = {
+                'ETag': etag,
+                'Last-Modified': http_date(last_modified),
+                # Stored by the client, revalidated on each use
+                'Cache-Control': 'private, no-cache',
+            }
+
+            if not_modified(request, etag, last_modified):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            stop_replica_reads()
+            response_cache = get_response_cache()
+            data = response_cache.get(etag)
+            if data is not None:
+                return Response(data, headers=headers)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response_cache.set(etag, response.data)
+                for header, value in headers.items():
+                    response[header] = value
+            return response
+        return wrapper
+    return decorator
+
+
+def entry_saved(sender, instance, **kwargs):
+    bump_versions(entries_scope(ENTRY_SCOPES[sender], instance.patient_id))
+
+
+def people_changed(sender, instance, **kwargs):
+    # Logins only touch last_login
+    if kwargs.get('update_fields') and set(kwargs['update_fields']) <= {'last_login'}:
+        return
+    if sender is Patient:
+        bump_versions('patients')
+    elif sender is Therapeute:
+        bump_versions('therapists')
+    else:
+        bump_versions('patients', 'therapists')
+
+
+for model in ENTRY_SCOPES:
+    post_save.connect(entry_saved, sender=model, dispatch_uid=f'http_version_{model.__name__}')
+    post_delete.connect(entry_saved, sender=model, dispatch_uid=f'http_version_delete_{model.__name__}')
+
+for model in (User, Patient, Therapeute):
+    post_save.connect(people_changed, sender=model, dispatch_uid=f'http_version_{model.__name__}')
+    post_delete.connect(people_changed, sender=model, dispatch_uid=f'http_version_delete_{model.__name__}')
@@ -0,0 +1,75 @@
+# core/insights.py - Cache of the Gemini insights shown on the dashboards
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .httpcache import entries_scope, get_versions
+from .llm import generate_text, agenerate_text
+from .models import Humeur, Sommeil, Journal
+from .prompts import INSIGHT_PROMPTS
+
+INSIGHT_MODELS = {
+    'mood': Humeur,
+    'sleep': Sommeil,
+    'journal': Journal,
+}
+
+
+def insight_cache_key(user_id, kind):
+    return f"insight:{kind}:{user_id}"
+
+
+def insight_fingerprint(user_id, kind):
+    """
+    Version of the rows an insight is built from, the DataVersion of the
+    history ETags: every save, delete (admin included) and bulk write changes
+    it in the database, so no worker serves an insight cached before another
+    one's write.
+    """
+    version, _ = get_versions([entries_scope(kind, user_id)])[0]
+    return version
+
+
+def get_cached_insight(user_id, kind, fingerprint):
+    """Return the cached insight text if it was built from the same rows"""
+    cached = cache.get(insight_cache_key(user_id, kind))
+    if cached and cached['fingerprint'] == fingerprint:
+        return cached['text']
+    return None
+
+
+def set_cached_insight(user_id, kind, fingerprint, text):
+    cache.set(
+        insight_cache_key(user_id, kind),
+        {'fingerprint': fingerprint, 'text': text},
+        timeout=getattr(settings, 'HEALME_INSIGHT_CACHE_TTL', 6 * 60 * 60)
+    )
+
+
+def invalidate_insight(user_id, kind):
+    cache.delete(insight_cache_key(user_id, kind))
+
+
+def generate_insight(user_id, kind, fingerprint=None):
+    """Return the insight for a user, only calling the LLM when the cached one is stale"""
+    if fingerprint is None:
+        fingerprint = insight_fingerprint(user_id, kind)
+
+    text = get_cached_insight(user_id, kind, fingerprint)
+    if text is None:
+        text = generate_text(INSIGHT_PROMPTS[kind](user_id))
+        set_cached_insight(user_id, kind, fingerprint, text)
+    return text
+
+
+async def agenerate_insight(user_id, kind, fingerprint=None):
+    """Async generate_insight: the database work runs in a thread, the LLM call on the loop"""
+    if fingerprint is None:
+        fingerprint = await sync_to_async(insight_fingerprint)(user_id, kind)
+
+    text = await sync_to_async(get_cached_insight)(user_id, kind, fingerprint)
+    if text is None:
+        prompt = await sync_to_async(INSIGHT_PROMPTS[kind])(user_id)
+        text = await agenerate_text(prompt)
+        await sync_to_async(set_cached_insight)(user_id, kind, fingerprint, text)
+    return text
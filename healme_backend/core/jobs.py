@@ -0,0 +1,142 @@
+# core/jobs.py - Background queue for slow LLM calls
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .chatcache import chat_reply
+from .insights import generate_insight
+from .models import AIJob
+
+ACTIVE_STATUSES = ('pending', 'running')
+ABANDONED_ERROR = 'Abandoned: no worker finished the job in time'
+
+
+def run_insight_job(job):
+    return generate_insight(job.user_id, job.payload['insight'])
+
+
+def run_chat_reply_job(job):
+    reply, _ = chat_reply(job.payload['message'])
+    return reply
+
+
+JOB_HANDLERS = {
+    'insight': run_insight_job,
+    'chat_reply': run_chat_reply_job,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'HEALME_JOB_WORKERS', 4),
+                    thread_name_prefix='healme-job'
+                )
+    return _executor
+
+
+def stale_cutoff():
+    """Active jobs not updated since then are lost (dispatch lost on a restart, crashed worker)"""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'HEALME_JOB_STALE_SECONDS', 600))
+
+
+def fail_stale_jobs(jobs, statuses=ACTIVE_STATUSES):
+    """Mark the lost jobs among `jobs` as failed, returns how many"""
+    return jobs.filter(status__in=statuses, updated_at__lt=stale_cutoff()).update(
+        status='failed',
+        error=ABANDONED_ERROR,
+        updated_at=timezone.now()
+    )
+
+
+def enqueue_job(kind, payload=None, user_id=None, dedupe_key=''):
+    """
+    Store a job and hand it to the workers once the transaction commits.
+    A job with the same dedupe_key that is still queued or running is returned
+    instead, unless it has not moved for HEALME_JOB_STALE_SECONDS.
+    """
+    if dedupe_key:
+        active = AIJob.objects.filter(dedupe_key=dedupe_key, status__in=ACTIVE_STATUSES)
+        existing = active.filter(updated_at__gte=stale_cutoff()).first()
+        if existing is not None:
+            return existing
+        fail_stale_jobs(active)
+
+    job = AIJob.objects.create(
+        kind=kind,
+        payload=payload or {},
+        user_id=user_id,
+        dedupe_key=dedupe_key
+    )
+    transaction.on_commit(lambda: dispatch_job(job.id))
+    return job
+
+
+def enqueue_insight(user_id, kind):
+    return enqueue_job(
+        'insight',
+        {'insight': kind},
+        user_id=user_id,
+        dedupe_key=f"insight:{kind}:{user_id}"
+    )
+
+
+def dispatch_job(job_id):
+    """
+    HEALME_JOB_MODE picks who runs the job:
+    'thread' - the in-process worker pool (default)
+    'eager' - right away in the caller, for tests
+    'worker' - nobody here, `manage.py run_ai_jobs` picks it up from the database
+    """
+    mode = getattr(settings, 'HEALME_JOB_MODE', 'thread')
+    if mode == 'eager':
+        run_job(job_id)
+    elif mode == 'thread':
+        get_executor().submit(_run_in_thread, job_id)
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # Worker threads must not keep their own database connections open
+        connections.close_all()
+
+
+def run_job(job_id):
+    """Run one pending job, returns False if another worker already claimed it"""
+    claimed = AIJob.objects.filter(id=job_id, status='pending').update(
+        status='running',
+        updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = AIJob.objects.get(id=job_id)
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception as e:
+        AIJob.objects.filter(id=job_id).update(status='failed', error=str(e), updated_at=timezone.now())
+    else:
+        AIJob.objects.filter(id=job_id).update(status='done', result=result, updated_at=timezone.now())
+    return True
+
+
+def run_pending_jobs(limit=None):
+    """Run queued jobs oldest first, returns how many were run"""
+    # Stale pending jobs are still run below, stale running ones had a worker die on them
+    fail_stale_jobs(AIJob.objects.all(), statuses=('running',))
+    job_ids = AIJob.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)
+    if limit is not None:
+        job_ids = job_ids[:limit]
+    return sum(1 for job_id in list(job_ids) if run_job(job_id))
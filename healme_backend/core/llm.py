@@ -0,0 +1,182 @@
+# core/llm.py - Access to the LLM behind the insights and the AI chat
+# (every call goes through the limits of core/gateway.py)
+import asyncio
+import os
+import threading
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from dotenv import load_dotenv
+
+from .gateway import get_gateway
+
+load_dotenv()  # loads the .env file
+
+MODEL_NAME = 'gemini-2.5-flash'
+DEFAULT_CLIENT = 'core.llm.gemini_client'
+
+
+def gemini_client():
+    """The real Gemini client (make sure GEMINI_API_KEY is set in your .env)"""
+    from google import genai
+    return genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModels:
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    def generate_content(self, model, contents, **kwargs):
+        self.prompts.append(contents)
+        return StubResponse(self.reply)
+
+    def generate_content_stream(self, model, contents, **kwargs):
+        # One chunk per word, like the small deltas Gemini streams
+        self.prompts.append(contents)
+        words = self.reply.split(' ')
+        for index, word in enumerate(words):
+            yield StubResponse(word if index == len(words) - 1 else word + ' ')
+
+
+class AsyncStubModels:
+    def __init__(self, models):
+        self._models = models
+
+    async def generate_content(self, model, contents, **kwargs):
+        return self._models.generate_content(model=model, contents=contents, **kwargs)
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        chunks = self._models.generate_content_stream(model=model, contents=contents, **kwargs)
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        return stream()
+
+
+class AsyncStubClient:
+    def __init__(self, models):
+        self.models = AsyncStubModels(models)
+
+
+class StubClient:
+    """
+    Offline stand-in for genai.Client, answers every prompt with the same reply.
+    Select it with HEALME_LLM_CLIENT = 'core.llm.StubClient'.
+    """
+    def __init__(self, reply='Take a short walk and drink a glass of water.'):
+        self.models = StubModels(reply)
+        self.aio = AsyncStubClient(self.models)
+
+
+_client = None
+_client_override = None
+_client_lock = threading.Lock()
+# Async clients keep pooled connections that belong to one event loop
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def build_client():
+    factory = getattr(settings, 'HEALME_LLM_CLIENT', DEFAULT_CLIENT)
+    return import_string(factory)()
+
+
+def get_client():
+    """Return the process-wide client built from HEALME_LLM_CLIENT"""
+    global _client
+    if _client_override is not None:
+        return _client_override
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_client()
+    return _client
+
+
+def get_async_client():
+    """
+    Return the async API (client.aio) for the running event loop.
+    Each loop builds its client once, so concurrent requests on the loop share
+    one connection pool.
+    """
+    if _client_override is not None:
+        return _client_override.aio
+
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        client = _loop_clients[loop] = build_client()
+    return client.aio
+
+
+def set_client(client):
+    """Use this client everywhere (sync and async), None goes back to settings"""
+    global _client_override
+    with _client_lock:
+        _client_override = client
+
+
+def generate_text(prompt):
+    """Reply to the prompt, through the gateway limits (core/gateway.py)"""
+    def call():
+        return get_client().models.generate_content(
+            model=MODEL_NAME,
+            contents=prompt
+        ).text
+
+    return get_gateway().generate(prompt, call)
+
+
+async def agenerate_text(prompt):
+    client = get_async_client()
+
+    async def call():
+        response = await client.models.generate_content(
+            model=MODEL_NAME,
+            contents=prompt
+        )
+        return response.text
+
+    return await get_gateway().agenerate(prompt, call)
+
+
+def stream_text(prompt):
+    """Yield the reply text as Gemini produces it"""
+    with get_gateway().stream():
+        stream = get_client().models.generate_content_stream(
+            model=MODEL_NAME,
+            contents=prompt
+        )
+        try:
+            for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            # Stops the generation when the consumer goes away early
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+
+async def astream_text(prompt):
+    async with get_gateway().astream():
+        stream = await get_async_client().models.generate_content_stream(
+            model=MODEL_NAME,
+            contents=prompt
+        )
+        try:
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+
+from core import llm
+from core.chatcache import ChatReplyCache, set_chat_cache
+from core.gateway import LLMGateway, set_gateway
+
+FAKE_REPLY = {
+    'candidates': [{
+        'content': {'parts': [{'text': 'Take a deep breath.'}], 'role': 'model'},
+        'finishReason': 'STOP',
+        'index': 0,
+    }]
+}
+
+
+class FakeGeminiServer:
+    """
+    Minimal keep-alive HTTP server answering every request like generateContent
+    after a fixed delay, running on its own event loop thread.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.writers = set()
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return f'http://127.0.0.1:{self.port}'
+
+    def stop(self):
+        async def shutdown():
+            self.server.close()
+            # Closing the sockets ends the idle keep-alive handlers
+            for writer in list(self.writers):
+                writer.close()
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*handlers, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, '127.0.0.1', 0, backlog=1024)
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        body = json.dumps(FAKE_REPLY).encode()
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode().partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                await reader.readexactly(length)
+
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(self.latency)
+                self.in_flight -= 1
+
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f'Content-Length: {len(body)}\r\n\r\n'.encode()
+                    + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent AI chat requests against a fake local Gemini server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=200, help='In-flight requests on the async view')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads for the sync baseline')
+        parser.add_argument('--latency', type=float, default=1.0, help='Seconds the fake Gemini takes per call')
+
+    def handle(self, *args, **options):
+        import httpx
+        from google import genai
+        from google.genai import types
+
+        server = FakeGeminiServer(options['latency'])
+        base_url = server.start()
+        try:
+            self.client = genai.Client(
+                api_key='fake-key',
+                http_options=types.HttpOptions(
+                    base_url=base_url,
+                    async_client_args={'limits': httpx.Limits(max_connections=options['concurrency'])}
+                )
+            )
+            llm.set_client(self.client)
+            # Measures the views and the client: no rate limit, no reply cache,
+            # and distinct prompts so nothing is coalesced
+            set_chat_cache(ChatReplyCache(max_entries=0))
+            set_gateway(LLMGateway(
+                rate=1e9, burst=1e9, max_concurrency=max(options['concurrency'], options['threads']), timeout=600
+            ))
+
+            self.stdout.write(
+                f"{options['requests']} chat requests, fake Gemini latency {options['latency'] * 1000:.0f} ms"
+            )
+            self.report('sync view, thread pool', options['threads'], server, self.run_sync, options)
+            self.report('async view, one event loop', options['concurrency'], server, self.run_async, options)
+        finally:
+            llm.set_client(None)
+            set_gateway(None)
+            set_chat_cache(None)
+            self.client.close()
+            server.stop()
+
+    def report(self, label, concurrency, server, runner, options):
+        server.max_in_flight = 0
+        started = time.perf_counter()
+        runner(options)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:<28} concurrency {concurrency:>4}  "
+            f"{options['requests'] / elapsed:8.1f} req/s  "
+            f"max in-flight at Gemini {server.max_in_flight}"
+        )
+
+    def run_sync(self, options):
+        local = threading.local()
+
+        def one(i):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            response = local.client.post(
+                '/api/ai-chat/', {'message': f'I feel anxious ({i})'}, content_type='application/json'
+            )
+            assert response.status_code == 200, response.content
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(one, range(options['requests'])))
+
+    def run_async(self, options):
+        async def scenario():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def one(i):
+                async with semaphore:
+                    response = await client.post(
+                        '/api/aio/ai-chat/', {'message': f'I feel anxious ({i})'}, content_type='application/json'
+                    )
+                    assert response.status_code == 200, response.content
+
+            await asyncio.gather(*(one(i) for i in range(options['requests'])))
+            # Pooled connections belong to this loop, close them before it goes away
+            await self.client.aio.aclose()
+
+        asyncio.run(scenario())
@@ -0,0 +1,152 @@
+import datetime
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core import analytics
+from core.analytics import analyze_users, build_grid, compute_metrics
+from core.models import Humeur, Sommeil, User
+
+
+def python_metrics(moods, sleeps, window):
+    """Per-user loop over dicts, how the metrics would be written without NumPy"""
+    days = sorted(moods)
+    averages = []
+    for day in days:
+        values = [moods[d] for d in range(day - window + 1, day + 1) if d in moods]
+        averages.append(sum(values) / len(values))
+
+    shared = [day for day in days if day in sleeps]
+    correlation = None
+    if len(shared) >= 3:
+        correlation = statistics.correlation([moods[d] for d in shared], [sleeps[d] for d in shared])
+
+    drops = []
+    for day in days:
+        previous = [moods[d] for d in range(day - window, day) if d in moods]
+        if previous and sum(previous) / len(previous) - moods[day] >= 2:
+            drops.append(day)
+
+    longest = current = 0
+    for index, day in enumerate(days):
+        current = current + 1 if index and days[index - 1] == day - 1 else 1
+        longest = max(longest, current)
+    return averages, correlation, drops, longest
+
+
+def load_series_row_loop(model, value_field, user_ids, start, end):
+    """load_series filling the arrays one row at a time, for comparison"""
+    rows = model.objects.filter(
+        patient_id__in=user_ids, date__gte=start, date__lte=end
+    ).values_list('patient_id', 'date', value_field).order_by()
+    count = len(rows)
+    patient_ids = np.empty(count, dtype=np.int64)
+    ordinals = np.empty(count, dtype=np.int64)
+    values = np.empty(count, dtype=np.float64)
+    for index, (patient_id, day, value) in enumerate(rows):
+        patient_ids[index] = patient_id
+        ordinals[index] = day.toordinal()
+        values[index] = value
+    return patient_ids, ordinals, values
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the vectorised trend analytics on synthetic daily mood and sleep data, "
+        "then analyze_users end to end on the same data in a throwaway test database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--years', type=int, default=3)
+        parser.add_argument('--window', type=int, default=7)
+        parser.add_argument('--python-users', type=int, default=100,
+                            help='Users run through the pure Python loop, extrapolated to --users')
+        parser.add_argument('--skip-db', action='store_true', help='Only time the array code')
+
+    def handle(self, *args, **options):
+        users, window = options['users'], options['window']
+        days = 365 * options['years']
+        start = datetime.date.today() - datetime.timedelta(days=days - 1)
+        rng = np.random.default_rng(0)
+
+        # Rows as load_series returns them: about 9 logged days out of 10
+        user_ids = np.arange(1, users + 1)
+        patient_ids = np.repeat(user_ids, days)
+        ordinals = np.tile(np.arange(days) + start.toordinal(), users)
+        logged = rng.random(users * days) < 0.9
+        patient_ids, ordinals = patient_ids[logged], ordinals[logged]
+        sleep = np.clip(rng.normal(7, 1.2, len(ordinals)), 3, 11).round(1)
+        mood = np.clip(np.round(sleep - 4 + rng.normal(0, 1, len(ordinals))), 1, 5)
+
+        self.stdout.write(f"{users} users x {days} days, {len(ordinals)} mood and sleep entries each")
+
+        started = time.perf_counter()
+        mood_grid = build_grid(patient_ids, ordinals, mood, user_ids, start, days)
+        sleep_grid = build_grid(patient_ids, ordinals, sleep, user_ids, start, days)
+        built = time.perf_counter()
+        metrics = compute_metrics(mood_grid, sleep_grid, window)
+        vectorised = time.perf_counter() - built
+        self.stdout.write(f"{'grids':<24} {(built - started) * 1000:9.1f} ms")
+        self.stdout.write(f"{'numpy metrics':<24} {vectorised * 1000:9.1f} ms")
+
+        sample = min(options['python_users'], users)
+        series = [{}, {}]
+        for values, store in ((mood, series[0]), (sleep, series[1])):
+            for patient_id, ordinal, value in zip(patient_ids.tolist(), ordinals.tolist(), values.tolist()):
+                if patient_id <= sample:
+                    store.setdefault(patient_id, {})[ordinal] = value
+
+        started = time.perf_counter()
+        for user_id in range(1, sample + 1):
+            python_metrics(series[0][user_id], series[1][user_id], window)
+        python = (time.perf_counter() - started) * users / sample
+        self.stdout.write(f"{'python loop (estimated)':<24} {python * 1000:9.1f} ms  ({sample} users measured)")
+        self.stdout.write(f"speedup x{python / vectorised:.0f}")
+        self.stdout.write(
+            f"median mood/sleep correlation {np.nanmedian(metrics['mood_sleep_correlation']):.2f}, "
+            f"{int(metrics['mood_drops'].sum())} drops, "
+            f"longest streak {int(metrics['longest_streak'].max())} days"
+        )
+
+        if not options['skip_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.run_end_to_end(user_ids, patient_ids, ordinals, mood, sleep, start, days, window)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_end_to_end(self, user_ids, patient_ids, ordinals, mood, sleep, start, days, window):
+        started = time.perf_counter()
+        User.objects.bulk_create([
+            User(id=user_id, username=f'bench{user_id}', email=f'bench{user_id}@example.com')
+            for user_id in user_ids.tolist()
+        ], batch_size=1000)
+        dates = [datetime.date.fromordinal(ordinal) for ordinal in ordinals.tolist()]
+        for model, field, values in ((Humeur, 'niveau', mood.astype(int)), (Sommeil, 'dureeHeures', sleep)):
+            extra = {'qualite': 'bonne'} if model is Sommeil else {}
+            model.objects.bulk_create((
+                model(patient_id=patient_id, date=day, **{field: value}, **extra)
+                for patient_id, day, value in zip(patient_ids.tolist(), dates, values.tolist())
+            ), batch_size=5000)
+        self.stdout.write(f"{'database seeded':<24} {time.perf_counter() - started:9.1f} s")
+
+        end = start + datetime.timedelta(days=days - 1)
+        user_ids = user_ids.tolist()
+        for label, loader in (('row loop', load_series_row_loop), ('columns', analytics.load_series)):
+            started = time.perf_counter()
+            for model, field in ((Humeur, 'niveau'), (Sommeil, 'dureeHeures')):
+                loader(model, field, user_ids, start, end)
+            self.stdout.write(f"{'load_series, ' + label:<24} {(time.perf_counter() - started) * 1000:9.1f} ms")
+
+        started = time.perf_counter()
+        results = analyze_users(user_ids, start, end, window)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{'analyze_users':<24} {elapsed * 1000:9.1f} ms  "
+            f"({elapsed / len(user_ids) * 1000:.2f} ms/user, {len(results)} users, DB load included)"
+        )
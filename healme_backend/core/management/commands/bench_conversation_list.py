@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.models import Message, Patient, Therapeute, User
+from core.projections import projection
+from core.serializers import MessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the per-row cost of a long conversation response: MessageSerializer "
+        "with and without eager loading against the values() projection. Runs in a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(count)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, count):
+        user = User.objects.create_user(username='bench-patient', email='bench-patient@example.com', user_type='patient')
+        patient = Patient.objects.create(user=user)
+        user = User.objects.create_user(username='bench-therapist', email='bench-therapist@example.com', user_type='therapeute')
+        therapist = Therapeute.objects.create(user=user)
+        Message.objects.bulk_create([
+            Message(patient=patient, therapeute=therapist, contenu=f"Message {i}",
+                    sender_type='patient' if i % 2 else 'therapeute')
+            for i in range(count)
+        ], batch_size=1000)
+        messages = Message.objects.filter(patient=patient, therapeute=therapist).order_by('date')
+
+        cases = (
+            ('serializer', lambda: MessageSerializer(messages.all(), many=True).data),
+            ('serializer + select_related', lambda: MessageSerializer(
+                messages.select_related('patient__user', 'therapeute__user'), many=True).data),
+            ('values() projection', lambda: projection(MessageSerializer)(messages.all())),
+        )
+
+        self.stdout.write(f"{count} messages in one conversation")
+        baseline = None
+        for name, build in cases:
+            queries = []
+            with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                started = time.perf_counter()
+                data = build()
+                elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            assert len(data) == count
+            self.stdout.write(
+                f"{name:<28} {elapsed * 1000:9.1f} ms  {elapsed / count * 1e6:7.1f} us/row  "
+                f"{len(queries):6d} queries  x{baseline / elapsed:.1f}"
+            )
@@ -0,0 +1,83 @@
+import datetime
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Humeur, Message, Patient, Therapeute, User
+from core.renderers import ORJSONParser, ORJSONRenderer
+from core.serializers import HumeurSerializer, MessageSerializer
+
+
+def build_messages(count):
+    """Unsaved messages of one conversation, as a history page would load them"""
+    patient = Patient(id=1, user=User(id=1, username='patient'))
+    therapist = Therapeute(id=2, user=User(id=2, username='therapist'))
+    start = timezone.now() - datetime.timedelta(days=count)
+    return [
+        Message(
+            id=i, patient=patient, therapeute=therapist, is_read=i % 3 == 0,
+            sender_type='patient' if i % 2 else 'therapeute',
+            contenu=f"Message {i}: comment s'est passée la journée ? Plutôt bien, merci.",
+            date=start + datetime.timedelta(minutes=i), updated_at=start, change_seq=i,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def build_moods(count):
+    start = datetime.date.today() - datetime.timedelta(days=count)
+    now = timezone.now()
+    return [
+        Humeur(id=i, patient_id=1, date=start + datetime.timedelta(days=i), niveau=i % 5 + 1,
+               description='Journée calme' if i % 2 else '', updated_at=now, change_seq=i)
+        for i in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Benchmark list rendering of MessageSerializer and HumeurSerializer with DRF's JSON renderer and orjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        cases = (
+            ('MessageSerializer', MessageSerializer, build_messages(rows)),
+            ('HumeurSerializer', HumeurSerializer, build_moods(rows)),
+        )
+        self.stdout.write(f"{rows} rows, best of {repeat}")
+
+        for name, serializer_class, instances in cases:
+            serialize, data = self.best_of(repeat, lambda: serializer_class(instances, many=True).data)
+            stdlib, expected = self.best_of(repeat, lambda: JSONRenderer().render(data))
+            fast, rendered = self.best_of(repeat, lambda: ORJSONRenderer().render(data))
+            if rendered != expected:
+                self.stderr.write(f"{name}: orjson output differs from JSONRenderer")
+            parse_stdlib, _ = self.best_of(repeat, lambda: JSONParser().parse(io.BytesIO(expected)))
+            parse_fast, _ = self.best_of(repeat, lambda: ORJSONParser().parse(io.BytesIO(expected)))
+
+            self.stdout.write(f"{name} ({len(expected) / 1e6:.1f} MB)")
+            self.stdout.write(f"  {'serializer .data':<18} {serialize * 1000:9.1f} ms")
+            self.stdout.write(f"  {'render json':<18} {stdlib * 1000:9.1f} ms")
+            self.stdout.write(f"  {'render orjson':<18} {fast * 1000:9.1f} ms  x{stdlib / fast:.1f}")
+            self.stdout.write(f"  {'parse json':<18} {parse_stdlib * 1000:9.1f} ms")
+            self.stdout.write(f"  {'parse orjson':<18} {parse_fast * 1000:9.1f} ms  x{parse_stdlib / parse_fast:.1f}")
+            self.stdout.write(
+                f"  response total     {(serialize + stdlib) * 1000:9.1f} ms -> {(serialize + fast) * 1000:.1f} ms"
+            )
+
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.test import Client
+
+# Environment of each database mode, on top of the current one
+MODES = {
+    'sqlite-default': {'HEALME_DB_ENGINE': 'sqlite', 'HEALME_SQLITE_TUNING': 'False'},
+    'sqlite-tuned': {'HEALME_DB_ENGINE': 'sqlite', 'HEALME_SQLITE_TUNING': 'True'},
+    'postgres-pool': {'HEALME_DB_ENGINE': 'postgres', 'HEALME_DB_POOL': 'True'},
+    'postgres-persistent': {'HEALME_DB_ENGINE': 'postgres', 'HEALME_DB_POOL': 'False'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent send_message throughput for each database mode. "
+        "SQLite modes use a throwaway file, PostgreSQL modes the HEALME_DB_* "
+        "database (its tables are migrated and messages are added)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', default=['sqlite-default', 'sqlite-tuned'], choices=sorted(MODES))
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.run_worker(options)
+
+        self.stdout.write(f"{options['messages']} messages from {options['threads']} threads")
+        for mode in options['modes']:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, **MODES[mode]}
+                if mode.startswith('sqlite'):
+                    env['HEALME_DB_NAME'] = os.path.join(directory, 'bench.sqlite3')
+                process = subprocess.run(
+                    [sys.executable, sys.argv[0], 'bench_send_message', '--worker',
+                     '--messages', str(options['messages']), '--threads', str(options['threads'])],
+                    env=env, capture_output=True, text=True
+                )
+            if process.returncode:
+                self.stdout.write(f"{mode:<20} failed: {process.stderr.strip().splitlines()[-1:]}")
+                continue
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{mode:<20} {result['rate']:8.1f} msg/s  "
+                f"p95 {result['p95'] * 1000:7.1f} ms  "
+                f"sync counter held p95 {result['counter_held_p95'] * 1000:6.2f} ms  "
+                f"errors {result['errors']}"
+            )
+
+    def run_worker(self, options):
+        """Runs in a subprocess configured for one mode, prints a JSON result"""
+        from core.models import Message, Patient, Therapeute, User
+
+        call_command('migrate', verbosity=0)
+        user = User.objects.create_user(username='bench-patient', email='bench-patient@example.com', user_type='patient')
+        patient = Patient.objects.create(user=user)
+        user = User.objects.create_user(username='bench-therapist', email='bench-therapist@example.com', user_type='therapeute')
+        therapist = Therapeute.objects.create(user=user)
+        connection.close()
+
+        payload = json.dumps({'patient_id': patient.id, 'therapist_id': therapist.id, 'contenu': 'Bonjour', 'sender_type': 'patient'})
+        local = threading.local()
+        latencies, errors, counter_held = [], [], []
+
+        def time_counter_lock(execute, sql, params, many, context):
+            # From taking sync numbers to the commit: every writer waits on that row
+            if sql.startswith('UPDATE "core_synccounter"'):
+                taken = time.perf_counter()
+                transaction.on_commit(lambda: counter_held.append(time.perf_counter() - taken))
+            return execute(sql, params, many, context)
+
+        def send(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(time_counter_lock):
+                    response = local.client.post('/api/send-message/', payload, content_type='application/json')
+                if response.status_code != 201:
+                    errors.append(response.content[:200])
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(send, range(options['messages'])))
+        elapsed = time.perf_counter() - started
+        connections.close_all()
+
+        latencies.sort()
+        counter_held.sort()
+        sent = Message.objects.filter(patient=patient).count()
+        self.stdout.write(json.dumps({
+            'rate': sent / elapsed,
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'counter_held_p95': counter_held[int(len(counter_held) * 0.95) - 1] if counter_held else 0,
+            'errors': len(errors),
+        }))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = "Copy the SQLite primary into the replica file, to try read replicas locally"
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.databases:
+            raise CommandError("No replica configured, set HEALME_DB_REPLICA_NAME")
+        primary, replica = connections['default'], connections[REPLICA]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError("Only for SQLite, PostgreSQL replicas are fed by streaming replication")
+
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        self.stdout.write(f"Copied {primary.settings_dict['NAME']} to {replica.settings_dict['NAME']}")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = "Delete the revocations of tokens that have expired since"
+
+    def handle(self, *args, **options):
+        count, _ = RevokedToken.objects.filter(expires_at__lt=timezone.now()).delete()
+        self.stdout.write(f"Pruned {count} revoked token(s)")
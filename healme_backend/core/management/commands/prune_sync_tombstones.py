@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import SyncCounter, Tombstone
+
+
+class Command(BaseCommand):
+    help = "Delete old sync tombstones, clients with an older token get a full sync"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep the tombstones of the last N days')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        with transaction.atomic():
+            old = Tombstone.objects.filter(created_at__lt=cutoff)
+            last_seq = old.aggregate(last=Max('change_seq'))['last']
+            if last_seq is None:
+                self.stdout.write("Nothing to prune")
+                return
+            count, _ = Tombstone.objects.filter(change_seq__lte=last_seq).delete()
+            # Older tokens could miss these deletes from now on; the counter
+            # row is locked last, as by the writers
+            SyncCounter.objects.filter(pk=1, pruned__lt=last_seq).update(pruned=last_seq)
+        self.stdout.write(f"Pruned {count} tombstone(s) up to change {last_seq}")
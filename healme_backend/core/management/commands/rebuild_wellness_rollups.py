@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.models import User
+from core.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily and weekly wellness rollups from the mood, sleep and journal entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Users rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or list(User.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        total_days = total_weeks = 0
+        for start in range(0, len(user_ids), batch_size):
+            days, weeks = rebuild_rollups(user_ids[start:start + batch_size])
+            total_days += days
+            total_weeks += weeks
+
+        self.stdout.write(f"Rebuilt {total_days} daily and {total_weeks} weekly rollups for {len(user_ids)} user(s)")
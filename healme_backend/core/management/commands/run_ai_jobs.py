@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued AI jobs (use with HEALME_JOB_MODE = 'worker')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs and exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between queue polls')
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Ran {count} job(s)")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_aijob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='humeur',
+            index=models.Index(fields=['patient', '-date', '-id'], name='humeur_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='journal',
+            index=models.Index(fields=['patient', '-date', '-id'], name='journal_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sommeil',
+            index=models.Index(fields=['patient', '-date', '-id'], name='sommeil_patient_date_idx'),
+        ),
+    ]
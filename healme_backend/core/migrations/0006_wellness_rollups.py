@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWellness',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mood_entries', models.IntegerField(default=0)),
+                ('mood_total', models.IntegerField(default=0)),
+                ('mood_min', models.IntegerField(blank=True, null=True)),
+                ('mood_max', models.IntegerField(blank=True, null=True)),
+                ('sleep_entries', models.IntegerField(default=0)),
+                ('sleep_hours', models.FloatField(default=0)),
+                ('sleep_quality', models.JSONField(blank=True, default=dict)),
+                ('journal_entries', models.IntegerField(default=0)),
+                ('date', models.DateField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'date'), name='daily_wellness_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyWellness',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mood_entries', models.IntegerField(default=0)),
+                ('mood_total', models.IntegerField(default=0)),
+                ('mood_min', models.IntegerField(blank=True, null=True)),
+                ('mood_max', models.IntegerField(blank=True, null=True)),
+                ('sleep_entries', models.IntegerField(default=0)),
+                ('sleep_hours', models.FloatField(default=0)),
+                ('sleep_quality', models.JSONField(blank=True, default=dict)),
+                ('journal_entries', models.IntegerField(default=0)),
+                ('week_start', models.DateField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'week_start'), name='weekly_wellness_unique')],
+            },
+        ),
+    ]
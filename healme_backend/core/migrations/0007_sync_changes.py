@@ -0,0 +1,115 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+def number_existing_rows(apps, schema_editor):
+    """Give the rows written before the sync endpoint their own change_seq"""
+    db = schema_editor.connection.alias
+    seq = 0
+    for name in ('Humeur', 'Sommeil', 'Journal', 'Message'):
+        model = apps.get_model('core', name)
+        batch = []
+        for row in model.objects.using(db).order_by('id').only('id').iterator():
+            seq += 1
+            row.change_seq = seq
+            batch.append(row)
+            if len(batch) == 1000:
+                model.objects.using(db).bulk_update(batch, ['change_seq'])
+                batch = []
+        model.objects.using(db).bulk_update(batch, ['change_seq'])
+    apps.get_model('core', 'SyncCounter').objects.using(db).create(pk=1, value=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_wellness_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+                ('pruned', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='humeur',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='humeur',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='journal',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='journal',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='sommeil',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sommeil',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='humeur',
+            index=models.Index(fields=['patient', 'change_seq'], name='humeur_patient_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='journal',
+            index=models.Index(fields=['patient', 'change_seq'], name='journal_patient_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['patient', 'change_seq'], name='message_patient_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['therapeute', 'change_seq'], name='message_therapist_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sommeil',
+            index=models.Index(fields=['patient', 'change_seq'], name='sommeil_patient_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user_id', 'change_seq'], name='tombstone_user_seq_idx'),
+        ),
+        migrations.RunPython(number_existing_rows, migrations.RunPython.noop),
+    ]
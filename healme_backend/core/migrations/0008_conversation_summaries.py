@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def summarise_conversations(apps, schema_editor):
+    """Build the summaries of the conversations that already have messages"""
+    db = schema_editor.connection.alias
+    Message = apps.get_model('core', 'Message')
+    ConversationSummary = apps.get_model('core', 'ConversationSummary')
+    conversations = Message.objects.using(db).filter(patient__isnull=False, therapeute__isnull=False).values(
+        'patient_id', 'therapeute_id'
+    ).annotate(
+        unread_by_patient=Count('id', filter=Q(sender_type='therapeute', is_read=False)),
+        unread_by_therapist=Count('id', filter=Q(sender_type='patient', is_read=False)),
+    ).order_by()
+
+    summaries = []
+    for row in conversations:
+        last = Message.objects.using(db).filter(
+            patient_id=row['patient_id'], therapeute_id=row['therapeute_id']
+        ).order_by('-date', '-id').first()
+        for side, unread in (('patient', row['unread_by_patient']), ('therapeute', row['unread_by_therapist'])):
+            summaries.append(ConversationSummary(
+                patient_id=row['patient_id'], therapeute_id=row['therapeute_id'], side=side,
+                unread_count=unread, last_message=last, last_message_preview=last.contenu[:100],
+                last_sender_type=last.sender_type, last_activity=last.date,
+            ))
+    ConversationSummary.objects.using(db).bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_sync_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('patient', 'Patient'), ('therapeute', 'Therapeute')], max_length=10)),
+                ('unread_count', models.IntegerField(default=0)),
+                ('last_message_preview', models.CharField(blank=True, max_length=100)),
+                ('last_sender_type', models.CharField(blank=True, max_length=10, null=True)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to='core.patient')),
+                ('therapeute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to='core.therapeute')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['therapeute', 'side', '-last_activity'], name='conversation_inbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'therapeute', 'side'), name='conversation_summary_unique')],
+            },
+        ),
+        migrations.RunPython(summarise_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_token_revocations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('scope', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.CharField(max_length=32)),
+                ('changed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,5 +1,7 @@
 # core/models.py
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
@@ -10,6 +12,8 @@ class User(AbstractUser):
         ('administrateur', 'Administrateur'),
     )
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES, default='patient')
+    # Signed API tokens issued before this are revoked (log out everywhere)
+    tokens_revoked_before = models.DateTimeField(null=True, blank=True)
 
 class Patient(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)  # Temporary nullable
@@ -27,23 +31,106 @@ class Administrateur(models.Model):
     def __str__(self):
         return f"Administrateur: {self.user.username}"
 
-class Journal(models.Model):
+class SyncCounter(models.Model):
+    """
+    Single row handing out the change sequence numbers of the synced models.
+    Taking numbers locks the row until the transaction commits, so numbers
+    become visible in order and a sync token never skips a change. Every
+    writer waits on that lock, so it is the last lock a transaction takes:
+    rows (messages, entries) first, then conversation summaries, then the
+    DataVersion rows, then the counter. Saves number their row after the
+    post_save handlers, bulk writes and mark_read after writing their rows,
+    deletes their tombstones after the last row of the cascade (core/sync.py).
+    """
+    value = models.BigIntegerField(default=0)
+    # Tombstones up to this number were pruned, older tokens need a full sync
+    pruned = models.BigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, count=1):
+        """Reserve `count` numbers, returns the last one"""
+        if not cls.objects.filter(pk=1).update(value=models.F('value') + count):
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(value=models.F('value') + count)
+        return cls.objects.values_list('value', flat=True).get(pk=1)
+
+
+class SyncedModel(models.Model):
+    """
+    Rows the mobile apps pull through the sync endpoint: every write takes a
+    new change_seq, deletes leave a Tombstone (see core/sync.py)
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        with transaction.atomic():
+            # post_save handlers (conversation summaries...) run before the counter is locked
+            super().save(*args, **kwargs)
+            self.change_seq = SyncCounter.allocate()
+            type(self)._base_manager.filter(pk=self.pk).update(change_seq=self.change_seq)
+
+
+class Tombstone(models.Model):
+    """A deleted synced row, kept so clients can drop their copy"""
+    # No foreign key, the user may be deleted in the same cascade
+    user_id = models.BigIntegerField()
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'change_seq'], name='tombstone_user_seq_idx'),
+        ]
+
+class Journal(SyncedModel):
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="journaux")
     date = models.DateField()
     contenu = models.TextField()
 
-class Humeur(models.Model):
+    class Meta:
+        indexes = [
+            # History pages: one user's entries newest first, keyset on (date, id)
+            models.Index(fields=['patient', '-date', '-id'], name='journal_patient_date_idx'),
+            # Delta sync
+            models.Index(fields=['patient', 'change_seq'], name='journal_patient_seq_idx'),
+        ]
+
+class Humeur(SyncedModel):
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="humeurs")
     date = models.DateField()
     niveau = models.IntegerField()
     description = models.TextField(blank=True)
 
-class Sommeil(models.Model):
+    class Meta:
+        indexes = [
+            # History pages: one user's entries newest first, keyset on (date, id)
+            models.Index(fields=['patient', '-date', '-id'], name='humeur_patient_date_idx'),
+            # Delta sync
+            models.Index(fields=['patient', 'change_seq'], name='humeur_patient_seq_idx'),
+        ]
+
+class Sommeil(SyncedModel):
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sommeils")
     date = models.DateField()
     dureeHeures = models.FloatField()
     qualite = models.CharField(max_length=50)
 
+    class Meta:
+        indexes = [
+            # History pages: one user's entries newest first, keyset on (date, id)
+            models.Index(fields=['patient', '-date', '-id'], name='sommeil_patient_date_idx'),
+            # Delta sync
+            models.Index(fields=['patient', 'change_seq'], name='sommeil_patient_seq_idx'),
+        ]
+
 class Session(models.Model):
     date = models.DateField()
     type = models.CharField(max_length=100)
@@ -60,7 +147,7 @@ class Room(models.Model):
 
 # core/models.py - Update Message model and add new fields
 
-class Message(models.Model):
+class Message(SyncedModel):
     contenu = models.TextField()
     date = models.DateTimeField(auto_now_add=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="messages", null=True)
@@ -75,6 +162,140 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['date']
+        indexes = [
+            # Conversation history and the ?since cursor of get_conversation_messages
+            models.Index(fields=['patient', 'therapeute', 'date'], name='message_conversation_idx'),
+            models.Index(fields=['patient', 'therapeute', 'id'], name='message_conv_cursor_idx'),
+            # Therapist inbox, newest first
+            models.Index(fields=['therapeute', '-date'], name='message_therapist_inbox_idx'),
+            # Delta sync, for both sides of the conversation
+            models.Index(fields=['patient', 'change_seq'], name='message_patient_seq_idx'),
+            models.Index(fields=['therapeute', 'change_seq'], name='message_therapist_seq_idx'),
+            # Unread badges only ever look at unread rows
+            models.Index(
+                fields=['therapeute', 'patient', 'sender_type'],
+                condition=models.Q(is_read=False),
+                name='message_unread_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender_type} - {self.date}"
+
+
+class ConversationSummary(models.Model):
+    """
+    One side's view of a patient/therapist conversation: its unread badge and
+    last message, kept up to date on send and mark-read (core/conversations.py)
+    so inboxes and badges never count over the message table
+    """
+    SIDE_CHOICES = [('patient', 'Patient'), ('therapeute', 'Therapeute')]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="conversation_summaries")
+    therapeute = models.ForeignKey(Therapeute, on_delete=models.CASCADE, related_name="conversation_summaries")
+    # Whose view this is: unread_count counts the other side's unread messages
+    side = models.CharField(max_length=10, choices=SIDE_CHOICES)
+    unread_count = models.IntegerField(default=0)
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_sender_type = models.CharField(max_length=10, null=True, blank=True)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'therapeute', 'side'], name='conversation_summary_unique'),
+        ]
+        indexes = [
+            # Therapist inbox, most recent conversation first
+            models.Index(fields=['therapeute', 'side', '-last_activity'], name='conversation_inbox_idx'),
+        ]
+
+
+class AIJob(models.Model):
+    """Background LLM work (insights, chat replies) polled by the apps"""
+    KIND_CHOICES = (
+        ('insight', 'Insight'),
+        ('chat_reply', 'Chat reply'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="ai_jobs")
+    payload = models.JSONField(default=dict, blank=True)
+    # Identical work already queued is reused instead of queued twice
+    dedupe_key = models.CharField(max_length=100, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='aijob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+
+class RevokedToken(models.Model):
+    """A signed API token revoked before it expired, see core/authentication.py"""
+    jti = models.CharField(max_length=32, primary_key=True)
+    # Past this the token is expired anyway and the row can be pruned
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class DataVersion(models.Model):
+    """Version of a data scope behind the ETags, see core/httpcache.py"""
+    scope = models.CharField(max_length=100, primary_key=True)
+    # New random value on each write to the scope
+    version = models.CharField(max_length=32)
+    changed_at = models.DateTimeField()
+
+
+class WellnessRollup(models.Model):
+    """Aggregates of a user's Humeur, Sommeil and Journal rows, maintained by core.rollups"""
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    mood_entries = models.IntegerField(default=0)
+    mood_total = models.IntegerField(default=0)
+    mood_min = models.IntegerField(null=True, blank=True)
+    mood_max = models.IntegerField(null=True, blank=True)
+    sleep_entries = models.IntegerField(default=0)
+    sleep_hours = models.FloatField(default=0)
+    # Number of nights per qualite value
+    sleep_quality = models.JSONField(default=dict, blank=True)
+    journal_entries = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def mood_average(self):
+        return self.mood_total / self.mood_entries if self.mood_entries else None
+
+    @property
+    def sleep_average_hours(self):
+        return self.sleep_hours / self.sleep_entries if self.sleep_entries else None
+
+class DailyWellness(WellnessRollup):
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'date'], name='daily_wellness_unique'),
+        ]
+
+class WeeklyWellness(WellnessRollup):
+    # Monday of the week
+    week_start = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'week_start'], name='weekly_wellness_unique'),
+        ]
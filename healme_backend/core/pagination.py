@@ -0,0 +1,83 @@
+# core/pagination.py
+import base64
+import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ConversationPagination(LimitOffsetPagination):
+    """
+    Opt-in paging for conversation lists: ?limit=&offset=
+    Without limit the plain list is returned, as the apps expect.
+    """
+    max_limit = 100
+
+
+class DateKeysetPagination(BasePagination):
+    """
+    Keyset paging on (date, id), newest first: ?limit=&cursor=
+    Each page is one indexed range scan whatever its depth, the cursor of the
+    next page comes back as next_cursor. Opt-in like ConversationPagination.
+    """
+    default_limit = 50
+    max_limit = 500
+
+    def encode_cursor(self, row):
+        # Model instances or values() dicts
+        if isinstance(row, dict):
+            row_date, row_id = row['date'], row['id']
+        else:
+            row_date, row_id = row.date, row.id
+        raw = f"{row_date.isoformat()}|{row_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            raw_date, raw_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            cursor_date = datetime.date.fromisoformat(raw_date)
+            return cursor_date, int(raw_id)
+        except (ValueError, UnicodeDecodeError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def get_limit(self, request):
+        raw_limit = request.query_params.get('limit')
+        if raw_limit is None:
+            return self.default_limit
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'limit must be a number.'})
+        return max(1, min(limit, self.max_limit))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if 'limit' not in request.query_params and 'cursor' not in request.query_params:
+            return None
+
+        self.request = request
+        limit = self.get_limit(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            cursor_date, cursor_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(date__lt=cursor_date) | Q(date=cursor_date, id__lt=cursor_id))
+
+        rows = list(queryset.order_by('-date', '-id')[:limit + 1])
+        page = rows[:limit]
+        self.next_cursor = self.encode_cursor(page[-1]) if len(rows) > limit else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, 'cursor', self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next_cursor': self.next_cursor,
+            'next': self.get_next_link(),
+            'results': data
+        })
@@ -0,0 +1,58 @@
+# core/profiles.py - Cached profile of the logged in user
+#
+# check-auth runs on every screen load of the apps. The profile it returns
+# (patient, therapist or admin) is read with one query joining the three
+# profile tables, then kept in the cache per user id until a profile is saved
+# or deleted.
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from .models import User, Patient, Therapeute, Administrateur
+from .serializers import PatientSerializer, TherapeuteSerializer, AdministrateurSerializer
+
+# Checked in this order, like the original hasattr chain
+PROFILE_TYPES = (
+    ('patient', PatientSerializer),
+    ('therapeute', TherapeuteSerializer),
+    ('administrateur', AdministrateurSerializer),
+)
+PROFILE_CACHE_TTL = 60 * 60
+
+
+def profile_cache_key(user_id):
+    return f"profile:{user_id}"
+
+
+def load_profile(user_id):
+    """Serialized profile of the user (None without one), in one query"""
+    user = User.objects.select_related(*(name for name, _ in PROFILE_TYPES)).get(pk=user_id)
+    for name, serializer_class in PROFILE_TYPES:
+        if hasattr(user, name):
+            return serializer_class(getattr(user, name)).data
+    return None
+
+
+def get_profile_data(user):
+    key = profile_cache_key(user.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached['profile']
+
+    profile = load_profile(user.pk)
+    # Wrapped so that "no profile" is cached too
+    cache.set(key, {'profile': profile}, timeout=PROFILE_CACHE_TTL)
+    return profile
+
+
+def invalidate_profile(user_id):
+    if user_id:
+        cache.delete(profile_cache_key(user_id))
+
+
+def profile_changed(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
+
+
+for model in (Patient, Therapeute, Administrateur):
+    post_save.connect(profile_changed, sender=model, dispatch_uid=f'profile_cache_{model.__name__}')
+    post_delete.connect(profile_changed, sender=model, dispatch_uid=f'profile_cache_delete_{model.__name__}')
@@ -0,0 +1,108 @@
+# core/projections.py - values() projections for the hot read-only lists
+#
+# Conversation, history and patient lists return thousands of rows. Going
+# through a ModelSerializer builds a model instance and runs every field per
+# row, and source='patient.user.username' style fields cost a query each
+# unless the queryset joins them. A Projection reads the serializer's
+# columns with one values() query (related sources become joins) and builds
+# the same dicts the serializer would, converting only the types DRF
+# formats (dates, decimals...).
+from rest_framework import serializers
+from rest_framework.response import Response
+
+# Serializer fields whose representation differs from the database value
+CONVERTED_FIELDS = (
+    serializers.DateTimeField,
+    serializers.DateField,
+    serializers.TimeField,
+    serializers.DecimalField,
+    serializers.DurationField,
+    serializers.UUIDField,
+)
+
+# Fields returning the column value as is
+PLAIN_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.FloatField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+class Projection:
+    """
+    The output of `serializer_class(many=True).data` built from values() rows.
+    `fields` keeps only some of the serializer's fields, like
+    DynamicFieldsModelSerializer; `extra` columns are loaded but not output
+    (the keyset pagination needs date and id).
+    """
+    def __init__(self, serializer_class, fields=None, extra=()):
+        self.columns = []
+        self.converters = []
+        self.nullable = []
+        for name, field in serializer_class().fields.items():
+            if fields is not None and name not in fields:
+                continue
+            if field.write_only:
+                continue
+            if isinstance(field, CONVERTED_FIELDS):
+                self.converters.append((name, field.to_representation))
+            elif not isinstance(field, PLAIN_FIELDS) or field.source == '*':
+                raise TypeError(f"{serializer_class.__name__}.{name} ({type(field).__name__}) can't be projected")
+            self.columns.append((name, field.source.replace('.', '__')))
+            # DRF leaves the field out when a relation on the way is null
+            path = field.source.split('.')[:-1]
+            if path:
+                self.nullable.append((name, ['__'.join(path[:depth]) for depth in range(1, len(path) + 1)]))
+        lookups = [lookup for _, lookup in self.columns]
+        lookups += [lookup for _, relations in self.nullable for lookup in relations]
+        self.lookups = list(dict.fromkeys(lookups + list(extra)))
+
+    def values(self, queryset):
+        """Queryset of the dict rows to page and pass to rows()"""
+        return queryset.values(*self.lookups)
+
+    def rows(self, values):
+        data = []
+        for row in values:
+            item = {name: row[lookup] for name, lookup in self.columns}
+            for name, convert in self.converters:
+                if item[name] is not None:
+                    item[name] = convert(item[name])
+            for name, relations in self.nullable:
+                if item[name] is None and any(row[lookup] is None for lookup in relations):
+                    del item[name]
+            data.append(item)
+        return data
+
+    def __call__(self, queryset):
+        return self.rows(self.values(queryset))
+
+
+_projections = {}
+
+
+def projection(serializer_class, fields=None, extra=()):
+    """
+    Projections are built once per serializer and field set. `fields` come
+    from the client (?fields=): callers check the names against the
+    serializer, and order and repeats don't make new entries.
+    """
+    key = (serializer_class, tuple(sorted(set(fields))) if fields is not None else None, tuple(extra))
+    if key not in _projections:
+        _projections[key] = Projection(serializer_class, fields, extra)
+    return _projections[key]
+
+
+class ProjectedListMixin:
+    """ViewSet list() through a Projection of its serializer, paged as usual"""
+    def list(self, request, *args, **kwargs):
+        rows = projection(self.get_serializer_class())
+        values = rows.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(values)
+        if page is not None:
+            return self.get_paginated_response(rows.rows(page))
+        return Response(rows.rows(values))
@@ -0,0 +1,173 @@
+# core/prompts.py - Prompts sent to the LLM
+#
+# Insight prompts stay the same size however long a patient has used the app:
+# the most recent entries are quoted, older ones are summarised in SQL
+# (weekly averages, averages by quality, counts), and the whole data part is
+# cut to HEALME_PROMPT_TOKEN_BUDGET.
+from django.conf import settings
+from django.db.models import Avg, Count
+from django.db.models.functions import TruncWeek
+
+from .models import Humeur, Sommeil, Journal
+
+# Rough size of a token for budgeting, close enough for Gemini on French/English text
+CHARS_PER_TOKEN = 4
+ENTRY_TEXT_LIMIT = 200
+# Sleep qualities are a handful of labels, the most frequent ones are summarised
+QUALITY_ROWS = 5
+
+
+def prompt_settings():
+    return (
+        getattr(settings, 'HEALME_PROMPT_TOKEN_BUDGET', 1000),
+        getattr(settings, 'HEALME_PROMPT_RECENT_ENTRIES', 14),
+        getattr(settings, 'HEALME_PROMPT_SUMMARY_WEEKS', 12),
+    )
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def shorten(text, limit=ENTRY_TEXT_LIMIT):
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+
+def fit_lines(lines, budget):
+    """Keep lines in order while they fit in the token budget, returns (lines, tokens left)"""
+    kept = []
+    for line in lines:
+        cost = estimate_tokens(line + "\n")
+        if cost > budget:
+            break
+        kept.append(line)
+        budget -= cost
+    return kept, budget
+
+
+def split_history(queryset, recent_entries):
+    """Return the newest entries and a queryset of everything older"""
+    recent = list(queryset.order_by('-date', '-id')[:recent_entries])
+    older = queryset.exclude(id__in=[entry.id for entry in recent])
+    return recent, older
+
+
+def weekly_stats(queryset, summary_weeks, **aggregates):
+    """Per-week aggregates, newest week first, computed by the database"""
+    return list(
+        queryset.annotate(week=TruncWeek('date'))
+        .values('week')
+        .annotate(entries=Count('id'), **aggregates)
+        .order_by('-week')[:summary_weeks]
+    )
+
+
+def build_data_section(instructions, recent_title, recent_lines, summary_title, summary_lines):
+    """Assemble the prompt, recent entries first, within the token budget"""
+    token_budget = prompt_settings()[0]
+    # Instructions, titles and the blank lines between sections come first
+    budget = token_budget - estimate_tokens(f"\n{instructions}\n\n{recent_title}\n\n{summary_title}\n\n")
+    recent_lines, budget = fit_lines(recent_lines, budget)
+    summary_lines, budget = fit_lines(summary_lines, budget)
+
+    sections = [instructions.strip()]
+    if recent_lines:
+        sections.append(recent_title + "\n" + "\n".join(recent_lines))
+    if summary_lines:
+        sections.append(summary_title + "\n" + "\n".join(summary_lines))
+    return "\n" + "\n\n".join(sections) + "\n"
+
+
+def build_mood_prompt(user_id):
+    _, recent_entries, summary_weeks = prompt_settings()
+    # Moods without a note are neither quoted nor summarised
+    moods = Humeur.objects.filter(patient_id=user_id).exclude(description='')
+    recent, older = split_history(moods, recent_entries)
+
+    recent_lines = [
+        f"{m.date}: Niveau {m.niveau} - {shorten(m.description)}"
+        for m in recent
+    ]
+    summary_lines = [
+        f"Week of {row['week']:%Y-%m-%d}: average niveau {row['average']:.1f} over {row['entries']} entries"
+        for row in weekly_stats(older, summary_weeks, average=Avg('niveau'))
+    ]
+
+    return build_data_section(
+        "Please generate a one phrases that suggests activities or advice (an activity that patient can do to imporve health) based on the following mood data:",
+        "Recent moods:",
+        recent_lines,
+        "Earlier weeks:",
+        summary_lines
+    )
+
+
+def build_sleep_prompt(user_id):
+    _, recent_entries, summary_weeks = prompt_settings()
+    recent, older = split_history(Sommeil.objects.filter(patient_id=user_id), recent_entries)
+
+    # Format sleep data for AI
+    recent_lines = [
+        f"{s.date}: {s.dureeHeures} hours, quality = {s.qualite}"
+        for s in recent
+    ]
+    by_quality = older.values('qualite').annotate(
+        entries=Count('id'),
+        average=Avg('dureeHeures')
+    ).order_by('-entries')
+    summary_lines = [
+        f"Quality {row['qualite']}: {row['entries']} nights, average {row['average']:.1f} hours"
+        for row in by_quality[:QUALITY_ROWS]
+    ] + [
+        f"Week of {row['week']:%Y-%m-%d}: average {row['average']:.1f} hours over {row['entries']} nights"
+        for row in weekly_stats(older, summary_weeks, average=Avg('dureeHeures'))
+    ]
+
+    return build_data_section(
+        "Please generate one single phrase of sleep advice based on this person's sleep patterns.\n"
+        "Make the suggestion practical and short.",
+        "Recent sleep data:",
+        recent_lines,
+        "Earlier sleep data:",
+        summary_lines
+    )
+
+
+def build_journal_prompt(user_id):
+    _, recent_entries, summary_weeks = prompt_settings()
+    recent, older = split_history(Journal.objects.filter(patient_id=user_id), recent_entries)
+
+    # Format journal text for AI
+    recent_lines = [
+        f"{j.date}: {shorten(j.contenu)}"
+        for j in recent
+    ]
+    summary_lines = [
+        f"Week of {row['week']:%Y-%m-%d}: {row['entries']} entries"
+        for row in weekly_stats(older, summary_weeks)
+    ]
+
+    return build_data_section(
+        "Please summarize the emotional tone of this person's journal entries in one short sentence.\n"
+        "Avoid deep analysis, keep it supportive and simple.",
+        "Journal entries:",
+        recent_lines,
+        "Earlier journal activity:",
+        summary_lines
+    )
+
+
+def build_chat_prompt(user_message):
+    return f"""
+You are a supportive assistant. Respond in a short, warm, simple tone.
+
+User said:
+{user_message}
+"""
+
+
+INSIGHT_PROMPTS = {
+    'mood': build_mood_prompt,
+    'sleep': build_sleep_prompt,
+    'journal': build_journal_prompt,
+}
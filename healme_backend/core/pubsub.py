@@ -0,0 +1,131 @@
+# core/pubsub.py - Fan out new chat messages to connected clients
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'core.pubsub.InMemoryPubSub'
+
+
+def conversation_channel(patient_id, therapist_id):
+    """Name of the channel carrying one patient-therapist conversation"""
+    return f"conversation.{patient_id}.{therapist_id}"
+
+
+class Subscription:
+    """
+    One subscriber of a channel, read from an asyncio event loop.
+    Publishers may run in another thread (sync views), so payloads are
+    handed over to the subscriber's loop thread-safely.
+    """
+    def __init__(self, pubsub, channel, max_pending=100):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+    def _put(self, payload):
+        # A client that stopped reading loses messages instead of growing memory
+        if not self.queue.full():
+            self.queue.put_nowait(payload)
+
+    def put(self, payload):
+        if self.loop is None or self.loop.is_closed():
+            self._put(payload)
+        else:
+            self.loop.call_soon_threadsafe(self._put, payload)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.pubsub.unsubscribe(self)
+
+
+class BasePubSub(ABC):
+    """Interface every pub/sub backend implements"""
+    @abstractmethod
+    def subscribe(self, channel):
+        """Return a Subscription receiving what is published on the channel"""
+
+    @abstractmethod
+    def unsubscribe(self, subscription):
+        pass
+
+    @abstractmethod
+    def publish(self, channel, payload):
+        """Deliver the payload to the channel's subscribers, return how many"""
+
+    @abstractmethod
+    def subscriber_count(self, channel):
+        """Subscribers of the channel known to this process"""
+
+
+class InMemoryPubSub(BasePubSub):
+    """
+    Keeps subscribers in process memory.
+    Good for a single ASGI process and for tests.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(payload)
+        return len(subscribers)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+def get_pubsub():
+    """Return the process-wide backend configured by HEALME_PUBSUB_BACKEND"""
+    global _pubsub
+    if _pubsub is None:
+        with _pubsub_lock:
+            if _pubsub is None:
+                backend = getattr(settings, 'HEALME_PUBSUB_BACKEND', DEFAULT_BACKEND)
+                _pubsub = import_string(backend)()
+    return _pubsub
+
+
+def publish_message(message):
+    """Push a saved Message to everyone watching its conversation"""
+    from .serializers import MessageSerializer
+
+    payload = {
+        'type': 'message',
+        'message': MessageSerializer(message).data,
+    }
+    return get_pubsub().publish(
+        conversation_channel(message.patient_id, message.therapeute_id),
+        payload
+    )
@@ -0,0 +1,174 @@
+# core/rollups.py - Daily and weekly wellness aggregates
+#
+# DailyWellness and WeeklyWellness hold per-user aggregates of the Humeur,
+# Sommeil and Journal rows so trend charts read O(weeks) rows instead of every
+# entry. Writes only recompute the days and weeks they touch (refresh_days);
+# rebuild_rollups recomputes everything. Both lock the patients' User rows and
+# aggregate in the same transaction as they replace the rollups, so concurrent
+# refreshes of a patient run one after the other and the last one sees every
+# committed entry (the rollup rows of a new day do not exist yet to be locked).
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .models import User, Humeur, Sommeil, Journal, DailyWellness, WeeklyWellness
+
+ROLLUP_FIELDS = (
+    'mood_entries', 'mood_total', 'mood_min', 'mood_max',
+    'sleep_entries', 'sleep_hours', 'sleep_quality', 'journal_entries',
+)
+
+
+def week_start(day):
+    """Monday of the week, the same weeks as TruncWeek"""
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def empty_rollup():
+    return {
+        'mood_entries': 0, 'mood_total': 0, 'mood_min': None, 'mood_max': None,
+        'sleep_entries': 0, 'sleep_hours': 0.0, 'sleep_quality': {}, 'journal_entries': 0,
+    }
+
+
+def is_empty(rollup):
+    return not (rollup['mood_entries'] or rollup['sleep_entries'] or rollup['journal_entries'])
+
+
+def merge_rollups(rollups):
+    """Combine several day rollups into one (used for weeks)"""
+    merged = empty_rollup()
+    quality = Counter()
+    for rollup in rollups:
+        for field in ('mood_entries', 'mood_total', 'sleep_entries', 'sleep_hours', 'journal_entries'):
+            merged[field] += rollup[field]
+        if rollup['mood_entries']:
+            if merged['mood_min'] is None:
+                merged['mood_min'], merged['mood_max'] = rollup['mood_min'], rollup['mood_max']
+            else:
+                merged['mood_min'] = min(merged['mood_min'], rollup['mood_min'])
+                merged['mood_max'] = max(merged['mood_max'], rollup['mood_max'])
+        quality.update(rollup['sleep_quality'])
+    merged['sleep_quality'] = dict(quality)
+    return merged
+
+
+def day_filter(keys, field='date'):
+    """Q matching the given (user id, date) pairs, one IN per user"""
+    dates = defaultdict(set)
+    for user_id, day in keys:
+        dates[user_id].add(day)
+    condition = Q(pk__in=[])
+    for user_id, days in dates.items():
+        condition |= Q(patient_id=user_id, **{f'{field}__in': days})
+    return condition
+
+
+def lock_patients(user_ids):
+    """Hold the User rows of these patients until the transaction ends"""
+    list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def collect_days(**filters):
+    """Day rollups of the entries matching filters, keyed by (user id, date)"""
+    days = defaultdict(empty_rollup)
+
+    moods = Humeur.objects.filter(**filters).values('patient_id', 'date').annotate(
+        entries=Count('id'), total=Sum('niveau'), low=Min('niveau'), high=Max('niveau')
+    ).order_by()
+    for row in moods:
+        days[row['patient_id'], row['date']].update(
+            mood_entries=row['entries'], mood_total=row['total'], mood_min=row['low'], mood_max=row['high']
+        )
+
+    sleeps = Sommeil.objects.filter(**filters).values('patient_id', 'date', 'qualite').annotate(
+        entries=Count('id'), hours=Sum('dureeHeures')
+    ).order_by()
+    for row in sleeps:
+        rollup = days[row['patient_id'], row['date']]
+        rollup['sleep_entries'] += row['entries']
+        rollup['sleep_hours'] += row['hours']
+        rollup['sleep_quality'][row['qualite']] = row['entries']
+
+    journals = Journal.objects.filter(**filters).values('patient_id', 'date').annotate(
+        entries=Count('id')
+    ).order_by()
+    for row in journals:
+        days[row['patient_id'], row['date']]['journal_entries'] = row['entries']
+
+    return days
+
+
+def refresh_day(user_id, day):
+    """Recompute the day and week rollups after an entry of that day was written"""
+    refresh_days({(user_id, day)})
+
+
+def refresh_days(keys):
+    """
+    Recompute the rollups of many (user id, date) pairs at once, e.g. after a
+    bulk write, with a fixed number of queries whatever the number of days
+    """
+    keys = {
+        (user_id, datetime.date.fromisoformat(day) if isinstance(day, str) else day)
+        for user_id, day in keys
+    }
+    if not keys:
+        return
+    user_ids = {user_id for user_id, _ in keys}
+    mondays = {(user_id, week_start(day)) for user_id, day in keys}
+
+    with transaction.atomic():
+        lock_patients(user_ids)
+        computed = collect_days(patient_id__in=user_ids, date__in={day for _, day in keys})
+
+        DailyWellness.objects.filter(day_filter(keys)).delete()
+        DailyWellness.objects.bulk_create([
+            DailyWellness(patient_id=user_id, date=day, **computed[user_id, day])
+            for user_id, day in keys
+            if not is_empty(computed[user_id, day])
+        ])
+
+        weeks = defaultdict(list)
+        week_days = {
+            (user_id, monday + datetime.timedelta(days=offset))
+            for user_id, monday in mondays
+            for offset in range(7)
+        }
+        for row in DailyWellness.objects.filter(day_filter(week_days)).values('patient_id', 'date', *ROLLUP_FIELDS):
+            weeks[row.pop('patient_id'), week_start(row.pop('date'))].append(row)
+
+        WeeklyWellness.objects.filter(day_filter(mondays, field='week_start')).delete()
+        WeeklyWellness.objects.bulk_create([
+            WeeklyWellness(patient_id=user_id, week_start=monday, **merge_rollups(weeks[user_id, monday]))
+            for user_id, monday in mondays
+            if weeks[user_id, monday]
+        ])
+
+
+def rebuild_rollups(user_ids):
+    """
+    Recompute every rollup of these users from the entry tables with a few
+    grouped queries, for backfills and repairs
+    """
+    with transaction.atomic():
+        lock_patients(user_ids)
+        days = collect_days(patient_id__in=user_ids)
+        weeks = defaultdict(list)
+        for (user_id, day), rollup in days.items():
+            weeks[user_id, week_start(day)].append(rollup)
+
+        DailyWellness.objects.filter(patient_id__in=user_ids).delete()
+        WeeklyWellness.objects.filter(patient_id__in=user_ids).delete()
+        DailyWellness.objects.bulk_create([
+            DailyWellness(patient_id=user_id, date=day, **rollup)
+            for (user_id, day), rollup in days.items()
+        ], batch_size=1000)
+        WeeklyWellness.objects.bulk_create([
+            WeeklyWellness(patient_id=user_id, week_start=monday, **merge_rollups(rollups))
+            for (user_id, monday), rollups in weeks.items()
+        ], batch_size=1000)
+
+    return len(days), len(weeks)
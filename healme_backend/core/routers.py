@@ -0,0 +1,149 @@
+# core/routers.py - Read replica routing
+#
+# When a 'replica' database is configured, the read-heavy endpoints (history
+# pages, conversation polls, therapist lists) read from it; everything else,
+# and every write, uses 'default'. Responses with validators from
+# core.httpcache are built from 'default' (their 304s need no query at all). Replication lags, so a client that just
+# wrote is pinned to 'default' for HEALME_REPLICA_STICKY_SECONDS: for the rest
+# of the request, then through a cookie and a per-user cache mark (for token
+# clients without cookies).
+import contextvars
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICA = 'replica'
+PIN_COOKIE = 'healme_primary'
+
+# Routing state of the request being handled, None outside requests
+_request_state = contextvars.ContextVar('healme_db_routing', default=None)
+
+
+def replica_enabled():
+    return REPLICA in settings.DATABASES
+
+
+def sticky_seconds():
+    return getattr(settings, 'HEALME_REPLICA_STICKY_SECONDS', 5)
+
+
+def pin_key(user_id):
+    return f"db-primary-pin:{user_id}"
+
+
+def user_is_pinned(user):
+    return bool(user and user.is_authenticated and (cache.get(pin_key(user.id)) or 0) > time.time())
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state and state['replica'] and not state['pinned'] and not state['wrote'] and replica_enabled():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases
+        return True
+
+
+class ReplicaStickinessMiddleware:
+    """Tracks the writes of each request and pins its client to the primary after one"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI the async views must not be run through a sync middleware
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _request_state.set(self.initial_state(request))
+        try:
+            response = self.get_response(request)
+            state = _request_state.get()
+        finally:
+            _request_state.reset(token)
+        if state['wrote'] and replica_enabled():
+            self.pin_client(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = _request_state.set(self.initial_state(request))
+        try:
+            response = await self.get_response(request)
+            state = _request_state.get()
+        finally:
+            _request_state.reset(token)
+        if state['wrote'] and replica_enabled():
+            # request.user may still have to be loaded from the database
+            await sync_to_async(self.pin_client)(request, response)
+        return response
+
+    def initial_state(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return {'replica': False, 'wrote': False, 'pinned': pinned_until > time.time()}
+
+    def pin_client(self, request, response):
+        until = time.time() + sticky_seconds()
+        response.set_cookie(PIN_COOKIE, f"{until:.0f}", max_age=sticky_seconds(), httponly=True, samesite='Lax')
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cache.set(pin_key(user.id), until, timeout=sticky_seconds())
+
+
+def start_replica_reads(request):
+    """Send the reads of this request to the replica, unless its client is pinned"""
+    state = _request_state.get()
+    if state is None or request.method not in ('GET', 'HEAD'):
+        return
+    # Resolve the user on the primary before switching
+    pinned = state['pinned'] or user_is_pinned(getattr(request, 'user', None))
+    state.update(replica=True, pinned=pinned)
+
+
+def stop_replica_reads():
+    state = _request_state.get()
+    if state is not None:
+        state['replica'] = False
+
+
+def replica_reads(view):
+    """Let a read-only view read from the replica"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        start_replica_reads(request)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            stop_replica_reads()
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """ViewSet list and retrieve read from the replica"""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            start_replica_reads(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        stop_replica_reads()
+        return super().finalize_response(request, response, *args, **kwargs)
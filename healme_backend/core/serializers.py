@@ -1,6 +1,18 @@
 from rest_framework import serializers
 from .models import *
 
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Takes an extra `fields` argument to only output some of the fields
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -21,17 +33,17 @@ class AdministrateurSerializer(serializers.ModelSerializer):
         model = Administrateur
         fields = '__all__'
 
-class JournalSerializer(serializers.ModelSerializer):
+class JournalSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Journal
         fields = '__all__'
 
-class HumeurSerializer(serializers.ModelSerializer):
+class HumeurSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Humeur
         fields = '__all__'
 
-class SommeilSerializer(serializers.ModelSerializer):
+class SommeilSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Sommeil
         fields = '__all__'
@@ -67,36 +79,57 @@ class TherapistListSerializer(serializers.ModelSerializer):
         model = Therapeute
         fields = ['id', 'user_id', 'username', 'email', 'specialite', 'phone', 'unread_count', 'last_message']
 
-    def get_unread_count(self, obj):
+    def get_summary(self, obj):
+        # The current patient's side of the conversation with this therapist
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            try:
-                patient = request.user.patient
-                return Message.objects.filter(
-                    therapeute=obj,
-                    patient=patient,
-                    is_read=False,
-                    sender_type='therapeute'
-                ).count()
-            except Patient.DoesNotExist:
-                return 0
-        return 0
+            return ConversationSummary.objects.filter(
+                therapeute=obj,
+                patient__user_id=request.user.id,
+                side='patient'
+            ).select_related('last_message').first()
+        return None
+
+    def get_unread_count(self, obj):
+        # Annotated by TherapistViewSet.get_queryset
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
+
+        summary = self.get_summary(obj)
+        return summary.unread_count if summary else 0
 
     def get_last_message(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                patient = request.user.patient
-                last_message = Message.objects.filter(
-                    therapeute=obj,
-                    patient=patient
-                ).order_by('-date').first()
-                if last_message:
-                    return {
-                        'content': last_message.contenu,
-                        'date': last_message.date,
-                        'sender_type': last_message.sender_type
-                    }
-            except Patient.DoesNotExist:
+        # Annotated by TherapistViewSet.get_queryset
+        if hasattr(obj, 'last_message_date'):
+            if obj.last_message_date is None:
                 return None
-        return None
\ No newline at end of file
+            return {
+                'content': obj.last_message_content,
+                'date': obj.last_message_date,
+                'sender_type': obj.last_message_sender_type
+            }
+
+        summary = self.get_summary(obj)
+        if summary is None or summary.last_activity is None:
+            return None
+        return {
+            'content': summary.last_message.contenu if summary.last_message else summary.last_message_preview,
+            'date': summary.last_activity,
+            'sender_type': summary.last_sender_type
+        }
+
+class DailyWellnessSerializer(serializers.ModelSerializer):
+    mood_average = serializers.FloatField(read_only=True)
+    sleep_average_hours = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DailyWellness
+        exclude = ['id', 'patient', 'mood_total']
+
+class WeeklyWellnessSerializer(serializers.ModelSerializer):
+    mood_average = serializers.FloatField(read_only=True)
+    sleep_average_hours = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = WeeklyWellness
+        exclude = ['id', 'patient', 'mood_total']
@@ -0,0 +1,198 @@
+# core/sync.py - Delta sync for the offline-first apps
+#
+# Every write of a synced model (Humeur, Sommeil, Journal, Message) takes the
+# next number of one global change sequence, and every delete leaves a
+# Tombstone numbered from the same sequence. A sync token is a position in the
+# sequence: the changes since a token are the rows and tombstones numbered
+# after it, read from (owner, change_seq) indexes.
+import base64
+import threading
+from heapq import merge
+from itertools import islice
+
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, pre_delete
+
+from . import conversations  # noqa: F401 - its delete handlers run before leave_tombstone
+from .models import Humeur, Sommeil, Journal, Message, Patient, Therapeute, SyncCounter, Tombstone, User
+from .serializers import HumeurSerializer, SommeilSerializer, JournalSerializer, MessageSerializer
+
+# Same names as the REST endpoints
+SYNC_KINDS = {
+    'humeurs': (Humeur, HumeurSerializer),
+    'sommeils': (Sommeil, SommeilSerializer),
+    'journaux': (Journal, JournalSerializer),
+    'messages': (Message, MessageSerializer),
+}
+
+
+class SyncTokenError(ValueError):
+    pass
+
+
+class SyncTokenExpired(Exception):
+    """The token is older than the pruned tombstones, the client must start over"""
+
+
+def encode_token(seq):
+    return base64.urlsafe_b64encode(f"v1|{seq}".encode()).decode()
+
+
+def decode_token(token):
+    try:
+        version, seq = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        if version != 'v1':
+            raise ValueError(version)
+        return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        raise SyncTokenError('Invalid sync token.')
+
+
+def message_audience(message):
+    """Users who see a message: both sides of the conversation"""
+    user_ids = []
+    if message.patient_id:
+        user_ids.append(Patient.objects.filter(pk=message.patient_id).values_list('user_id', flat=True).first())
+    if message.therapeute_id:
+        user_ids.append(Therapeute.objects.filter(pk=message.therapeute_id).values_list('user_id', flat=True).first())
+    return [user_id for user_id in user_ids if user_id]
+
+
+# Tombstones of the deletes in progress in this thread, by id of the delete's origin
+_deletes = threading.local()
+
+
+def root_model(origin):
+    """Model whose rows post_delete reports last in a delete started from origin"""
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def pending_delete(origin, start=False):
+    """State of the delete started from origin, None if it is not tracked"""
+    deletes = getattr(_deletes, 'pending', None)
+    if deletes is None:
+        deletes = _deletes.pending = {}
+    pending = deletes.get(id(origin))
+    if pending is not None and pending['origin'] is not origin:
+        # Left behind by a failed delete
+        del deletes[id(origin)]
+        pending = None
+    if pending is None and start:
+        pending = deletes[id(origin)] = {'origin': origin, 'remaining': 0, 'tombstones': []}
+    return pending
+
+
+def delete_started(sender, instance, origin=None, **kwargs):
+    # pre_delete runs for every row before the first one is deleted
+    if origin is not None and sender is root_model(origin):
+        pending_delete(origin, start=True)['remaining'] += 1
+
+
+def number_tombstones(tombstones):
+    """Take sync numbers for deleted rows, given as (kind, object id, user ids)"""
+    if not tombstones:
+        return
+    last = SyncCounter.allocate(len(tombstones))
+    Tombstone.objects.bulk_create([
+        Tombstone(user_id=user_id, kind=kind, object_id=object_id, change_seq=seq)
+        for seq, (kind, object_id, user_ids) in enumerate(tombstones, start=last - len(tombstones) + 1)
+        for user_id in user_ids
+    ])
+
+
+def delete_finished(sender, instance, origin=None, tombstone=None, **kwargs):
+    """
+    Collect the row's tombstone; after the last row of the delete, number
+    them all. The rows of a cascade are deleted and the conversation
+    summaries updated by then, so the counter is the last lock taken.
+    """
+    pending = pending_delete(origin) if origin is not None else None
+    if pending is None:
+        # Not started from a model tracked by delete_started
+        number_tombstones([tombstone] if tombstone else [])
+        return
+    if tombstone:
+        pending['tombstones'].append(tombstone)
+    if sender is root_model(origin):
+        pending['remaining'] -= 1
+        if not pending['remaining']:
+            del _deletes.pending[id(origin)]
+            number_tombstones(pending['tombstones'])
+
+
+def leave_tombstone(sender, instance, **kwargs):
+    kind = next(kind for kind, (model, _) in SYNC_KINDS.items() if model is sender)
+    user_ids = message_audience(instance) if sender is Message else [instance.patient_id]
+    delete_finished(sender, instance, tombstone=(kind, instance.pk, user_ids) if user_ids else None, **kwargs)
+
+
+# Deletes of synced rows and of the people owning them (cascades)
+for model in (*(model for model, _ in SYNC_KINDS.values()), User, Patient, Therapeute):
+    pre_delete.connect(delete_started, sender=model, dispatch_uid=f'sync_delete_started_{model.__name__}')
+for model, _ in SYNC_KINDS.values():
+    # After the conversation summary handlers (imported above), so a message
+    # delete updates its summaries before the counter is locked
+    post_delete.connect(leave_tombstone, sender=model, dispatch_uid=f'sync_tombstone_{model.__name__}')
+for model in (User, Patient, Therapeute):
+    post_delete.connect(delete_finished, sender=model, dispatch_uid=f'sync_delete_finished_{model.__name__}')
+
+
+def visible_rows(kind, user):
+    model = SYNC_KINDS[kind][0]
+    if model is Message:
+        return Message.objects.filter(
+            Q(patient_id__in=Patient.objects.filter(user_id=user.id).values('id'))
+            | Q(therapeute_id__in=Therapeute.objects.filter(user_id=user.id).values('id'))
+        ).select_related('patient__user', 'therapeute__user')
+    return model.objects.filter(patient_id=user.id)
+
+
+def tagged(kind, queryset, limit):
+    for row in queryset.order_by('change_seq')[:limit]:
+        yield row.change_seq, kind, row
+
+
+def collect_changes(user, token=None, limit=500):
+    """
+    Changes visible to the user after the token, oldest first, at most
+    `limit` of them. Without a token everything is returned (no tombstones).
+    """
+    since = 0
+    # Read before the tables: anything committed after it is picked up by
+    # the queries or by the next sync
+    counter = SyncCounter.objects.filter(pk=1).values('value', 'pruned').first() or {'value': 0, 'pruned': 0}
+    if token:
+        since = decode_token(token)
+        if since < counter['pruned']:
+            raise SyncTokenExpired()
+
+    # Each source is already ordered by change_seq, limit + 1 tells if there is more
+    sources = [
+        tagged(kind, visible_rows(kind, user).filter(change_seq__gt=since), limit + 1)
+        for kind in SYNC_KINDS
+    ]
+    if since:
+        sources.append(tagged(None, Tombstone.objects.filter(user_id=user.id, change_seq__gt=since), limit + 1))
+
+    changes = list(islice(merge(*sources, key=lambda change: change[0]), limit + 1))
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    updated = {kind: [] for kind in SYNC_KINDS}
+    deleted = {kind: [] for kind in SYNC_KINDS}
+    for _, kind, row in changes:
+        if kind is None:
+            deleted[row.kind].append(row.object_id)
+        else:
+            updated[kind].append(row)
+
+    last_seq = changes[-1][0] if changes else since
+    return {
+        'token': encode_token(last_seq if more else max(last_seq, counter['value'])),
+        'more': more,
+        'changes': {
+            kind: SYNC_KINDS[kind][1](rows, many=True).data
+            for kind, rows in updated.items()
+        },
+        'deleted': deleted,
+    }
@@ -1,3 +1,1714 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, connections, router
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import AsyncClient, RequestFactory, TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from . import authentication, bulk, llm
+from .analytics import analyze_users
+from .chatcache import ChatReplyCache, normalize, set_chat_cache
+from .conversations import mark_read
+from .gateway import ConcurrencyLimit, LLMCircuitOpen, LLMGateway, LLMRateLimited, LLMTimeout, TokenBucket, set_gateway
+from .httpcache import ResponseCache, bump_versions, entries_scope
+from .insights import insight_cache_key
+from .jobs import ABANDONED_ERROR, run_pending_jobs
+from .models import User, Patient, Therapeute, Message, Humeur, Sommeil, Journal, AIJob, Tombstone, ConversationSummary, SyncCounter, RevokedToken
+from .projections import Projection, projection
+from .prompts import INSIGHT_PROMPTS, estimate_tokens
+from .consumers import conversation_socket
+from .pubsub import InMemoryPubSub, conversation_channel, get_pubsub
+from .routers import PIN_COOKIE, ReplicaStickinessMiddleware, replica_reads
+from .serializers import HumeurSerializer, JournalSerializer, MessageSerializer, PatientSerializer, SommeilSerializer, TherapistListSerializer
+from .sync import encode_token
 
 # Create your tests here.
+
+
+def create_patient(username='patient'):
+    user = User.objects.create_user(username=username, email=f'{username}@healme.test', password='pass', user_type='patient')
+    return Patient.objects.create(user=user)
+
+
+def create_therapist(username='therapist'):
+    user = User.objects.create_user(username=username, email=f'{username}@healme.test', password='pass', user_type='therapeute')
+    return Therapeute.objects.create(user=user)
+
+
+class ConversationPollingTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient()
+        self.therapist = create_therapist()
+        self.url = f'/api/conversation/{self.patient.id}/{self.therapist.id}/'
+        self.client = APIClient()
+
+    def send(self, contenu, sender_type='patient'):
+        return Message.objects.create(patient=self.patient, therapeute=self.therapist, contenu=contenu, sender_type=sender_type)
+
+    def test_first_poll_then_delta(self):
+        self.send('Bonjour')
+        second = self.send('Salut', 'therapeute')
+
+        response = self.client.get(self.url, {'since': 0})
+        self.assertEqual([row['contenu'] for row in response.json()['messages']], ['Bonjour', 'Salut'])
+        self.assertEqual(response.json()['cursor'], second.id)
+        self.assertIn('ETag', response)
+
+        third = self.send('Ça va ?')
+        delta = self.client.get(self.url, {'since': response.json()['cursor']}).json()
+        self.assertEqual([row['id'] for row in delta['messages']], [third.id])
+        self.assertEqual(delta['cursor'], third.id)
+
+        # Without since the whole conversation, as before
+        self.assertEqual(len(self.client.get(self.url).json()), 3)
+
+    def test_unchanged_conversation_answers_304(self):
+        message = self.send('Bonjour')
+        response = self.client.get(self.url, {'since': message.id})
+        self.assertEqual(response.json(), {'messages': [], 'cursor': message.id})
+
+        response = self.client.get(self.url, {'since': message.id}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.send('Salut', 'therapeute')
+        response = self.client.get(self.url, {'since': message.id}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 1)
+
+    def test_invalid_since(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'since must be a message id'})
+
+
+class InMemoryPubSubTests(SimpleTestCase):
+    def test_publish_reaches_subscribers_of_the_channel_only(self):
+        async def scenario():
+            pubsub = InMemoryPubSub()
+            watched = pubsub.subscribe('conversation.1.2')
+            other = pubsub.subscribe('conversation.1.3')
+
+            self.assertEqual(pubsub.publish('conversation.1.2', {'n': 1}), 1)
+            self.assertEqual(await asyncio.wait_for(watched.get(), 1), {'n': 1})
+            self.assertTrue(other.queue.empty())
+
+            watched.close()
+            other.close()
+            self.assertEqual(pubsub.publish('conversation.1.2', {'n': 2}), 0)
+
+        asyncio.run(scenario())
+
+
+class ConversationSocketTests(TestCase):
+    def test_send_message_is_pushed_to_connected_socket(self):
+        patient = create_patient()
+        therapist = create_therapist()
+        channel = conversation_channel(patient.id, therapist.id)
+        incoming = asyncio.Queue()
+        outgoing = asyncio.Queue()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def connect():
+            await incoming.put({'type': 'websocket.connect'})
+            scope = {'type': 'websocket', 'path': f'/ws/conversation/{patient.id}/{therapist.id}/'}
+            socket = asyncio.ensure_future(conversation_socket(scope, incoming.get, outgoing.put))
+            self.assertEqual((await asyncio.wait_for(outgoing.get(), 1))['type'], 'websocket.accept')
+            return socket
+
+        async def receive_and_disconnect(socket):
+            frame = await asyncio.wait_for(outgoing.get(), 1)
+            await incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+            await asyncio.wait_for(socket, 1)
+            return json.loads(frame['text'])
+
+        socket = loop.run_until_complete(connect())
+        # The view runs here, in the test's thread and transaction, while the socket waits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/send-message/', {
+                'patient_id': patient.id,
+                'therapist_id': therapist.id,
+                'contenu': 'hello',
+                'sender_type': 'patient',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        payload = loop.run_until_complete(receive_and_disconnect(socket))
+        self.assertEqual(payload['message']['id'], Message.objects.get().id)
+        self.assertEqual(payload['message']['contenu'], 'hello')
+        self.assertEqual(get_pubsub().subscriber_count(channel), 0)
+
+    def test_send_message_publishes_to_conversation(self):
+        patient = create_patient()
+        therapist = create_therapist()
+        subscription = get_pubsub().subscribe(conversation_channel(patient.id, therapist.id))
+        self.addCleanup(subscription.close)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/send-message/', {
+                'patient_id': patient.id,
+                'therapist_id': therapist.id,
+                'contenu': 'Bonjour',
+                'sender_type': 'therapeute',
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        payload = subscription.queue.get_nowait()
+        self.assertEqual(payload['message']['id'], Message.objects.get().id)
+        self.assertEqual(payload['message']['sender_type'], 'therapeute')
+
+
+class MessageQueryPlanTests(TestCase):
+    """The chat queries must be served by the Message indexes, not a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_patient()
+        cls.therapist = create_therapist()
+        Message.objects.bulk_create([
+            Message(patient=cls.patient, therapeute=cls.therapist, contenu=str(i), sender_type='patient')
+            for i in range(20)
+        ])
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheaper to scan, make the planner show its index choice
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan)
+        elif connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            self.assertNotRegex(plan, r'\bSCAN core_message\b')
+        else:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+        self.assertIn(index_name, plan)
+
+    def test_conversation_history_uses_conversation_index(self):
+        queryset = Message.objects.filter(
+            patient_id=self.patient.id, therapeute_id=self.therapist.id
+        ).order_by('date')
+        self.assertUsesIndex(queryset, 'message_conversation_idx')
+
+    def test_conversation_cursor_uses_cursor_index(self):
+        queryset = Message.objects.filter(
+            patient_id=self.patient.id, therapeute_id=self.therapist.id
+        ).order_by('-id').values_list('id', flat=True)[:1]
+        self.assertUsesIndex(queryset, 'message_conv_cursor_idx')
+
+    def test_therapist_inbox_uses_inbox_index(self):
+        queryset = Message.objects.filter(therapeute_id=self.therapist.id).order_by('-date')
+        self.assertUsesIndex(queryset, 'message_therapist_inbox_idx')
+
+    def test_unread_count_uses_partial_index(self):
+        # Same filter as the unread badge counts, count() drops the ordering
+        queryset = Message.objects.filter(
+            therapeute_id=self.therapist.id,
+            patient_id=self.patient.id,
+            sender_type='patient',
+            is_read=False
+        ).order_by()
+        self.assertUsesIndex(queryset, 'message_unread_idx')
+
+
+class TherapistInboxTests(TestCase):
+    def setUp(self):
+        self.therapist = create_therapist()
+        self.url = f'/api/api/therapist/{self.therapist.id}/conversations/'
+
+    def add_patients(self, count):
+        for _ in range(count):
+            patient = create_patient(f'patient{Patient.objects.count()}')
+            Message.objects.create(patient=patient, therapeute=self.therapist, contenu='Bonjour', sender_type='patient')
+            Message.objects.create(patient=patient, therapeute=self.therapist, contenu='Salut', sender_type='therapeute')
+
+    def test_inbox_runs_a_constant_number_of_queries(self):
+        self.add_patients(2)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        self.add_patients(8)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 10)
+        self.assertEqual(response.json()[0]['last_message']['content'], 'Salut')
+
+        # Paged: the count, then the page
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'limit': 3})
+        self.assertEqual(len(response.json()['results']), 3)
+
+
+class TherapistListTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def add_therapists(self, count):
+        for _ in range(count):
+            therapist = create_therapist(f'therapist{Therapeute.objects.count()}')
+            Message.objects.create(patient=self.patient, therapeute=therapist, contenu='Bonjour', sender_type='patient')
+            Message.objects.create(patient=self.patient, therapeute=therapist, contenu='Salut', sender_type='therapeute')
+
+    def test_list_runs_a_constant_number_of_queries(self):
+        self.add_therapists(2)
+        # The list and its ETag version
+        with self.assertNumQueries(2):
+            self.client.get('/api/therapists/')
+
+        self.add_therapists(8)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/therapists/')
+        self.assertEqual(len(response.json()), 10)
+
+    def test_list_reports_unread_count_and_last_message(self):
+        self.add_therapists(1)
+        other_patient = create_patient('other')
+        therapist = Therapeute.objects.get()
+        Message.objects.create(patient=other_patient, therapeute=therapist, contenu='Not yours', sender_type='therapeute')
+
+        row = self.client.get('/api/therapists/').json()[0]
+
+        self.assertEqual(row['username'], therapist.user.username)
+        self.assertEqual(row['unread_count'], 1)
+        self.assertEqual(row['last_message']['content'], 'Salut')
+        self.assertEqual(row['last_message']['sender_type'], 'therapeute')
+
+
+class ConversationSummaryTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient()
+        self.therapist = create_therapist()
+        self.client = APIClient()
+
+    def send(self, contenu, sender_type):
+        return Message.objects.create(patient=self.patient, therapeute=self.therapist, contenu=contenu, sender_type=sender_type)
+
+    def summary(self, side):
+        return ConversationSummary.objects.get(patient=self.patient, therapeute=self.therapist, side=side)
+
+    def test_sending_counts_unread_for_the_reader(self):
+        self.send('Bonjour', 'patient')
+        self.send('Ça va ?', 'patient')
+        last = self.send('Salut', 'therapeute')
+
+        self.assertEqual(self.summary('therapeute').unread_count, 2)
+        self.assertEqual(self.summary('patient').unread_count, 1)
+        self.assertEqual(self.summary('patient').last_message_id, last.id)
+        self.assertEqual(self.summary('therapeute').last_sender_type, 'therapeute')
+
+    def test_mark_read_endpoint_marks_messages_in_one_go(self):
+        first = self.send('1', 'patient')
+        self.send('2', 'patient')
+        self.send('3', 'patient')
+
+        response = self.client.post(
+            f'/api/conversation/{self.patient.id}/{self.therapist.id}/read/',
+            {'reader': 'therapeute', 'up_to': first.id}, format='json'
+        )
+        self.assertEqual(response.json(), {'marked': 1, 'unread_count': 2})
+
+        response = self.client.post(
+            f'/api/conversation/{self.patient.id}/{self.therapist.id}/read/',
+            {'reader': 'therapeute'}, format='json'
+        )
+        self.assertEqual(response.json(), {'marked': 2, 'unread_count': 0})
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+        self.assertEqual(self.summary('therapeute').unread_count, 0)
+
+    def test_mark_read_rejects_unknown_reader(self):
+        self.send('1', 'patient')
+        response = self.client.post(
+            f'/api/conversation/{self.patient.id}/{self.therapist.id}/read/', {'reader': 'admin'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleting_messages_recomputes_the_summary(self):
+        self.send('Bonjour', 'patient')
+        last = self.send('Salut', 'patient')
+        last.delete()
+        self.assertEqual(self.summary('therapeute').unread_count, 1)
+        self.assertEqual(self.summary('therapeute').last_message_preview, 'Bonjour')
+
+        Message.objects.all().delete()
+        self.assertFalse(ConversationSummary.objects.exists())
+
+    def test_therapist_inbox_reads_summaries(self):
+        other = create_patient('other')
+        self.send('Bonjour', 'patient')
+        Message.objects.create(patient=other, therapeute=self.therapist, contenu='Hello', sender_type='patient')
+        Message.objects.create(patient=other, therapeute=self.therapist, contenu='Merci', sender_type='therapeute')
+
+        response = self.client.get(f'/api/api/therapist/{self.therapist.id}/conversations/')
+        rows = response.json()
+
+        self.assertEqual([row['patient_id'] for row in rows], [other.id, self.patient.id])
+        self.assertEqual(rows[0]['last_message']['content'], 'Merci')
+        self.assertEqual(rows[0]['unread_count'], 1)
+        self.assertEqual(rows[1]['unread_count'], 1)
+
+
+class StubLLMMixin:
+    """Answer every LLM call locally and start each test with an empty cache"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.llm = llm.StubClient(reply='Go for a walk.')
+        llm.set_client(self.llm)
+        self.addCleanup(llm.set_client, None)
+        # Fresh limits, metrics and chat reply cache
+        set_gateway(None)
+        set_chat_cache(None)
+        self.addCleanup(set_gateway, None)
+        self.addCleanup(set_chat_cache, None)
+
+
+@override_settings(HEALME_JOB_MODE='eager')
+class AIJobTests(StubLLMMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+        Humeur.objects.create(patient=self.patient.user, date='2025-01-01', niveau=3, description='Tired')
+        self.client = APIClient()
+
+    def test_async_insight_returns_job_then_result(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1')
+        self.assertEqual(response.status_code, 202)
+
+        job = self.client.get(f"/api/ai-jobs/{response.json()['job_id']}/").json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'], 'Go for a walk.')
+
+        # The job filled the insight cache, the next request answers directly
+        response = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ai_insight'], 'Go for a walk.')
+        self.assertEqual(len(self.llm.models.prompts), 1)
+
+    def test_identical_queued_insights_share_one_job(self):
+        with override_settings(HEALME_JOB_MODE='worker'):
+            first = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1').json()
+            second = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1').json()
+        self.assertEqual(first['job_id'], second['job_id'])
+
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(AIJob.objects.get().status, 'done')
+
+    def test_async_chat_reply(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ai-chat/', {'message': "I can't sleep", 'async': True}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(AIJob.objects.get().result, 'Go for a walk.')
+        self.assertIn("I can't sleep", self.llm.models.prompts[0])
+
+    def test_failed_job_reports_error(self):
+        self.llm.models.generate_content = mock.Mock(side_effect=RuntimeError('quota exceeded'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ai-chat/', {'message': 'Hello', 'async': True}, format='json')
+
+        job = self.client.get(f"/api/ai-jobs/{response.json()['job_id']}/").json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'quota exceeded')
+
+    def test_lost_jobs_are_failed_and_queued_again(self):
+        with override_settings(HEALME_JOB_MODE='worker'):
+            lost = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1').json()
+            crashed = self.client.post('/api/ai-chat/', {'message': 'Hello', 'async': True}, format='json').json()
+        AIJob.objects.filter(id=crashed['job_id']).update(status='running')
+        # Dispatch lost on a restart, and a worker that died mid job
+        AIJob.objects.update(updated_at=timezone.now() - datetime.timedelta(minutes=11))
+
+        with override_settings(HEALME_JOB_MODE='worker'):
+            retry = self.client.get(f'/api/moods/{self.patient.user.id}/insights/?async=1').json()
+        self.assertNotEqual(retry['job_id'], lost['job_id'])
+        job = self.client.get(f"/api/ai-jobs/{lost['job_id']}/").json()
+        self.assertEqual((job['status'], job['error']), ('failed', ABANDONED_ERROR))
+
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(AIJob.objects.get(id=retry['job_id']).status, 'done')
+        self.assertEqual(AIJob.objects.get(id=crashed['job_id']).status, 'failed')
+
+    @override_settings(HEALME_PRECOMPUTE_INSIGHTS=True)
+    def test_new_entry_precomputes_insight(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/humeurs/', {
+                'patient': self.patient.user.id,
+                'date': '2025-01-02',
+                'niveau': 4,
+                'description': 'Better'
+            }, format='json')
+
+        job = AIJob.objects.get()
+        self.assertEqual((job.kind, job.status), ('insight', 'done'))
+        self.assertIn('Better', self.llm.models.prompts[0])
+
+
+class InsightCacheTests(StubLLMMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+        self.entry = Humeur.objects.create(patient=self.patient.user, date='2025-01-01', niveau=3, description='Tired')
+        self.client = APIClient()
+
+    def get_insight(self):
+        response = self.client.get(f'/api/moods/{self.patient.user.id}/insights/')
+        self.assertEqual(response.json()['ai_insight'], 'Go for a walk.')
+        return len(self.llm.models.prompts)
+
+    def test_repeat_requests_are_answered_from_the_cache(self):
+        self.assertEqual([self.get_insight() for _ in range(3)], [1, 1, 1])
+
+    def test_edits_outside_the_api_invalidate_the_insight(self):
+        self.get_insight()
+        # As from the admin: same count and newest id, other content
+        self.entry.description = 'Rested'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entry.save()
+        self.assertEqual(self.get_insight(), 2)
+
+    def test_writes_by_other_workers_invalidate_the_insight(self):
+        self.get_insight()
+        # Their write changes the version in the database, not this worker's cached insight
+        Humeur.objects.filter(pk=self.entry.pk).update(niveau=1)
+        bump_versions(entries_scope('mood', self.patient.user.id))
+        self.assertIsNotNone(cache.get(insight_cache_key(self.patient.user.id, 'mood')))
+        self.assertEqual(self.get_insight(), 2)
+
+    def test_other_kinds_keep_their_insight(self):
+        self.get_insight()
+        with self.captureOnCommitCallbacks(execute=True):
+            Sommeil.objects.create(patient=self.patient.user, date='2025-01-01', dureeHeures=7, qualite='Bonne')
+        self.assertEqual(self.get_insight(), 1)
+
+
+class SlowAsyncModels:
+    """Async genai models API that takes a while and counts overlapping calls"""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    async def generate_content(self, model, contents, **kwargs):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.05)
+            return llm.StubResponse(f'reply to {contents}')
+        finally:
+            self.running -= 1
+
+
+class AsyncAIViewTests(StubLLMMixin, TestCase):
+    async def test_async_chat_requests_run_concurrently(self):
+        # Every middleware must be async capable, else the views are serialized
+        models = SlowAsyncModels()
+        llm.set_client(mock.Mock(aio=mock.Mock(models=models)))
+        client = AsyncClient()
+
+        responses = await asyncio.gather(*(
+            client.post('/api/aio/ai-chat/', {'message': f'I feel anxious ({i})'}, content_type='application/json')
+            for i in range(5)
+        ))
+
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        self.assertEqual(models.max_running, 5)
+
+    async def test_async_chat_reply(self):
+        response = await AsyncClient().post('/api/aio/ai-chat/', {'message': 'I feel anxious'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'reply': 'Go for a walk.'})
+
+    async def test_async_chat_reply_rejects_empty_message(self):
+        response = await AsyncClient().post('/api/aio/ai-chat/', {'message': ' '}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_insight_is_cached(self):
+        patient = await Patient.objects.acreate(user=await User.objects.acreate(username='p', email='p@healme.test'))
+        await Humeur.objects.acreate(patient=patient.user, date='2025-01-01', niveau=2, description='Sad')
+
+        for _ in range(2):
+            response = await AsyncClient().get(f'/api/aio/moods/{patient.user.id}/insights/')
+            self.assertEqual(response.json(), {'ai_insight': 'Go for a walk.'})
+        self.assertEqual(len(self.llm.models.prompts), 1)
+
+    async def test_async_insight_without_entries(self):
+        user = await User.objects.acreate(username='p', email='p@healme.test')
+        response = await AsyncClient().get(f'/api/aio/sleep/{user.id}/insights/')
+        self.assertEqual(response.json(), {'sleep': [], 'ai_insight': 'No sleep data to analyze.'})
+
+
+class StreamingChatTests(StubLLMMixin, TestCase):
+    def parse_events(self, body):
+        events = []
+        for block in body.strip().split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append((lines.get('event'), json.loads(lines['data'])))
+        return events
+
+    def test_stream_sends_deltas_then_full_reply(self):
+        response = APIClient().post('/api/ai-chat/', {'message': 'Hello', 'stream': True}, format='json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = self.parse_events(b''.join(response.streaming_content).decode())
+        self.assertEqual(events[0], (None, {'delta': 'Go '}))
+        self.assertEqual(events[-1], ('done', {'reply': 'Go for a walk.'}))
+        self.assertEqual(''.join(data['delta'] for event, data in events[:-1]), 'Go for a walk.')
+
+    def test_stream_reports_errors_as_event(self):
+        self.llm.models.generate_content_stream = mock.Mock(side_effect=RuntimeError('quota exceeded'))
+        response = APIClient().post('/api/ai-chat/?stream=1', {'message': 'Hello'}, format='json')
+
+        events = self.parse_events(b''.join(response.streaming_content).decode())
+        self.assertEqual(events, [('error', {'error': 'quota exceeded'})])
+
+    def open_circuit(self):
+        gateway = LLMGateway(failure_threshold=1)
+        gateway.breaker.record_failure()
+        set_gateway(gateway)
+
+    def test_stream_answers_503_when_the_circuit_is_open(self):
+        self.open_circuit()
+        response = APIClient().post('/api/ai-chat/', {'message': 'Hello', 'stream': True}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    async def test_async_stream_answers_503_when_the_circuit_is_open(self):
+        self.open_circuit()
+        response = await AsyncClient().post(
+            '/api/aio/ai-chat/', {'message': 'Hello', 'stream': True}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    async def test_async_stream(self):
+        response = await AsyncClient().post(
+            '/api/aio/ai-chat/', {'message': 'Hello', 'stream': True}, content_type='application/json'
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(self.parse_events(body)[-1], ('done', {'reply': 'Go for a walk.'}))
+
+
+@override_settings(HEALME_PROMPT_TOKEN_BUDGET=600, HEALME_PROMPT_RECENT_ENTRIES=10, HEALME_PROMPT_SUMMARY_WEEKS=8)
+class PromptBuilderTests(TestCase):
+    def setUp(self):
+        self.user = create_patient().user
+
+    def add_days(self, start, days):
+        first_day = datetime.date(2020, 1, 1) + datetime.timedelta(days=start)
+        dates = [first_day + datetime.timedelta(days=i) for i in range(days)]
+        Humeur.objects.bulk_create([
+            Humeur(patient=self.user, date=day, niveau=day.day % 5 + 1, description='Une journee ' * 10)
+            for day in dates
+        ])
+        Sommeil.objects.bulk_create([
+            Sommeil(patient=self.user, date=day, dureeHeures=6 + day.day % 3, qualite=['bonne', 'moyenne'][day.day % 2])
+            for day in dates
+        ])
+        Journal.objects.bulk_create([
+            Journal(patient=self.user, date=day, contenu='Aujourd\'hui ' * 100)
+            for day in dates
+        ])
+
+    def test_prompt_size_stays_constant_as_history_grows(self):
+        self.add_days(0, 120)
+        sizes = {kind: len(build(self.user.id)) for kind, build in INSIGHT_PROMPTS.items()}
+
+        self.add_days(120, 900)
+        for kind, build in INSIGHT_PROMPTS.items():
+            prompt = build(self.user.id)
+            self.assertLessEqual(estimate_tokens(prompt), 600, kind)
+            self.assertLessEqual(abs(len(prompt) - sizes[kind]), 50, kind)
+
+    def test_older_history_is_summarised(self):
+        self.add_days(0, 60)
+        mood_prompt = INSIGHT_PROMPTS['mood'](self.user.id)
+        sleep_prompt = INSIGHT_PROMPTS['sleep'](self.user.id)
+
+        self.assertEqual(mood_prompt.count('Niveau'), 10)
+        self.assertIn('Earlier weeks:', mood_prompt)
+        self.assertRegex(mood_prompt, r'Week of \d{4}-\d{2}-\d{2}: average niveau \d\.\d over \d entries')
+        self.assertRegex(sleep_prompt, r'Quality (bonne|moyenne): \d+ nights, average \d\.\d hours')
+
+    def test_short_history_is_quoted_whole(self):
+        Humeur.objects.create(patient=self.user, date='2025-01-01', niveau=4, description='Calme')
+        prompt = INSIGHT_PROMPTS['mood'](self.user.id)
+        self.assertIn('2025-01-01: Niveau 4 - Calme', prompt)
+        self.assertNotIn('Earlier weeks:', prompt)
+
+    def test_moods_without_a_note_are_left_out(self):
+        Humeur.objects.create(patient=self.user, date='2025-01-01', niveau=4, description='Calme')
+        Humeur.objects.create(patient=self.user, date='2025-01-02', niveau=1, description='')
+        prompt = INSIGHT_PROMPTS['mood'](self.user.id)
+        self.assertIn('2025-01-01: Niveau 4 - Calme', prompt)
+        self.assertNotIn('2025-01-02', prompt)
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = create_patient().user
+        Journal.objects.bulk_create([
+            Journal(patient=self.user, date=datetime.date(2025, 1, 1) + datetime.timedelta(days=i // 2), contenu=f'Entry {i}')
+            for i in range(9)
+        ])
+        self.client = APIClient()
+
+    def test_cursor_walks_all_entries_newest_first(self):
+        url = f'/api/users/{self.user.id}/journal/?limit=4'
+        seen = []
+        while url:
+            page = self.client.get(url).json()
+            seen += [(row['date'], row['id']) for row in page['results']]
+            url = page['next']
+
+        self.assertEqual(len(seen), 9)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_without_paging_params_returns_plain_list(self):
+        response = self.client.get(f'/api/users/{self.user.id}/journal/')
+        self.assertEqual(len(response.json()), 9)
+
+    def test_date_range_and_field_projection(self):
+        response = self.client.get(f'/api/users/{self.user.id}/journal/?from=2025-01-02&to=2025-01-03&fields=id,date')
+        rows = response.json()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(set(rows[0]), {'id', 'date'})
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in ('cursor=nope', 'from=yesterday', 'fields=id,secret'):
+            response = self.client.get(f'/api/users/{self.user.id}/journal/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+
+class WellnessRollupTests(TestCase):
+    def setUp(self):
+        self.user = create_patient().user
+        self.client = APIClient()
+
+    def post_entries(self):
+        # 2025-03-03 is a Monday, the 9th ends that week
+        for day, niveau in (('2025-03-03', 2), ('2025-03-03', 4), ('2025-03-09', 5), ('2025-03-10', 1)):
+            self.client.post('/api/humeurs/', {'patient': self.user.id, 'date': day, 'niveau': niveau}, format='json')
+        for day, hours, quality in (('2025-03-04', 7.0, 'bonne'), ('2025-03-05', 5.0, 'mauvaise')):
+            self.client.post('/api/sommeils/', {'patient': self.user.id, 'date': day, 'dureeHeures': hours, 'qualite': quality}, format='json')
+        self.client.post('/api/journaux/', {'patient': self.user.id, 'date': '2025-03-05', 'contenu': 'Bien'}, format='json')
+
+    def trends(self, query=''):
+        return self.client.get(f'/api/users/{self.user.id}/trends/{query}').json()
+
+    def test_writes_keep_weekly_trends_up_to_date(self):
+        self.post_entries()
+        first_week, second_week = self.trends()
+
+        self.assertEqual(first_week['week_start'], '2025-03-03')
+        self.assertEqual((first_week['mood_entries'], first_week['mood_min'], first_week['mood_max']), (3, 2, 5))
+        self.assertAlmostEqual(first_week['mood_average'], 11 / 3)
+        self.assertEqual(first_week['sleep_average_hours'], 6.0)
+        self.assertEqual(first_week['sleep_quality'], {'bonne': 1, 'mauvaise': 1})
+        self.assertEqual(first_week['journal_entries'], 1)
+        self.assertEqual((second_week['week_start'], second_week['mood_entries']), ('2025-03-10', 1))
+
+        humeur = Humeur.objects.get(date='2025-03-10')
+        self.client.patch(f'/api/humeurs/{humeur.id}/', {'date': '2025-03-08'}, format='json')
+        self.assertEqual(len(self.trends()), 1)
+
+        for humeur in Humeur.objects.filter(date='2025-03-03'):
+            self.client.delete(f'/api/humeurs/{humeur.id}/')
+        week = self.trends()[0]
+        self.assertEqual((week['mood_entries'], week['mood_min'], week['mood_max']), (2, 1, 5))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.post_entries()
+        daily, weekly = self.trends('?period=day'), self.trends()
+
+        call_command('rebuild_wellness_rollups', stdout=io.StringIO())
+
+        self.assertEqual(self.trends('?period=day'), daily)
+        self.assertEqual(self.trends(), weekly)
+        self.assertEqual(len(self.trends('?period=day&from=2025-03-04&to=2025-03-05')), 2)
+
+
+class TrendAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = create_patient().user
+        self.other = create_patient('other').user
+        self.start = datetime.date(2025, 3, 1)
+
+    def log(self, user, moods, sleeps):
+        for offset, (niveau, hours) in enumerate(zip(moods, sleeps)):
+            day = self.start + datetime.timedelta(days=offset)
+            if niveau is not None:
+                Humeur.objects.create(patient=user, date=day, niveau=niveau)
+            if hours is not None:
+                Sommeil.objects.create(patient=user, date=day, dureeHeures=hours, qualite='bonne')
+
+    def test_batch_metrics(self):
+        self.log(self.user, [4, 4, 5, 4, None, 1, 3, 4], [7, 7, 8, 7, 6, 4, 6, 7])
+        self.log(self.other, [3, 3], [None, None])
+        end = self.start + datetime.timedelta(days=7)
+
+        results = analyze_users([self.user.id, self.other.id], self.start, end, window=3)
+        mine, theirs = results[self.user.id], results[self.other.id]
+
+        self.assertEqual(mine['mood_moving_average'][:6], [4.0, 4.0, 4.33, 4.33, 4.5, 2.5])
+        self.assertEqual(mine['mood_drops'], ['2025-03-06'])
+        self.assertGreater(mine['mood_sleep_correlation'], 0.9)
+        self.assertEqual(mine['streaks'], {'current': 3, 'longest': 4})
+        self.assertEqual(theirs['streaks'], {'current': 0, 'longest': 2})
+        self.assertIsNone(theirs['mood_sleep_correlation'])
+        self.assertEqual(theirs['sleep_moving_average'], [None] * 8)
+
+    def test_endpoint(self):
+        today = timezone.localdate()
+        Humeur.objects.create(patient=self.user, date=today, niveau=3)
+
+        response = APIClient().get(f'/api/users/{self.user.id}/analytics/?days=10')
+        body = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body['dates']), 10)
+        self.assertEqual(body['end'], today.isoformat())
+        self.assertEqual(body['streaks']['current'], 1)
+        self.assertEqual(APIClient().get(f'/api/users/{self.user.id}/analytics/?days=x').status_code, 400)
+
+
+class BulkEntryTests(TestCase):
+    def setUp(self):
+        self.user = create_patient().user
+        self.client = APIClient()
+
+    def bulk(self, url, payload):
+        return self.client.post(url, payload, format='json')
+
+    def test_bulk_create_in_one_request(self):
+        moods = [{'patient': self.user.id, 'date': f'2025-03-0{day}', 'niveau': day % 5 + 1} for day in range(1, 8)]
+
+        with self.assertNumQueries(26):
+            # 8 patient lookups, 1 insert, 2 for the sync numbers and 1 to store them, a fixed number of rollup queries (patient lock included), 1 ETag version
+            response = self.bulk('/api/humeurs/bulk/', moods + [{'patient': self.user.id, 'niveau': 3}])
+        results = response.json()['results']
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in results], ['created'] * 7 + ['invalid'])
+        self.assertIn('date', results[7]['errors'])
+        self.assertEqual(Humeur.objects.count(), 7)
+        self.assertEqual(set(Humeur.objects.values_list('id', flat=True)), {result['id'] for result in results[:7]})
+        weeks = self.client.get(f'/api/users/{self.user.id}/trends/').json()
+        self.assertEqual([week['mood_entries'] for week in weeks], [2, 5])
+
+    def test_upsert_is_idempotent(self):
+        Sommeil.objects.create(patient=self.user, date='2025-03-01', dureeHeures=5, qualite='mauvaise')
+        payload = {'upsert': True, 'entries': [
+            {'patient': self.user.id, 'date': '2025-03-01', 'dureeHeures': 8, 'qualite': 'bonne'},
+            {'patient': self.user.id, 'date': '2025-03-02', 'dureeHeures': 6, 'qualite': 'moyenne'},
+        ]}
+
+        first = self.bulk('/api/sommeils/bulk/', payload)
+        second = self.bulk('/api/sommeils/bulk/', payload)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual([result['status'] for result in first.json()['results']], ['updated', 'created'])
+        self.assertEqual([result['status'] for result in second.json()['results']], ['updated', 'updated'])
+        self.assertEqual(
+            list(Sommeil.objects.order_by('date').values_list('dureeHeures', 'qualite')),
+            [(8.0, 'bonne'), (6.0, 'moyenne')]
+        )
+
+    def test_upsert_matches_rows_written_while_waiting_for_the_lock(self):
+        items = [(0, {'patient': self.user, 'date': datetime.date(2025, 3, 1), 'dureeHeures': 8, 'qualite': 'bonne'})]
+        lock_patients = bulk.lock_patients
+
+        def lock_after_another_batch(user_ids):
+            # The same batch, retried, commits while this one waits for the lock
+            with mock.patch.object(bulk, 'lock_patients', lock_patients):
+                bulk.bulk_save_entries(Sommeil, items, upsert=True)
+            lock_patients(user_ids)
+
+        with mock.patch.object(bulk, 'lock_patients', lock_after_another_batch):
+            results, _ = bulk.bulk_save_entries(Sommeil, items, upsert=True)
+
+        self.assertEqual(results[0]['status'], 'updated')
+        self.assertEqual(Sommeil.objects.count(), 1)
+
+    def test_rejects_non_list(self):
+        response = self.bulk('/api/journaux/bulk/', {'patient': self.user.id})
+        self.assertEqual(response.status_code, 400)
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient()
+        self.therapist = create_therapist()
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def sync(self, token=None, **params):
+        if token:
+            params['token'] = token
+        return self.client.get('/api/sync/', params)
+
+    def test_first_sync_then_deltas_with_tombstones(self):
+        kept = Humeur.objects.create(patient=self.patient.user, date='2025-03-01', niveau=3)
+        removed = Journal.objects.create(patient=self.patient.user, date='2025-03-01', contenu='Bien')
+        Humeur.objects.create(patient=create_patient('other').user, date='2025-03-01', niveau=1)
+
+        first = self.sync().json()
+        self.assertEqual([row['id'] for row in first['changes']['humeurs']], [kept.id])
+        self.assertEqual(len(first['changes']['journaux']), 1)
+        self.assertFalse(first['more'])
+        self.assertEqual(self.sync(first['token']).json()['changes']['humeurs'], [])
+
+        kept.niveau = 5
+        kept.save()
+        removed_id = removed.id
+        removed.delete()
+        Message.objects.create(patient=self.patient, therapeute=self.therapist, contenu='Bonjour', sender_type='patient')
+
+        delta = self.sync(first['token']).json()
+        self.assertEqual([row['niveau'] for row in delta['changes']['humeurs']], [5])
+        self.assertEqual(delta['changes']['journaux'], [])
+        self.assertEqual(delta['deleted']['journaux'], [removed_id])
+        self.assertEqual([row['contenu'] for row in delta['changes']['messages']], ['Bonjour'])
+
+        # The therapist sees the message too
+        self.client.force_authenticate(self.therapist.user)
+        self.assertEqual(len(self.sync().json()['changes']['messages']), 1)
+
+    def test_sync_numbers_are_taken_after_the_signal_handlers(self):
+        counter_in_handlers = []
+
+        def handler(sender, instance, **kwargs):
+            counter_in_handlers.append(SyncCounter.objects.values_list('value', flat=True).first())
+
+        before = SyncCounter.objects.values_list('value', flat=True).first()
+        post_save.connect(handler, sender=Message, dispatch_uid='test_counter_in_handlers')
+        self.addCleanup(post_save.disconnect, sender=Message, dispatch_uid='test_counter_in_handlers')
+        message = Message.objects.create(patient=self.patient, therapeute=self.therapist, contenu='Bonjour', sender_type='patient')
+
+        # The counter row was not locked yet while the handlers ran
+        self.assertEqual(counter_in_handlers, [before])
+        message.refresh_from_db()
+        self.assertEqual(message.change_seq, SyncCounter.objects.get().value)
+
+    def assert_counter_taken_last(self, queries):
+        """Once the counter is locked, only tombstones and the numbers taken are written"""
+        sql = [query['sql'] for query in queries]
+        first = next(index for index, statement in enumerate(sql) if statement.startswith('UPDATE "core_synccounter"'))
+        for statement in sql[first:]:
+            self.assertTrue(
+                '"core_synccounter"' in statement or statement.startswith(('INSERT INTO "core_tombstone"', 'SAVEPOINT', 'RELEASE'))
+                or (statement.startswith('UPDATE') and '"change_seq"' in statement),
+                statement
+            )
+
+    def test_writes_and_deletes_lock_the_sync_counter_last(self):
+        other = create_therapist('other-therapist')
+        messages = [
+            Message.objects.create(patient=self.patient, therapeute=therapist, contenu='Bonjour', sender_type='therapeute')
+            for therapist in (self.therapist, other, self.therapist)
+        ]
+        Humeur.objects.create(patient=self.patient.user, date='2025-03-01', niveau=3)
+
+        with CaptureQueriesContext(connection) as queries:
+            Journal.objects.create(patient=self.patient.user, date='2025-03-01', contenu='Bien')
+        self.assert_counter_taken_last(queries)
+        with CaptureQueriesContext(connection) as queries:
+            mark_read(self.patient.id, self.therapist.id, 'patient')
+        self.assert_counter_taken_last(queries)
+        items = [(0, {'patient': self.patient.user, 'date': datetime.date(2025, 3, 1), 'dureeHeures': 7, 'qualite': 'bonne'})]
+        with CaptureQueriesContext(connection) as queries:
+            bulk.bulk_save_entries(Sommeil, items, upsert=True)
+        self.assert_counter_taken_last(queries)
+
+        # Several messages, then a cascade over every synced model
+        with CaptureQueriesContext(connection) as queries:
+            Message.objects.filter(pk__in=[message.pk for message in messages[:2]]).delete()
+        self.assert_counter_taken_last(queries)
+        with CaptureQueriesContext(connection) as queries:
+            self.patient.user.delete()
+        self.assert_counter_taken_last(queries)
+
+        # One number per deleted row, shared by the users who saw it
+        tombstones = list(Tombstone.objects.values_list('kind', 'change_seq').order_by('change_seq'))
+        self.assertEqual(len({seq for _, seq in tombstones}), 6)
+        self.assertEqual({kind for kind, _ in tombstones}, {'humeurs', 'journaux', 'messages', 'sommeils'})
+        self.assertEqual(tombstones[-1][1], SyncCounter.objects.get().value)
+
+    def test_pages_and_bulk_writes(self):
+        self.client.post('/api/sommeils/bulk/', [
+            {'patient': self.patient.user.id, 'date': f'2025-03-0{day}', 'dureeHeures': 7, 'qualite': 'bonne'}
+            for day in range(1, 6)
+        ], format='json')
+
+        token, pages, dates = None, 0, []
+        while True:
+            page = self.sync(token, limit=2).json()
+            dates += [row['date'] for row in page['changes']['sommeils']]
+            token, pages = page['token'], pages + 1
+            if not page['more']:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(dates, [f'2025-03-0{day}' for day in range(1, 6)])
+
+    def test_expired_and_invalid_tokens(self):
+        Humeur.objects.create(patient=self.patient.user, date='2025-03-01', niveau=3).delete()
+        token = encode_token(1)
+        Tombstone.objects.update(created_at=timezone.now() - datetime.timedelta(days=100))
+        call_command('prune_sync_tombstones', stdout=io.StringIO())
+
+        self.assertEqual(self.sync(token).status_code, 410)
+        self.assertEqual(self.sync('garbage').status_code, 400)
+        self.client.logout()
+        self.client.force_authenticate(None)
+        self.assertEqual(self.sync().status_code, 403)
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = create_patient()
+        self.client = APIClient()
+        self.client.force_login(self.patient.user)
+
+    def check_auth(self):
+        return self.client.get('/api/check-auth/').json()
+
+    def test_profile_is_cached_until_saved(self):
+        # Session, user and its groups/permissions, then the profile in one query
+        with self.assertNumQueries(5):
+            self.assertEqual(self.check_auth()['profile']['id'], self.patient.id)
+        with self.assertNumQueries(4):
+            self.assertIsNone(self.check_auth()['profile']['phone'])
+
+        self.patient.phone = '0600000000'
+        self.patient.save()
+        self.assertEqual(self.check_auth()['profile']['phone'], '0600000000')
+
+    def test_user_without_profile(self):
+        user = User.objects.create_user(username='admin', email='admin@example.com', password='pass')
+        self.client.force_login(user)
+        self.assertIsNone(self.check_auth()['profile'])
+        with self.assertNumQueries(4):
+            self.assertIsNone(self.check_auth()['profile'])
+
+
+class TokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = create_patient()
+        self.patient.user.set_password('secret')
+        self.patient.user.save()
+        self.client = APIClient()
+
+    def obtain(self):
+        return self.client.post('/api/token/', {'email': self.patient.user.email, 'password': 'secret'}, format='json').json()
+
+    def sync(self, access):
+        return self.client.get('/api/sync/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_token_requests_skip_session_and_user_queries(self):
+        tokens = self.obtain()
+        self.assertEqual(tokens['profile']['id'], self.patient.id)
+
+        # The revocation check, then the sync queries: counter and the four tables
+        with self.assertNumQueries(6):
+            self.assertEqual(self.sync(tokens['access']).status_code, 200)
+        self.assertEqual(self.client.get('/api/check-auth/', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}").json()['user']['id'], self.patient.user.id)
+
+        self.assertEqual(self.client.post('/api/token/', {'email': self.patient.user.email, 'password': 'wrong'}, format='json').status_code, 401)
+        self.assertEqual(self.sync(tokens['access'] + 'x').status_code, 401)
+
+    def test_refresh_rotates_and_revoke(self):
+        tokens = self.obtain()
+        renewed = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').json()
+        self.assertEqual(self.sync(renewed['access']).status_code, 200)
+        # A refresh token is single use
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').status_code, 401)
+
+        self.client.post('/api/token/revoke/', {'refresh': renewed['refresh']}, format='json', HTTP_AUTHORIZATION=f"Bearer {renewed['access']}")
+        self.assertEqual(self.sync(renewed['access']).status_code, 401)
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': renewed['refresh']}, format='json').status_code, 401)
+
+        # Log out everywhere
+        self.client.post('/api/token/revoke/', {'all': True}, format='json', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.sync(tokens['access']).status_code, 401)
+
+    def refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': token}, format='json')
+
+    def test_revocations_are_kept_in_the_database(self):
+        tokens, other = self.obtain(), self.obtain()
+        self.client.post('/api/token/revoke/', {'refresh': tokens['refresh']}, format='json', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        # Another worker, a restart or an evicted cache entry
+        cache.clear()
+        self.assertEqual(self.sync(tokens['access']).status_code, 401)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+        self.assertEqual(self.sync(other['access']).status_code, 200)
+
+        self.client.post('/api/token/revoke/', {'all': True}, format='json', HTTP_AUTHORIZATION=f"Bearer {other['access']}")
+        cache.clear()
+        self.assertEqual(self.sync(other['access']).status_code, 401)
+        self.assertEqual(self.refresh(other['refresh']).status_code, 401)
+
+        RevokedToken.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        call_command('prune_revoked_tokens', stdout=io.StringIO())
+        self.assertFalse(RevokedToken.objects.exists())
+
+
+    def test_refresh_reloads_the_user(self):
+        tokens = self.obtain()
+        user = self.patient.user
+        user.user_type = 'therapeute'
+        user.save()
+        renewed = self.refresh(tokens['refresh']).json()
+        self.assertEqual(authentication.read_token(renewed['access'], authentication.ACCESS_SALT)['typ'], 'therapeute')
+
+        user.is_active = False
+        user.save()
+        response = self.refresh(renewed['refresh'])
+        self.assertEqual((response.status_code, response.json()['error']), (401, 'User inactive or deleted.'))
+
+        user.is_active = True
+        user.save()
+        refresh = self.obtain()['refresh']
+        user.delete()
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_concurrent_refreshes_with_one_token_only_one_succeeds(self):
+        refresh = self.obtain()['refresh']
+        real_read_token = authentication.read_token
+        inner = {}
+
+        def read_token(token, salt):
+            claims = real_read_token(token, salt)
+            if 'tokens' not in inner:
+                # A second refresh reads the same token before the first one revokes it
+                inner['tokens'] = None
+                inner['tokens'] = authentication.refresh_tokens(token)
+            return claims
+
+        with mock.patch('core.authentication.read_token', side_effect=read_token):
+            with self.assertRaisesMessage(AuthenticationFailed, 'Token revoked.'):
+                authentication.refresh_tokens(refresh)
+        self.assertIn('access', inner['tokens'])
+
+    @override_settings(HEALME_ACCESS_TOKEN_TTL=-1)
+    def test_expired_access_token(self):
+        response = self.sync(self.obtain()['access'])
+        self.assertEqual((response.status_code, response.json()['detail']), (401, 'Token expired.'))
+
+
+@override_settings(HEALME_REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.routes = []
+        patcher = mock.patch('core.routers.replica_enabled', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handle(self, request, write=False):
+        @replica_reads
+        def view(request):
+            if write:
+                router.db_for_write(Humeur)
+            self.routes.append(router.db_for_read(Humeur))
+            return HttpResponse()
+
+        request.user = getattr(request, 'user', AnonymousUser())
+        return ReplicaStickinessMiddleware(view)(request)
+
+    def test_reads_go_to_replica_until_the_client_writes(self):
+        response = self.handle(self.factory.get('/'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        response = self.handle(self.factory.get('/'), write=True)
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.handle(request)
+
+        self.assertEqual(self.routes, ['replica', 'default', 'default'])
+        self.assertEqual(router.db_for_read(Humeur), 'default')
+
+    def test_writes_pin_the_user_without_cookies(self):
+        user = create_patient().user
+        request = self.factory.post('/')
+        request.user = user
+        self.handle(request, write=True)
+
+        request = self.factory.get('/')
+        request.user = user
+        self.handle(request)
+        self.handle(self.factory.get('/'))
+
+        self.assertEqual(self.routes, ['default', 'default', 'replica'])
+
+    async def test_async_requests_are_tracked_too(self):
+        async def view(request):
+            router.db_for_write(Humeur)
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = self.factory.post('/')
+        request.user = AnonymousUser()
+        response = await middleware(request)
+
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(router.db_for_read(Humeur), 'default')
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """orjson must render exactly what DRF's JSONRenderer renders"""
+
+    def test_output_matches_drf_renderer(self):
+        from decimal import Decimal
+        import numpy as np
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import ORJSONRenderer
+
+        data = {
+            'utc': datetime.datetime(2024, 1, 2, 3, 4, 5, 123, tzinfo=datetime.timezone.utc),
+            'offset': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5),
+            'day': datetime.date(2024, 1, 2),
+            'time': datetime.time(3, 4, 5),
+            'duration': datetime.timedelta(hours=7, minutes=30),
+            'decimal': Decimal('7.50'),
+            'average': np.float64(3.5),
+            'text': 'Journée calme',
+            'rows': [{'id': 1, 'is_read': False, 'sender_type': None}],
+            1: 'int key',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_data_orjson_cannot_encode_is_rendered_by_drf(self):
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import ORJSONRenderer
+
+        data = {'id': 2 ** 70, 'text': 'Journée calme'}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_parser_reads_json_and_rejects_garbage(self):
+        from rest_framework.exceptions import ParseError
+        from .renderers import ORJSONParser
+
+        self.assertEqual(ORJSONParser().parse(io.BytesIO('{"contenu": "Ça va"}'.encode())), {'contenu': 'Ça va'})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"contenu": NaN}'))
+
+
+class ORJSONRequestTests(TestCase):
+    def test_api_renders_and_parses_with_orjson(self):
+        patient = create_patient()
+        therapist = create_therapist()
+        response = self.client.post('/api/send-message/', json.dumps({
+            'patient_id': patient.id, 'therapist_id': therapist.id, 'contenu': 'Bonjour', 'sender_type': 'patient'
+        }), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.accepted_renderer.__class__.__name__, 'ORJSONRenderer')
+        self.assertEqual(response.json()['contenu'], 'Bonjour')
+        self.assertTrue(response.json()['date'].endswith('Z'))
+
+
+class ProjectionTests(TestCase):
+    """The values() projections must return exactly what the serializers return"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_patient()
+        cls.patient.dateNaissance = datetime.date(1990, 5, 17)
+        cls.patient.save()
+        cls.therapist = create_therapist()
+        Patient.objects.create(user=None)
+        for i in range(3):
+            Message.objects.create(patient=cls.patient, therapeute=cls.therapist, contenu=f'm{i}', sender_type='patient')
+        Message.objects.create(patient=None, therapeute=cls.therapist, contenu='orphan', sender_type='therapeute')
+        user = cls.patient.user
+        Humeur.objects.create(patient=user, date=datetime.date(2024, 3, 1), niveau=4, description='calme')
+        Sommeil.objects.create(patient=user, date=datetime.date(2024, 3, 1), dureeHeures=7.5, qualite='bonne')
+        Journal.objects.create(patient=user, date=datetime.date(2024, 3, 1), contenu='Journée')
+        cls.cases = (
+            (MessageSerializer, Message.objects.order_by('id')),
+            (HumeurSerializer, Humeur.objects.order_by('id')),
+            (SommeilSerializer, Sommeil.objects.order_by('id')),
+            (JournalSerializer, Journal.objects.order_by('id')),
+            (PatientSerializer, Patient.objects.order_by('id')),
+        )
+
+    def test_projection_matches_serializer(self):
+        for serializer_class, queryset in self.cases:
+            with self.subTest(serializer_class.__name__):
+                expected = json.loads(json.dumps(serializer_class(queryset, many=True).data))
+                self.assertEqual(projection(serializer_class)(queryset), expected)
+
+    def test_projection_keeps_requested_fields(self):
+        rows = projection(HumeurSerializer, ['niveau', 'date'])(Humeur.objects.all())
+        self.assertEqual(rows, [{'date': '2024-03-01', 'niveau': 4}])
+        # One projection whatever the order or repeats of the names
+        self.assertIs(projection(HumeurSerializer, ['date', 'niveau', 'date']), projection(HumeurSerializer, ['niveau', 'date']))
+
+    def test_projection_rejects_computed_fields(self):
+        with self.assertRaises(TypeError):
+            Projection(TherapistListSerializer)
+
+    def test_conversation_runs_one_query(self):
+        url = f'/api/conversation/{self.patient.id}/{self.therapist.id}/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([row['patient_name'] for row in response.json()], ['patient'] * 3)
+        self.assertEqual(response.json()[0]['therapist_name'], 'therapist')
+
+    def test_message_list_runs_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/messages/', {'therapist_id': self.therapist.id})
+        self.assertEqual(len(response.json()), 4)
+
+
+class ConditionalResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = create_patient()
+        self.user = self.patient.user
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/users/{self.user.id}/mood/'
+
+    def add_mood(self, day, niveau=3):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Humeur.objects.create(patient=self.user, date=day, niveau=niveau)
+
+    def test_history_answers_if_none_match_with_the_version_lookup_only(self):
+        self.add_mood(datetime.date(2024, 3, 1))
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Other query strings are other representations
+        self.assertNotEqual(self.client.get(self.url, {'limit': 1})['ETag'], etag)
+
+    def test_writes_change_the_etag(self):
+        mood = self.add_mood(datetime.date(2024, 3, 1))
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mood.niveau = 5
+            mood.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['niveau'], 5)
+
+        # Bulk writes send no signals
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/humeurs/bulk/', [
+                {'patient': self.user.id, 'date': '2024-03-02', 'niveau': 2}
+            ], format='json')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_versions_are_kept_in_the_database(self):
+        """Other workers, restarts and cache evictions see the same versions"""
+        mood = self.add_mood(datetime.date(2024, 3, 1))
+        etag = self.client.get(self.url)['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        mood.niveau = 5
+        mood.save()
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['niveau'], 5)
+
+    def test_if_modified_since(self):
+        self.add_mood(datetime.date(2024, 3, 1))
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_therapist_list_follows_messages_and_logins_do_not_count(self):
+        therapist = create_therapist()
+        etag = self.client.get('/api/therapists/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('login'), {'username': 'therapist', 'password': 'pass'})
+        self.assertEqual(self.client.get('/api/therapists/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(patient=self.patient, therapeute=therapist, contenu='Salut', sender_type='therapeute')
+        response = self.client.get('/api/therapists/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['unread_count'], 1)
+
+    def test_patient_list_follows_renames(self):
+        etag = self.client.get('/api/all-patients/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+        response = self.client.get('/api/all-patients/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()[0]['patient_name'], 'renamed')
+
+    def test_response_cache_serves_repeat_loads(self):
+        self.add_mood(datetime.date(2024, 3, 1))
+        with mock.patch('core.httpcache._response_cache', ResponseCache(max_entries=10, ttl=60)):
+            first = self.client.get(self.url).json()
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url)
+        self.assertEqual(response.json(), first)
+
+    def test_response_cache_evicts_least_recently_used_and_expired(self):
+        response_cache = ResponseCache(max_entries=2, ttl=60)
+        response_cache.set('a', 1)
+        response_cache.set('b', 2)
+        response_cache.get('a')
+        response_cache.set('c', 3)
+        self.assertIsNone(response_cache.get('b'))
+        self.assertEqual(response_cache.get('a'), 1)
+
+        with mock.patch('core.httpcache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(response_cache.get('a'))
+
+
+class StaleReplicaTests(TestCase):
+    """Two SQLite databases: the 'replica' still holds the rows before the last write"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test runner has set up 'default', each test rolls it back too
+        connections.settings['replica'] = {**connections['default'].settings_dict, 'NAME': ':memory:'}
+        cls.databases = cls.databases | {'replica'}
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.databases = cls.databases - {'replica'}
+        super().tearDownClass()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        cache.clear()
+        self.patient = create_patient()
+        self.user = self.patient.user
+        first = Humeur.objects.create(patient=self.user, date=datetime.date(2024, 3, 1), niveau=3)
+        User.objects.using('replica').bulk_create([User(id=self.user.id, username='patient', email='patient@healme.test')])
+        Humeur.objects.using('replica').bulk_create([Humeur(id=first.id, patient_id=self.user.id, date=first.date, niveau=3)])
+
+        # Written by another client, not replicated yet
+        with self.captureOnCommitCallbacks(execute=True):
+            Humeur.objects.create(patient=self.user, date=datetime.date(2024, 3, 2), niveau=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_conditional_responses_are_read_from_the_primary(self):
+        url = f'/api/users/{self.user.id}/mood/'
+        with mock.patch('core.httpcache._response_cache', ResponseCache(max_entries=10, ttl=60)):
+            response = self.client.get(url)
+            self.assertEqual(sorted(row['niveau'] for row in response.json()), [3, 5])
+            # The copy kept under the new ETag is the fresh one too
+            self.assertEqual(len(self.client.get(url).json()), 2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_reads_without_validators_still_use_the_replica(self):
+        therapist = create_therapist()
+        Message.objects.create(patient=self.patient, therapeute=therapist, contenu='Salut', sender_type='patient')
+        self.assertEqual(self.client.get(f'/api/conversation/{self.patient.id}/{therapist.id}/').json(), [])
+
+
+class FakeLLMModels:
+    """Fake genai models API: counts calls, can block, fail or be slow"""
+
+    def __init__(self):
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.release = None
+        self.delay = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if self.release is not None:
+                self.release.wait(5)
+            time.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return llm.StubResponse(f'reply to {contents}')
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class FakeLLMClient:
+    def __init__(self):
+        self.models = FakeLLMModels()
+        self.aio = llm.AsyncStubClient(self.models)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LLMGatewayTests(TestCase):
+    def setUp(self):
+        self.client_fake = FakeLLMClient()
+        self.models = self.client_fake.models
+        llm.set_client(self.client_fake)
+        self.addCleanup(llm.set_client, None)
+        self.addCleanup(set_gateway, None)
+        set_chat_cache(None)
+        self.addCleanup(set_chat_cache, None)
+
+    def use_gateway(self, **options):
+        gateway = LLMGateway(**options)
+        set_gateway(gateway)
+        return gateway
+
+    def run_threads(self, prompts):
+        with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+            return [future.result() for future in [pool.submit(llm.generate_text, prompt) for prompt in prompts]]
+
+    def test_identical_prompts_share_one_call(self):
+        gateway = self.use_gateway()
+        self.models.release = threading.Event()
+
+        def release_when_all_waiting():
+            while gateway.metrics()['coalesced'] < 4:
+                time.sleep(0.005)
+            self.models.release.set()
+
+        threading.Thread(target=release_when_all_waiting).start()
+        replies = self.run_threads(['Same prompt'] * 5)
+
+        self.assertEqual(replies, ['reply to Same prompt'] * 5)
+        self.assertEqual(self.models.calls, 1)
+        metrics = gateway.metrics()
+        self.assertEqual((metrics['requests'], metrics['calls'], metrics['coalesced']), (5, 1, 4))
+
+        # Once answered, the next identical prompt is a new call
+        self.models.release = None
+        llm.generate_text('Same prompt')
+        self.assertEqual(self.models.calls, 2)
+
+    def test_concurrency_is_capped(self):
+        self.use_gateway(max_concurrency=2)
+        self.models.delay = 0.05
+        self.run_threads([f'prompt {i}' for i in range(6)])
+        self.assertEqual(self.models.calls, 6)
+        self.assertEqual(self.models.max_running, 2)
+
+    def test_slot_waiters_are_served_in_arrival_order(self):
+        slots = ConcurrencyLimit(1)
+        self.assertTrue(slots.try_acquire())
+        order = []
+
+        async def wait(name):
+            if await slots.aacquire(timeout=1):
+                order.append(name)
+                slots.release()
+
+        async def main():
+            waiters = [asyncio.ensure_future(wait(name)) for name in 'abc']
+            await asyncio.sleep(0)
+            # A newcomer does not jump the queue
+            self.assertFalse(slots.try_acquire())
+            started = time.monotonic()
+            slots.release()
+            await asyncio.gather(*waiters)
+            return time.monotonic() - started
+
+        self.assertLess(asyncio.run(main()), 0.01)
+        self.assertEqual(order, ['a', 'b', 'c'])
+        self.assertEqual((slots.active, len(slots.waiters)), (0, 0))
+
+        # Timed out waiters leave the queue, threads are woken by release
+        self.assertTrue(slots.try_acquire())
+        self.assertFalse(slots.acquire(timeout=0.01))
+        self.assertFalse(asyncio.run(slots.aacquire(timeout=0.01)))
+        threading.Timer(0.01, slots.release).start()
+        self.assertTrue(slots.acquire(timeout=1))
+        self.assertEqual((slots.active, len(slots.waiters)), (1, 0))
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+        self.assertEqual([bucket.reserve(5), bucket.reserve(5)], [0, 0])
+        self.assertEqual(bucket.reserve(5), 1.0)
+        # The next caller would wait 2 s
+        self.assertIsNone(bucket.reserve(1.5))
+        clock.now += 3
+        self.assertEqual(bucket.reserve(0), 0)
+
+    def test_rate_limited_callers_are_turned_down(self):
+        gateway = self.use_gateway(rate=0.001, burst=1, queue_timeout=0)
+        llm.generate_text('first')
+        with self.assertRaises(LLMRateLimited):
+            llm.generate_text('second')
+        self.assertEqual(gateway.metrics()['rate_limited'], 1)
+
+    def test_slow_calls_time_out(self):
+        gateway = self.use_gateway(timeout=0.05)
+        self.models.delay = 0.5
+        with self.assertRaises(LLMTimeout):
+            llm.generate_text('slow')
+        self.assertEqual(gateway.metrics()['timeouts'], 1)
+
+    def test_circuit_opens_after_failures_and_closes_after_a_trial(self):
+        clock = FakeClock()
+        gateway = self.use_gateway(failure_threshold=2, reset_timeout=30, clock=clock)
+        self.models.error = RuntimeError('503 from Gemini')
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                llm.generate_text('prompt')
+
+        with self.assertRaises(LLMCircuitOpen) as opened:
+            llm.generate_text('prompt')
+        self.assertEqual(self.models.calls, 2)
+        self.assertEqual(opened.exception.retry_after, 30)
+        self.assertEqual(gateway.metrics()['circuit'], 'open')
+
+        clock.now += 30
+        self.models.error = None
+        self.assertEqual(llm.generate_text('prompt'), 'reply to prompt')
+        metrics = gateway.metrics()
+        self.assertEqual((metrics['circuit'], metrics['failed'], metrics['circuit_rejected']), ('closed', 2, 1))
+
+    def test_async_identical_prompts_share_one_call(self):
+        gateway = self.use_gateway()
+
+        async def ask():
+            return await asyncio.gather(*(llm.agenerate_text('Same prompt') for _ in range(3)))
+
+        self.assertEqual(asyncio.run(ask()), ['reply to Same prompt'] * 3)
+        self.assertEqual(self.models.calls, 1)
+        self.assertEqual(gateway.metrics()['coalesced'], 2)
+
+    def test_chat_answers_503_when_the_circuit_is_open(self):
+        self.use_gateway(failure_threshold=1)
+        self.models.error = RuntimeError('down')
+        self.client.post('/api/ai-chat/', {'message': 'I feel anxious'}, content_type='application/json')
+
+        response = self.client.post('/api/ai-chat/', {'message': 'I feel anxious'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_metrics_endpoint_is_for_admins(self):
+        self.use_gateway()
+        llm.generate_text('prompt')
+        client = APIClient()
+        client.force_authenticate(create_patient().user)
+        self.assertEqual(client.get('/api/ai-metrics/').status_code, 403)
+
+        admin = User.objects.create_user(username='admin', email='admin@healme.test', password='pass', is_staff=True)
+        client.force_authenticate(admin)
+        response = client.get('/api/ai-metrics/')
+        self.assertEqual(response.json()['calls'], 1)
+        self.assertEqual(response.json()['circuit'], 'closed')
+
+
+class ChatReplyCacheTests(StubLLMMixin, TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize("  I CAN'T   sleep!! "), 'i cant sleep')
+        self.assertEqual(normalize('Je suis épuisée…'), 'je suis epuisee')
+
+    def test_repeated_messages_are_answered_from_the_cache(self):
+        first = self.client.post('/api/ai-chat/', {'message': 'I feel anxious'}, content_type='application/json')
+        second = self.client.post('/api/ai-chat/', {'message': 'i feel ANXIOUS!!'}, content_type='application/json')
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json(), {'reply': 'Go for a walk.'})
+        self.assertEqual(len(self.llm.models.prompts), 1)
+
+        # Streams use the same cache
+        response = self.client.post('/api/ai-chat/', {'message': 'I feel anxious', 'stream': True}, content_type='application/json')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('"reply": "Go for a walk."', body)
+        self.assertEqual(len(self.llm.models.prompts), 1)
+
+    def test_near_duplicates_match_unless_a_negation_differs(self):
+        chat_cache = ChatReplyCache(similarity=0.8)
+        chat_cache.set('I feel so anxious today', 'Breathe slowly.')
+
+        self.assertEqual(chat_cache.get('I feel anxious today'), 'Breathe slowly.')
+        self.assertIsNone(chat_cache.get("I don't feel anxious today"))
+        self.assertIsNone(chat_cache.get('My knee hurts'))
+
+        metrics = chat_cache.metrics()
+        self.assertEqual((metrics['similar_hits'], metrics['misses'], metrics['hit_rate']), (1, 2, 0.333))
+        self.assertIsNotNone(metrics['lookup_avg_us'])
+
+    def test_an_expired_near_duplicate_does_not_hide_a_valid_one(self):
+        clock = FakeClock()
+        chat_cache = ChatReplyCache(ttl=60, similarity=0.5, clock=clock)
+        chat_cache.set('I feel anxious today', 'Old reply.')
+        clock.now += 30
+        chat_cache.set('I feel so anxious', 'Breathe slowly.')
+        clock.now += 31
+
+        # The closest message has expired, the next one is still valid
+        self.assertEqual(chat_cache.get('Feel anxious today'), 'Breathe slowly.')
+        metrics = chat_cache.metrics()
+        self.assertEqual((metrics['similar_hits'], metrics['expired'], metrics['entries']), (1, 1, 1))
+
+    def test_size_ttl_and_long_messages(self):
+        clock = FakeClock()
+        chat_cache = ChatReplyCache(max_entries=2, ttl=60, max_chars=20, clock=clock)
+        chat_cache.set('one', '1')
+        chat_cache.set('two', '2')
+        chat_cache.get('one')
+        chat_cache.set('three', '3')
+        self.assertIsNone(chat_cache.get('two'))
+        self.assertEqual(chat_cache.get('one'), '1')
+
+        clock.now += 61
+        self.assertIsNone(chat_cache.get('one'))
+
+        chat_cache.set('a message longer than twenty characters', 'x')
+        self.assertIsNone(chat_cache.get('a message longer than twenty characters'))
+        metrics = chat_cache.metrics()
+        self.assertEqual((metrics['evicted'], metrics['expired'], metrics['bypassed']), (1, 1, 1))
+
+    def test_stats_endpoint_is_for_admins(self):
+        self.client.post('/api/ai-chat/', {'message': 'I feel anxious'}, content_type='application/json')
+        admin = User.objects.create_user(username='admin', email='admin@healme.test', password='pass', is_staff=True)
+        client = APIClient()
+        self.assertEqual(client.get('/api/ai-chat/cache-stats/').status_code, 403)
+        client.force_authenticate(admin)
+        stats = client.get('/api/ai-chat/cache-stats/').json()
+        self.assertEqual((stats['misses'], stats['stored'], stats['entries']), (1, 1, 1))
@@ -19,11 +19,18 @@ urlpatterns = [
     path('users/<int:user_id>/mood/', views.get_user_mood, name='user-mood-all'),
     path('users/<int:user_id>/sleep/', views.get_user_sleep, name='user-sleep-all'),
     path('users/<int:user_id>/journal/', views.get_user_journal, name='user-journal-all'),
+    path('users/<int:user_id>/trends/', views.get_user_trends, name='user-trends'),
+    path('users/<int:user_id>/analytics/', views.get_user_analytics, name='user-analytics'),
+    path('sync/', views.sync_changes, name='sync'),
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('check-auth/', views.check_auth, name='check_auth'),
+    path('token/', views.obtain_token, name='token'),
+    path('token/refresh/', views.refresh_token, name='token_refresh'),
+    path('token/revoke/', views.revoke_tokens, name='token_revoke'),
     path('conversation/<int:patient_id>/<int:therapist_id>/', get_conversation_messages),
+    path('conversation/<int:patient_id>/<int:therapist_id>/read/', views.mark_conversation_read, name='mark_conversation_read'),
     path('send-message/', send_message),
     path('api/therapist/<int:therapist_id>/conversations/', views.therapist_conversations, name='therapist_conversations'),
     path('all-patients/', views.all_patients, name='all_patients'),
@@ -33,5 +40,14 @@ urlpatterns = [
     path("sleep/<int:user_id>/insights/", get_user_sleep_insight),
     path("journal/<int:user_id>/insights/", get_user_journal_insight),
     path("ai-chat/", views.ai_chat_reply, name="ai_chat"),
+    path("ai-chat/cache-stats/", views.chat_cache_stats, name="ai_chat_cache_stats"),
+    path("ai-jobs/<uuid:job_id>/", views.get_ai_job, name="ai_job"),
+    path("ai-metrics/", views.llm_metrics, name="llm_metrics"),
+    # Async AI endpoints, meant to be served through asgi.py
+    path('aio/test-gemini/', views.AsyncGeminiTestView.as_view(), name='test-gemini-api-async'),
+    path("aio/moods/<int:user_id>/insights/", views.get_user_mood_insight_async),
+    path("aio/sleep/<int:user_id>/insights/", views.get_user_sleep_insight_async),
+    path("aio/journal/<int:user_id>/insights/", views.get_user_journal_insight_async),
+    path("aio/ai-chat/", views.ai_chat_reply_async, name="ai_chat_async"),
 
 ]
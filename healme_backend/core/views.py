@@ -1,8 +1,8 @@
 # core/views.py - Fixed with only one send_message function
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.contrib.auth import authenticate, login, logout
 from .models import *
 from .serializers import *
@@ -13,26 +13,89 @@ from django.shortcuts import get_object_or_404
 from .models import User, Humeur, Sommeil, Journal, Patient
 from .serializers import HumeurSerializer, SommeilSerializer, JournalSerializer
 from rest_framework.decorators import *
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views import View
-from google import genai
-from dotenv import load_dotenv
-import os
-
-load_dotenv()  # loads the .env file
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .pagination import ConversationPagination, DateKeysetPagination
+from .insights import INSIGHT_MODELS, get_cached_insight, insight_fingerprint, invalidate_insight, generate_insight, agenerate_insight
+from .jobs import ACTIVE_STATUSES, enqueue_job, enqueue_insight, fail_stale_jobs
+from .gateway import LLMUnavailable, get_gateway
+from .llm import MODEL_NAME, generate_text, agenerate_text, stream_text, astream_text
+from .prompts import build_chat_prompt
+from .profiles import get_profile_data
+from .projections import ProjectedListMixin, projection
+from .pubsub import publish_message
+from .rollups import refresh_days
+from .routers import ReplicaReadMixin, replica_reads
+from .analytics import analyze_users
+from .authentication import (
+    ACCESS_SALT, REFRESH_SALT, issue_tokens, read_token, refresh_tokens, revoke_token, revoke_user_tokens
+)
+from .bulk import bulk_save_entries
+from .chatcache import achat_reply, chat_reply, get_chat_cache
+from .conversations import mark_read
+from .httpcache import bump_versions, conditional, entries_scope, inbox_scope, user_entries
+from .sync import SyncTokenError, SyncTokenExpired, collect_changes
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+import datetime
+import itertools
+import json
+
+def history_response(request, queryset, serializer_class):
+    """
+    Shared by the user history views, newest first:
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD limit the date range,
+    ?fields=id,date,... only loads and returns those fields,
+    ?limit=&cursor= pages on (date, id).
+    """
+    params = request.query_params
+
+    for param, lookup in (('from', 'date__gte'), ('to', 'date__lte')):
+        if params.get(param):
+            day = parse_date(params[param])
+            if day is None:
+                raise ValidationError({param: 'Expected a YYYY-MM-DD date.'})
+            queryset = queryset.filter(**{lookup: day})
+
+    fields = None
+    if params.get('fields'):
+        fields = [field.strip() for field in params['fields'].split(',') if field.strip()]
+        unknown = set(fields) - set(serializer_class().fields)
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+
+    # Rows read with values(), shaped like serializer_class's output;
+    # date and id are always loaded for the ordering and the cursor
+    rows = projection(serializer_class, fields, extra=('id', 'date'))
+    values = rows.values(queryset.order_by('-date', '-id'))
+    paginator = DateKeysetPagination()
+    page = paginator.paginate_queryset(values, request)
+
+    if page is None:
+        return Response(rows.rows(values))
+    return paginator.get_paginated_response(rows.rows(page))
 
 @api_view(['GET'])
+@conditional(user_entries('mood'))
 def get_user_mood(request, user_id):
-    """Get ALL mood data for a user by user ID"""
+    """Get ALL mood data for a user by user ID (see history_response for paging)"""
     try:
         user = get_object_or_404(User, id=user_id)
         
         # Now filter directly by User (since models use User ForeignKey)
-        humeurs = Humeur.objects.filter(patient=user).order_by('-date')
-        serializer = HumeurSerializer(humeurs, many=True)
-        
-        return Response(serializer.data)
+        humeurs = Humeur.objects.filter(patient=user)
+        return history_response(request, humeurs, HumeurSerializer)
         
+    except ValidationError as e:
+        return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         print(f"Error in get_user_mood: {str(e)}")
         return Response(
@@ -41,17 +104,18 @@ def get_user_mood(request, user_id):
         )
 
 @api_view(['GET'])
+@conditional(user_entries('sleep'))
 def get_user_sleep(request, user_id):
-    """Get ALL sleep data for a user by user ID"""
+    """Get ALL sleep data for a user by user ID (see history_response for paging)"""
     try:
         user = get_object_or_404(User, id=user_id)
         
         # Filter directly by User
-        sommeils = Sommeil.objects.filter(patient=user).order_by('-date')
-        serializer = SommeilSerializer(sommeils, many=True)
-        
-        return Response(serializer.data)
+        sommeils = Sommeil.objects.filter(patient=user)
+        return history_response(request, sommeils, SommeilSerializer)
         
+    except ValidationError as e:
+        return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         print(f"Error in get_user_sleep: {str(e)}")
         return Response(
@@ -60,17 +124,18 @@ def get_user_sleep(request, user_id):
         )
 
 @api_view(['GET'])
+@conditional(user_entries('journal'))
 def get_user_journal(request, user_id):
-    """Get ALL journal data for a user by user ID"""
+    """Get ALL journal data for a user by user ID (see history_response for paging)"""
     try:
         user = get_object_or_404(User, id=user_id)
         
         # Filter directly by User
-        journaux = Journal.objects.filter(patient=user).order_by('-date')
-        serializer = JournalSerializer(journaux, many=True)
-        
-        return Response(serializer.data)
+        journaux = Journal.objects.filter(patient=user)
+        return history_response(request, journaux, JournalSerializer)
         
+    except ValidationError as e:
+        return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         print(f"Error in get_user_journal: {str(e)}")
         return Response(
@@ -78,6 +143,95 @@ def get_user_journal(request, user_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+@replica_reads
+def get_user_trends(request, user_id):
+    """
+    Mood/sleep/journal trends of a user, read from the rollup tables only.
+    ?period=week (default) or day, optional ?from=&to= dates.
+    """
+    try:
+        user = get_object_or_404(User, id=user_id)
+
+        period = request.query_params.get('period', 'week')
+        if period == 'week':
+            rollups = WeeklyWellness.objects.filter(patient=user)
+            date_field, serializer_class = 'week_start', WeeklyWellnessSerializer
+        elif period == 'day':
+            rollups = DailyWellness.objects.filter(patient=user)
+            date_field, serializer_class = 'date', DailyWellnessSerializer
+        else:
+            return Response({'period': 'period must be "week" or "day".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        for param, lookup in (('from', 'gte'), ('to', 'lte')):
+            if request.query_params.get(param):
+                day = parse_date(request.query_params[param])
+                if day is None:
+                    return Response({param: 'Expected a YYYY-MM-DD date.'}, status=status.HTTP_400_BAD_REQUEST)
+                rollups = rollups.filter(**{f'{date_field}__{lookup}': day})
+
+        serializer = serializer_class(rollups.order_by(date_field), many=True)
+        return Response(serializer.data)
+
+    except Exception as e:
+        print(f"Error in get_user_trends: {str(e)}")
+        return Response(
+            {"error": "Internal server error"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@replica_reads
+def get_user_analytics(request, user_id):
+    """
+    Mood/sleep analytics of a user over the last ?days= (default 90):
+    moving averages over ?window= days (default 7), mood-sleep correlation,
+    mood drops and logging streaks.
+    """
+    try:
+        user = get_object_or_404(User, id=user_id)
+
+        try:
+            days = min(max(int(request.query_params.get('days', 90)), 1), 3 * 366)
+            window = min(max(int(request.query_params.get('window', 7)), 1), 90)
+        except ValueError:
+            return Response({'error': 'days and window must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = timezone.localdate()
+        start = end - datetime.timedelta(days=days - 1)
+        return Response(analyze_users([user.id], start, end, window)[user.id])
+
+    except Exception as e:
+        print(f"Error in get_user_analytics: {str(e)}")
+        return Response(
+            {"error": "Internal server error"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    Delta sync for the mobile apps: every mood, sleep, journal and message
+    change of the logged in user since ?token= (all of them without a
+    token), with the ids of deleted rows. Pages of ?limit= changes (default
+    500), keep calling with the returned token while "more" is true.
+    """
+    try:
+        limit = min(max(int(request.query_params.get('limit', 500)), 1), 2000)
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return Response(collect_changes(request.user, request.query_params.get('token'), limit))
+    except SyncTokenError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except SyncTokenExpired:
+        return Response(
+            {'error': 'Sync token expired, sync again without a token'},
+            status=status.HTTP_410_GONE
+        )
+
 # ===== AUTHENTICATION VIEWS =====
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -163,13 +317,7 @@ def login_view(request):
             print(f"Login successful for: {user.username}")  # Debug
             
             # Get user profile based on user type
-            profile_data = None
-            if hasattr(user, 'patient'):
-                profile_data = PatientSerializer(user.patient).data
-            elif hasattr(user, 'therapeute'):
-                profile_data = TherapeuteSerializer(user.therapeute).data
-            elif hasattr(user, 'administrateur'):
-                profile_data = AdministrateurSerializer(user.administrateur).data
+            profile_data = get_profile_data(user)
             
             return Response({
                 'message': 'Login successful',
@@ -192,17 +340,69 @@ def logout_view(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def obtain_token(request):
+    """
+    Token login for the apps: same credentials as login_view, answers with
+    bearer tokens instead of opening a session
+    """
+    data = request.data
+    if 'email' not in data or 'password' not in data:
+        return Response({'error': 'Email and password are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    user_by_email = User.objects.filter(email=data['email']).first()
+    user = user_by_email and authenticate(username=user_by_email.username, password=data['password'])
+    if not user:
+        return Response({'error': 'Invalid email or password'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    return Response({
+        **issue_tokens(user),
+        'user': UserSerializer(user).data,
+        'profile': get_profile_data(user)
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def refresh_token(request):
+    """New access and refresh tokens for a refresh token, which can't be used again"""
+    token = request.data.get('refresh')
+    if not token:
+        return Response({'error': 'refresh is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(refresh_tokens(token))
+    except AuthenticationFailed as e:
+        return Response({'error': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def revoke_tokens(request):
+    """
+    Token logout: revokes the access token of the request and the given
+    refresh token, or every token of the user with {"all": true}
+    """
+    if request.data.get('all') in (True, 'true', '1'):
+        revoke_user_tokens(request.user.id)
+        return Response({'message': 'All tokens revoked'})
+
+    if isinstance(request.auth, dict):
+        revoke_token(request.auth, ACCESS_SALT)
+    if request.data.get('refresh'):
+        try:
+            claims = read_token(request.data['refresh'], REFRESH_SALT)
+        except AuthenticationFailed as e:
+            return Response({'error': str(e.detail)}, status=status.HTTP_400_BAD_REQUEST)
+        if claims['uid'] != request.user.id:
+            return Response({'error': 'Not your token'}, status=status.HTTP_403_FORBIDDEN)
+        revoke_token(claims, REFRESH_SALT)
+    return Response({'message': 'Token revoked'})
+
 @api_view(['GET'])
 def check_auth(request):
     """Check if user is authenticated"""
     if request.user.is_authenticated:
-        profile_data = None
-        if hasattr(request.user, 'patient'):
-            profile_data = PatientSerializer(request.user.patient).data
-        elif hasattr(request.user, 'therapeute'):
-            profile_data = TherapeuteSerializer(request.user.therapeute).data
-        elif hasattr(request.user, 'administrateur'):
-            profile_data = AdministrateurSerializer(request.user.administrateur).data
+        # Cached per user, see core/profiles.py
+        profile_data = get_profile_data(request.user)
             
         return Response({
             'authenticated': True,
@@ -212,40 +412,154 @@ def check_auth(request):
     else:
         return Response({'authenticated': False})
 
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(ReplicaReadMixin, ProjectedListMixin, viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
 
-class JournalViewSet(viewsets.ModelViewSet):
+# Entries accepted by one bulk request
+BULK_MAX_ENTRIES = 1000
+
+class WellnessEntryMixin:
+    """
+    Keeps data derived from the Journal/Humeur/Sommeil entries in step with
+    writes: the cached AI insight and the daily/weekly rollups.
+    """
+    insight_kind = None
+
+    def entries_changed(self, patient_id, day):
+        self.days_changed({(patient_id, day)})
+
+    def days_changed(self, keys):
+        """Refresh after writes touching these (patient id, date) pairs"""
+        refresh_days(keys)
+        for patient_id in {patient_id for patient_id, _ in keys}:
+            invalidate_insight(patient_id, self.insight_kind)
+            # Bulk writes send no signals
+            bump_versions(entries_scope(self.insight_kind, patient_id))
+            # Optionally have the new insight ready before the dashboard asks for it
+            if getattr(settings, 'HEALME_PRECOMPUTE_INSIGHTS', False):
+                enqueue_insight(patient_id, self.insight_kind)
+
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        self.entries_changed(instance.patient_id, instance.date)
+
+    def perform_update(self, serializer):
+        previous = (serializer.instance.patient_id, serializer.instance.date)
+        instance = serializer.save()
+        self.entries_changed(*previous)
+        if (instance.patient_id, instance.date) != previous:
+            self.entries_changed(instance.patient_id, instance.date)
+
+    def perform_destroy(self, instance):
+        patient_id, day = instance.patient_id, instance.date
+        instance.delete()
+        self.entries_changed(patient_id, day)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many entries in one request, e.g. a week of offline data.
+        Takes a list of entries (or {"entries": [...], "upsert": true});
+        with upsert an entry replaces the one of the same patient and date.
+        Valid entries are saved even when others are rejected, the response
+        has one result per entry.
+        """
+        data = request.data
+        upsert = request.query_params.get('upsert', '').lower() in ('1', 'true', 'yes')
+        if isinstance(data, dict):
+            upsert = upsert or data.get('upsert') in (True, 'true', '1')
+            data = data.get('entries')
+
+        if not isinstance(data, list):
+            return Response({'error': 'Expected a list of entries'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(data) > BULK_MAX_ENTRIES:
+            return Response(
+                {'error': f'At most {BULK_MAX_ENTRIES} entries per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The list serializer's child validates each entry on its own, so one
+        # bad entry does not reject the batch
+        child = self.get_serializer(data=data, many=True).child
+        valid, rejected = [], []
+        for index, item in enumerate(data):
+            try:
+                valid.append((index, child.run_validation(item)))
+            except ValidationError as e:
+                rejected.append({'index': index, 'status': 'invalid', 'errors': e.detail})
+
+        results, changed = bulk_save_entries(self.queryset.model, valid, upsert=upsert)
+        if changed:
+            self.days_changed(changed)
+
+        results = sorted(results + rejected, key=lambda result: result['index'])
+        return Response(
+            {'results': results},
+            status=status.HTTP_207_MULTI_STATUS if rejected else status.HTTP_201_CREATED
+        )
+
+class JournalViewSet(ReplicaReadMixin, ProjectedListMixin, WellnessEntryMixin, viewsets.ModelViewSet):
     queryset = Journal.objects.all()
     serializer_class = JournalSerializer
+    insight_kind = 'journal'
 
-class HumeurViewSet(viewsets.ModelViewSet):
+class HumeurViewSet(ReplicaReadMixin, ProjectedListMixin, WellnessEntryMixin, viewsets.ModelViewSet):
     queryset = Humeur.objects.all()
     serializer_class = HumeurSerializer
+    insight_kind = 'mood'
 
-class SommeilViewSet(viewsets.ModelViewSet):
+class SommeilViewSet(ReplicaReadMixin, ProjectedListMixin, WellnessEntryMixin, viewsets.ModelViewSet):
     queryset = Sommeil.objects.all()
     serializer_class = SommeilSerializer
+    insight_kind = 'sleep'
 
-class SessionViewSet(viewsets.ModelViewSet):
+class SessionViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Session.objects.all()
     serializer_class = SessionSerializer
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
 
 # core/views.py - Temporary fix for testing
-class TherapistViewSet(viewsets.ModelViewSet):
+def therapist_list_scopes(request):
+    """The therapists, and the badges of the current patient's conversations"""
+    if request.user.is_authenticated:
+        return ['therapists', inbox_scope(request.user.id)]
+    return ['therapists']
+
+class TherapistViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Therapeute.objects.all()
     serializer_class = TherapistListSerializer
 
+    def get_queryset(self):
+        queryset = Therapeute.objects.select_related('user')
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+
+        # Unread count and last message of the current patient's conversation
+        # with each therapist, read from its summary in the same query as the list
+        summary = ConversationSummary.objects.filter(
+            therapeute=OuterRef('pk'),
+            patient__user_id=user.id,
+            side='patient'
+        )
+
+        return queryset.annotate(
+            unread_count=Coalesce(Subquery(summary.values('unread_count')[:1]), 0),
+            last_message_content=Subquery(summary.values('last_message__contenu')[:1]),
+            last_message_date=Subquery(summary.values('last_activity')[:1]),
+            last_message_sender_type=Subquery(summary.values('last_sender_type')[:1])
+        )
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
 
+    @method_decorator(conditional(therapist_list_scopes))
     def list(self, request):
         # TEMPORARY: Allow access without authentication for testing
         # Remove this in production
@@ -254,34 +568,41 @@ class TherapistViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 # core/views.py - Update MessageViewSet
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ReplicaReadMixin, ProjectedListMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [AllowAny]  # Add this for testing
 
     def get_queryset(self):
         # Simplified - just return all messages for the therapist
+        # (names of both sides joined for MessageSerializer)
+        messages = Message.objects.select_related('patient__user', 'therapeute__user')
         therapist_id = self.request.query_params.get('therapist_id')
         if therapist_id:
-            return Message.objects.filter(therapeute_id=therapist_id).order_by('date')
-        return Message.objects.all().order_by('date')
+            return messages.filter(therapeute_id=therapist_id).order_by('date')
+        return messages.order_by('date')
 
     def perform_create(self, serializer):
         # Simplified for testing - always create as patient message
         therapist_id = self.request.data.get('therapeute')
-        serializer.save(
+        message = serializer.save(
             patient_id=1,  # Default patient ID for testing
             therapeute_id=therapist_id,
             sender_type='patient'
         )
+        transaction.on_commit(lambda: publish_message(message))
 
 # core/views.py - Remove auth verification from get_conversation_messages
 @api_view(['GET'])
 @permission_classes([AllowAny])  # Add this to allow any access
+@replica_reads
 def get_conversation_messages(request, patient_id, therapist_id):
     """
     Get messages between specific patient and therapist
     No authentication required for testing
+
+    Pass ?since=<message id> to only get the messages sent after that id,
+    together with the cursor to send on the next poll.
     """
     try:
         # REMOVED AUTH VERIFICATION - allow any access
@@ -289,15 +610,67 @@ def get_conversation_messages(request, patient_id, therapist_id):
         messages = Message.objects.filter(
             patient_id=patient_id,
             therapeute_id=therapist_id
-        ).order_by('date')
-        
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        )
+
+        # MessageSerializer's output, names joined in the same query
+        rows = projection(MessageSerializer)
+
+        since = request.query_params.get('since')
+        if since is None:
+            return Response(rows(messages.order_by('date')))
+
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'since must be a message id'}, status=400)
+
+        # Ids only grow, so the newest id is the version of the conversation
+        latest_id = messages.order_by('-id').values_list('id', flat=True).first() or 0
+        cursor = max(latest_id, since)
+        etag = f'"conversation-{patient_id}-{therapist_id}-{cursor}"'
+
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        if latest_id <= since:
+            new_messages = []
+        else:
+            new_messages = rows(messages.filter(id__gt=since).order_by('id'))
+
+        return Response({
+            'messages': new_messages,
+            'cursor': cursor
+        }, headers={'ETag': etag})
         
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def mark_conversation_read(request, patient_id, therapist_id):
+    """
+    Mark every message the reader received in the conversation as read
+    (up to ?up_to= / "up_to" message id if given). "reader" is "patient" or
+    "therapeute". Answers with the number marked and the unread count left.
+    """
+    reader = request.data.get('reader')
+    if reader not in ('patient', 'therapeute'):
+        return Response(
+            {'error': 'reader must be either "patient" or "therapeute"'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    up_to = request.data.get('up_to', request.query_params.get('up_to'))
+    try:
+        up_to = int(up_to) if up_to is not None else None
+    except (TypeError, ValueError):
+        return Response({'error': 'up_to must be a message id'}, status=status.HTTP_400_BAD_REQUEST)
+
+    marked, unread = mark_read(patient_id, therapist_id, reader, up_to)
+    return Response({'marked': marked, 'unread_count': unread})
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def send_message(request):
@@ -335,6 +708,8 @@ def send_message(request):
             contenu=contenu,
             sender_type=sender_type  # Use the provided sender_type
         )
+        # Push to connected websocket clients once the row is visible
+        transaction.on_commit(lambda: publish_message(message))
         
         serializer = MessageSerializer(message)
         return Response(serializer.data, status=201)
@@ -345,52 +720,42 @@ def send_message(request):
     
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@replica_reads
 def therapist_conversations(request, therapist_id):
-
-
     """
     Get all conversations for a therapist (only patients who actually messaged)
+    One row per patient, read from the conversation summaries.
+    Supports ?limit=&offset= paging.
     """
     try:
-        # Get unique patients who have conversations with this therapist
-        conversations = Message.objects.filter(
-            therapeute_id=therapist_id
-        ).select_related(
-            'patient__user'
-        ).order_by('-date')
-        
-        # Group by patient and get latest message
-        conversation_map = {}
-        for message in conversations:
-            patient_id = message.patient_id
-            if patient_id not in conversation_map:
-                conversation_map[patient_id] = {
-                    'patient_id': patient_id,
-                    'patient_name': message.patient.user.username,
-                    'patient_email': message.patient.user.email,
-                    'last_message': {
-                        'content': message.contenu,
-                        'date': message.date,
-                        'sender_type': message.sender_type
-                    },
-                    'unread_count': 0  # We'll calculate this separately
-                }
-        
-        # Calculate unread counts for each conversation
-        for patient_id in conversation_map.keys():
-            unread_count = Message.objects.filter(
-                therapeute_id=therapist_id,
-                patient_id=patient_id,
-                sender_type='patient',
-                is_read=False
-            ).count()
-            conversation_map[patient_id]['unread_count'] = unread_count
-        
-        conversation_list = list(conversation_map.values())
-        
-        # Sort by last message date (newest first)
-        conversation_list.sort(key=lambda x: x['last_message']['date'], reverse=True)
-        
+        # One summary row per conversation, kept up to date on send/mark-read
+        conversations = ConversationSummary.objects.filter(
+            therapeute_id=therapist_id,
+            side='therapeute'
+        ).select_related('patient__user', 'last_message').order_by(
+            F('last_activity').desc(nulls_last=True), 'patient_id'
+        )
+
+        paginator = ConversationPagination()
+        page = paginator.paginate_queryset(conversations, request)
+
+        conversation_list = [
+            {
+                'patient_id': summary.patient_id,
+                'patient_name': summary.patient.user.username if summary.patient.user else None,
+                'patient_email': summary.patient.user.email if summary.patient.user else None,
+                'last_message': {
+                    'content': summary.last_message.contenu if summary.last_message else summary.last_message_preview,
+                    'date': summary.last_activity,
+                    'sender_type': summary.last_sender_type
+                },
+                'unread_count': summary.unread_count
+            }
+            for summary in (conversations if page is None else page)
+        ]
+
+        if page is not None:
+            return paginator.get_paginated_response(conversation_list)
         return Response(conversation_list)
         
     except Exception as e:
@@ -400,21 +765,23 @@ def therapist_conversations(request, therapist_id):
 # core/views.py - Add this simple view
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(lambda request: ['patients'])
 def all_patients(request):
     """
     Get ALL patients for therapist to see
     """
     try:
-        patients = Patient.objects.select_related('user').all()
-        
-        patient_list = []
-        for patient in patients:
-            patient_list.append({
-                'patient_id': patient.id,
-                'patient_name': patient.user.username,
-                'patient_email': patient.user.email,
-            })
-        
+        patients = Patient.objects.values_list('id', 'user__username', 'user__email')
+
+        patient_list = [
+            {
+                'patient_id': patient_id,
+                'patient_name': username,
+                'patient_email': email,
+            }
+            for patient_id, username, email in patients
+        ]
+
         return Response(patient_list)
         
     except Exception as e:
@@ -422,11 +789,8 @@ def all_patients(request):
     
 
 # --- Initialization ---
-# Get API Key securely from environment variables
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-# Initialize the client (make sure GEMINI_API_KEY is set in your .env)
-client = genai.Client(api_key=GEMINI_API_KEY) 
-model_name = 'gemini-2.5-flash'
+# The client comes from core.llm (Gemini, or a local stub through HEALME_LLM_CLIENT)
+model_name = MODEL_NAME
 
 class GeminiTestView(View):
     """
@@ -440,13 +804,9 @@ class GeminiTestView(View):
         try:
             # 2. Call the Gemini API
             print(f"Sending prompt to Gemini: '{test_prompt}'")
-            response = client.models.generate_content(
-                model=model_name,
-                contents=test_prompt
-            )
+            ai_response_text = generate_text(test_prompt)
             
             # 3. Format the result for JSON response
-            ai_response_text = response.text
             
             return JsonResponse({
                 'status': 'success',
@@ -464,6 +824,53 @@ class GeminiTestView(View):
                 'detail': str(e)
             }, status=500)
 
+def llm_unavailable_response(error, response_class=Response):
+    """503 for calls the LLM gateway turned down (rate limit, open circuit, timeout)"""
+    response = response_class({"error": str(error)}, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def llm_metrics(request):
+    """Counters, latencies and circuit state of the LLM gateway"""
+    return Response(get_gateway().metrics())
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def chat_cache_stats(request):
+    """Hit rate, lookup latency and size of the chat reply cache"""
+    return Response(get_chat_cache().metrics())
+
+def wants_async(request):
+    """?async=1 (or "async": true in the body) queues the LLM call as an AIJob"""
+    flag = request.query_params.get('async', request.data.get('async', False))
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+def job_accepted_response(job):
+    return Response({
+        "job_id": str(job.id),
+        "status": job.status
+    }, status=202)
+
+def insight_response(request, user_id, kind):
+    """Answer an insight request from the cache, the job queue or Gemini"""
+    fingerprint = insight_fingerprint(user_id, kind)
+
+    if wants_async(request):
+        cached_insight = get_cached_insight(user_id, kind, fingerprint)
+        if cached_insight is None:
+            return job_accepted_response(enqueue_insight(user_id, kind))
+        return Response({
+            "ai_insight": cached_insight
+        }, status=200)
+
+    ai_result = generate_insight(user_id, kind, fingerprint)
+
+    return Response({
+        "ai_insight": ai_result
+    }, status=200)
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_user_mood_insight(request, user_id):
@@ -472,34 +879,17 @@ def get_user_mood_insight(request, user_id):
     """
     try:
         user = get_object_or_404(User, id=user_id)
-        moods = Humeur.objects.filter(patient=user).order_by('-date')
-        serializer = HumeurSerializer(moods, many=True)
 
-        if not moods.exists():
+        if not Humeur.objects.filter(patient=user).exists():
             return Response({
                 "moods": [],
                 "ai_insight": "No mood data to analyze."
             }, status=200)
 
-        mood_text = "\n".join([f"{m.date}: Niveau {m.niveau} - {m.description if m.description else 'Aucune note'}" for m in moods if m.description])
-
-        ai_prompt = f"""
-Please generate a one phrases that suggests activities or advice (an activity that patient can do to imporve health) based on the following mood data:
-
-{mood_text}
-"""
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=ai_prompt
-        )
-
-        ai_result = response.text
-
-        return Response({
-            "ai_insight": ai_result
-        }, status=200)
+        return insight_response(request, user.id, 'mood')
 
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
     
@@ -511,41 +901,17 @@ def get_user_sleep_insight(request, user_id):
     """
     try:
         user = get_object_or_404(User, id=user_id)
-        sleeps = Sommeil.objects.filter(patient=user).order_by('-date')
-        serializer = SommeilSerializer(sleeps, many=True)
 
-        if not sleeps.exists():
+        if not Sommeil.objects.filter(patient=user).exists():
             return Response({
                 "sleep": [],
                 "ai_insight": "No sleep data to analyze."
             }, status=200)
 
-        # Format sleep data for AI
-        sleep_text = "\n".join([
-            f"{s.date}: {s.dureeHeures} hours, quality = {s.qualite}"
-            for s in sleeps
-        ])
-
-        ai_prompt = f"""
-Please generate one single phrase of sleep advice based on this person's sleep patterns.
-Make the suggestion practical and short.
-
-Sleep data:
-
-{sleep_text}
-"""
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=ai_prompt
-        )
-
-        ai_result = response.text
-
-        return Response({
-            "ai_insight": ai_result
-        }, status=200)
+        return insight_response(request, user.id, 'sleep')
 
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
@@ -557,50 +923,116 @@ def get_user_journal_insight(request, user_id):
     """
     try:
         user = get_object_or_404(User, id=user_id)
-        journals = Journal.objects.filter(patient=user).order_by('-date')
-        serializer = JournalSerializer(journals, many=True)
 
-        if not journals.exists():
+        if not Journal.objects.filter(patient=user).exists():
             return Response({
                 "journal": [],
                 "ai_insight": "No journal entries to analyze."
             }, status=200)
 
-        # Format journal text for AI
-        journal_text = "\n".join([
-            f"{j.date}: {j.contenu[:200]}..."
-            for j in journals
-        ])
-
-        ai_prompt = f"""
-Please summarize the emotional tone of this person's journal entries in one short sentence.
-Avoid deep analysis, keep it supportive and simple.
-
-Journal entries:
-
-{journal_text}
-"""
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=ai_prompt
-        )
-
-        ai_result = response.text
-
-        return Response({
-            "ai_insight": ai_result
-        }, status=200)
+        return insight_response(request, user.id, 'journal')
 
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
     
 
+def sse_event(data, event=None):
+    """Format one server-sent event"""
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+def sse_response(events):
+    """
+    Streams the SSE events. The first one is read before the response
+    starts, so an LLMUnavailable raised by then reaches the view (503).
+    """
+    first = next(events, None)
+    if first is not None:
+        events = itertools.chain([first], events)
+    return streaming_sse(events)
+
+async def asse_response(events):
+    first = await anext(events, None)
+    if first is not None:
+        events = prepend_event(first, events)
+    return streaming_sse(events)
+
+async def prepend_event(first, events):
+    yield first
+    async for event in events:
+        yield event
+
+def streaming_sse(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let proxies pass each event through
+    return response
+
+def chat_reply_events(user_message):
+    """
+    SSE stream of a chat reply: one {"delta"} event per chunk from Gemini,
+    then a "done" event with the whole reply (or an "error" event).
+    LLMUnavailable before the first chunk is raised, for a 503.
+    """
+    chat_cache = get_chat_cache()
+    cached = chat_cache.get(user_message)
+    if cached is not None:
+        yield sse_event({"delta": cached})
+        yield sse_event({"reply": cached}, event="done")
+        return
+
+    reply = []
+    try:
+        for text in stream_text(build_chat_prompt(user_message)):
+            reply.append(text)
+            yield sse_event({"delta": text})
+    except Exception as e:
+        if isinstance(e, LLMUnavailable) and not reply:
+            raise
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    chat_cache.set(user_message, "".join(reply))
+    yield sse_event({"reply": "".join(reply)}, event="done")
+
+async def achat_reply_events(user_message):
+    chat_cache = get_chat_cache()
+    cached = chat_cache.get(user_message)
+    if cached is not None:
+        yield sse_event({"delta": cached})
+        yield sse_event({"reply": cached}, event="done")
+        return
+
+    reply = []
+    try:
+        async for text in astream_text(build_chat_prompt(user_message)):
+            reply.append(text)
+            yield sse_event({"delta": text})
+    except Exception as e:
+        if isinstance(e, LLMUnavailable) and not reply:
+            raise
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    chat_cache.set(user_message, "".join(reply))
+    yield sse_event({"reply": "".join(reply)}, event="done")
+
+def wants_stream(request, data=None):
+    """?stream=1 (or "stream": true in the body) streams the reply as SSE"""
+    if data is None:
+        data = request.data
+    flag = request.GET.get('stream', data.get('stream', False))
+    return str(flag).lower() in ('1', 'true', 'yes')
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def ai_chat_reply(request):
     """
     Generate an AI response to a user's chat message (Gemini).
+    Send "async": true to get a job id back instead of waiting for the reply,
+    or "stream": true to receive the reply as server-sent events.
     """
     try:
         user_message = request.data.get("message", "")
@@ -611,23 +1043,150 @@ def ai_chat_reply(request):
                 status=400
             )
 
-        ai_prompt = f"""
-You are a supportive assistant. Respond in a short, warm, simple tone.
-
-User said:
-{user_message}
-"""
+        if wants_async(request):
+            job = enqueue_job(
+                'chat_reply',
+                {'message': user_message},
+                user_id=request.user.id if request.user.is_authenticated else None
+            )
+            return job_accepted_response(job)
 
-        response = client.models.generate_content(
-            model=model_name,
-            contents=ai_prompt
-        )
+        if wants_stream(request):
+            return sse_response(chat_reply_events(user_message))
 
-        ai_reply = response.text
+        # Repeated short messages are answered from the reply cache
+        ai_reply, cached = chat_reply(user_message)
 
         return Response({
             "reply": ai_reply
-        }, status=200)
+        }, status=200, headers={'X-Cache': 'HIT' if cached else 'MISS'})
 
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_ai_job(request, job_id):
+    """
+    Poll a queued AI job, the result is set once status is "done"
+    """
+    job = get_object_or_404(AIJob, id=job_id)
+    if job.status in ACTIVE_STATUSES and fail_stale_jobs(AIJob.objects.filter(id=job.id)):
+        job.refresh_from_db()
+    return Response({
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "result": job.result if job.status == 'done' else None,
+        "error": job.error or None
+    }, status=200)
+
+
+
+# ===== ASYNC AI VIEWS =====
+# Native async versions of the AI endpoints. Under asgi.py many LLM calls
+# wait on one event loop instead of holding a worker thread each.
+
+INSIGHT_EMPTY_RESPONSES = {
+    'mood': ("moods", "No mood data to analyze."),
+    'sleep': ("sleep", "No sleep data to analyze."),
+    'journal': ("journal", "No journal entries to analyze."),
+}
+
+class AsyncGeminiTestView(View):
+    """
+    Async GeminiTestView, using the async Gemini client.
+    """
+    async def get(self, request, *args, **kwargs):
+        test_prompt = "Explain the concept of Django REST Framework in one concise sentence."
+
+        try:
+            ai_response_text = await agenerate_text(test_prompt)
+
+            return JsonResponse({
+                'status': 'success',
+                'prompt_sent': test_prompt,
+                'model_used': model_name,
+                'ai_response': ai_response_text
+            }, status=200)
+
+        except Exception as e:
+            print(f"Error calling Gemini API: {e}")
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Failed to connect to or get a response from the Gemini API.',
+                'detail': str(e)
+            }, status=500)
+
+async def async_insight_response(user_id, kind):
+    try:
+        if not await User.objects.filter(id=user_id).aexists():
+            return JsonResponse({"error": "User not found"}, status=404)
+
+        if not await INSIGHT_MODELS[kind].objects.filter(patient_id=user_id).aexists():
+            data_key, message = INSIGHT_EMPTY_RESPONSES[kind]
+            return JsonResponse({
+                data_key: [],
+                "ai_insight": message
+            }, status=200)
+
+        ai_result = await agenerate_insight(user_id, kind)
+
+        return JsonResponse({
+            "ai_insight": ai_result
+        }, status=200)
+
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e, JsonResponse)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+@require_GET
+async def get_user_mood_insight_async(request, user_id):
+    """Async get_user_mood_insight"""
+    return await async_insight_response(user_id, 'mood')
+
+@require_GET
+async def get_user_sleep_insight_async(request, user_id):
+    """Async get_user_sleep_insight"""
+    return await async_insight_response(user_id, 'sleep')
+
+@require_GET
+async def get_user_journal_insight_async(request, user_id):
+    """Async get_user_journal_insight"""
+    return await async_insight_response(user_id, 'journal')
+
+@csrf_exempt
+@require_POST
+async def ai_chat_reply_async(request):
+    """Async ai_chat_reply, takes the same JSON body ("stream": true included)"""
+    try:
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body."}, status=400)
+
+        user_message = data.get("message", "")
+
+        if not user_message or user_message.strip() == "":
+            return JsonResponse(
+                {"error": "Message field cannot be empty."},
+                status=400
+            )
+
+        if wants_stream(request, data):
+            return await asse_response(achat_reply_events(user_message))
+
+        ai_reply, cached = await achat_reply(user_message)
+
+        return JsonResponse({
+            "reply": ai_reply
+        }, status=200, headers={'X-Cache': 'HIT' if cached else 'MISS'})
+
+    except LLMUnavailable as e:
+        return llm_unavailable_response(e, JsonResponse)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healme_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, the consumer touches models and settings
+from core.consumers import conversation_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Route websocket connections to the chat push channel, HTTP to Django"""
+    if scope['type'] == 'websocket':
+        await conversation_socket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,96 @@
+"""
+Database settings from the environment.
+
+HEALME_DB_ENGINE picks the backend:
+
+- ``sqlite`` (default): one file, for single node deployments. Tuned for
+  concurrent writers unless HEALME_SQLITE_TUNING=False: WAL journal (readers
+  no longer block the writer), synchronous=NORMAL, a busy timeout so writers
+  wait for the lock instead of failing with "database is locked", IMMEDIATE
+  transactions (no failing lock upgrade) and memory mapped reads.
+- ``postgres``: HEALME_DB_NAME/USER/PASSWORD/HOST/PORT. Connections are
+  pooled (psycopg 3 pool, HEALME_DB_POOL_MIN/MAX) or, with
+  HEALME_DB_POOL=False, kept open for HEALME_DB_CONN_MAX_AGE seconds.
+
+A read replica (alias 'replica', see core/routers.py) is configured with
+HEALME_DB_REPLICA_NAME for SQLite (a second file, refreshed locally with
+manage.py copy_sqlite_replica) or HEALME_DB_REPLICA_HOST for PostgreSQL.
+"""
+import os
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA mmap_size=134217728;'
+    'PRAGMA cache_size=-20000;'
+    'PRAGMA temp_store=MEMORY;'
+)
+
+
+def env_flag(env, name, default):
+    return env.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def sqlite_config(env, base_dir):
+    config = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('HEALME_DB_NAME', base_dir / 'db.sqlite3'),
+    }
+    if env_flag(env, 'HEALME_SQLITE_TUNING', True):
+        config['OPTIONS'] = {
+            'init_command': SQLITE_PRAGMAS,
+            # Seconds a writer waits for the lock
+            'timeout': float(env.get('HEALME_SQLITE_BUSY_TIMEOUT', 20)),
+            'transaction_mode': 'IMMEDIATE',
+        }
+    return config
+
+
+def postgres_config(env):
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('HEALME_DB_NAME', 'healme'),
+        'USER': env.get('HEALME_DB_USER', 'healme'),
+        'PASSWORD': env.get('HEALME_DB_PASSWORD', ''),
+        'HOST': env.get('HEALME_DB_HOST', 'localhost'),
+        'PORT': env.get('HEALME_DB_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if env_flag(env, 'HEALME_DB_POOL', True):
+        # Django's pool replaces persistent connections (CONN_MAX_AGE must stay 0)
+        config['OPTIONS']['pool'] = {
+            'min_size': int(env.get('HEALME_DB_POOL_MIN', 2)),
+            'max_size': int(env.get('HEALME_DB_POOL_MAX', 20)),
+            'timeout': float(env.get('HEALME_DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        config['CONN_MAX_AGE'] = int(env.get('HEALME_DB_CONN_MAX_AGE', 60))
+    return config
+
+
+def database_config(base_dir, env=os.environ):
+    engine = env.get('HEALME_DB_ENGINE', 'sqlite')
+    if engine == 'sqlite':
+        return sqlite_config(env, base_dir)
+    if engine in ('postgres', 'postgresql'):
+        return postgres_config(env)
+    raise ValueError(f"Unknown HEALME_DB_ENGINE {engine!r}, use 'sqlite' or 'postgres'")
+
+
+def replica_config(base_dir, env=os.environ):
+    """Settings of the read replica, None when there is none"""
+    engine = env.get('HEALME_DB_ENGINE', 'sqlite')
+    if engine == 'sqlite' and env.get('HEALME_DB_REPLICA_NAME'):
+        config = sqlite_config({**env, 'HEALME_DB_NAME': env['HEALME_DB_REPLICA_NAME']}, base_dir)
+    elif engine in ('postgres', 'postgresql') and env.get('HEALME_DB_REPLICA_HOST'):
+        config = postgres_config({
+            **env,
+            'HEALME_DB_HOST': env['HEALME_DB_REPLICA_HOST'],
+            'HEALME_DB_PORT': env.get('HEALME_DB_REPLICA_PORT', env.get('HEALME_DB_PORT', '5432')),
+        })
+    else:
+        return None
+    # Tests run against one database
+    config['TEST'] = {'MIRROR': 'default'}
+    return config
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from .database import database_config, replica_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -53,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.routers.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -91,18 +94,114 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'healme_backend.wsgi.application'
+ASGI_APPLICATION = 'healme_backend.asgi.application'
+
+# Pub/sub backend used to push new chat messages over websockets
+HEALME_PUBSUB_BACKEND = os.getenv('HEALME_PUBSUB_BACKEND', 'core.pubsub.InMemoryPubSub')
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# HEALME_DB_ENGINE = 'sqlite' (tuned for concurrent writes) or 'postgres',
+# see healme_backend/database.py for the other variables
 DATABASES = {
+    'default': database_config(BASE_DIR),
+}
+if replica_config(BASE_DIR):
+    DATABASES['replica'] = replica_config(BASE_DIR)
+
+# History, conversation and list reads go to the replica when there is one
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# Keep reading from the primary this long after a client wrote
+HEALME_REPLICA_STICKY_SECONDS = int(os.getenv('HEALME_REPLICA_STICKY_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'healme',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('HEALME_CACHE_MAX_ENTRIES', 10000)),
+        },
     }
 }
 
+# Sessions: 'django.contrib.sessions.backends.cached_db' reads them from the
+# cache and only hits the database on a miss. Needs a cache shared by all
+# workers (not LocMemCache) when running more than one process.
+SESSION_ENGINE = os.getenv('HEALME_SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Bearer tokens from /api/token/, checked with one indexed query (revocations)
+        'core.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    # orjson instead of the stdlib json module, same output (core/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# In-process cache of the data of the ETag'd list responses (core/httpcache.py),
+# entries by ETag; 0 only answers conditional requests
+HEALME_RESPONSE_CACHE_SIZE = int(os.getenv('HEALME_RESPONSE_CACHE_SIZE', 0))
+HEALME_RESPONSE_CACHE_TTL = int(os.getenv('HEALME_RESPONSE_CACHE_TTL', 60))
+
+# Lifetime of the signed API tokens, in seconds
+HEALME_ACCESS_TOKEN_TTL = int(os.getenv('HEALME_ACCESS_TOKEN_TTL', 15 * 60))
+HEALME_REFRESH_TOKEN_TTL = int(os.getenv('HEALME_REFRESH_TOKEN_TTL', 14 * 24 * 60 * 60))
+
+# How long a Gemini insight is reused while the user's entries are unchanged
+HEALME_INSIGHT_CACHE_TTL = int(os.getenv('HEALME_INSIGHT_CACHE_TTL', 6 * 60 * 60))
+
+# Insight prompts quote the latest entries and summarise older ones, within a token budget
+HEALME_PROMPT_TOKEN_BUDGET = int(os.getenv('HEALME_PROMPT_TOKEN_BUDGET', 1000))
+HEALME_PROMPT_RECENT_ENTRIES = int(os.getenv('HEALME_PROMPT_RECENT_ENTRIES', 14))
+HEALME_PROMPT_SUMMARY_WEEKS = int(os.getenv('HEALME_PROMPT_SUMMARY_WEEKS', 12))
+
+# LLM client factory, 'core.llm.StubClient' answers locally without Gemini
+HEALME_LLM_CLIENT = os.getenv('HEALME_LLM_CLIENT', 'core.llm.gemini_client')
+
+# Limits of the LLM gateway (core/gateway.py): calls per second and burst,
+# calls running at once, seconds per call and seconds a caller may wait for
+# its turn, failures in a row that open the circuit and how long it stays open
+HEALME_LLM_RATE = float(os.getenv('HEALME_LLM_RATE', 10))
+HEALME_LLM_BURST = int(os.getenv('HEALME_LLM_BURST', 20))
+HEALME_LLM_MAX_CONCURRENCY = int(os.getenv('HEALME_LLM_MAX_CONCURRENCY', 16))
+HEALME_LLM_TIMEOUT = float(os.getenv('HEALME_LLM_TIMEOUT', 30))
+HEALME_LLM_QUEUE_TIMEOUT = float(os.getenv('HEALME_LLM_QUEUE_TIMEOUT', 10))
+HEALME_LLM_BREAKER_FAILURES = int(os.getenv('HEALME_LLM_BREAKER_FAILURES', 5))
+HEALME_LLM_BREAKER_RESET = float(os.getenv('HEALME_LLM_BREAKER_RESET', 30))
+
+# Replies to short chat messages reused for repeats (core/chatcache.py): entries,
+# seconds, longest message cached, and the cosine similarity from which a near
+# duplicate counts as the same message (0 = exact normalised matches only)
+HEALME_CHAT_CACHE_SIZE = int(os.getenv('HEALME_CHAT_CACHE_SIZE', 1000))
+HEALME_CHAT_CACHE_TTL = int(os.getenv('HEALME_CHAT_CACHE_TTL', 60 * 60))
+HEALME_CHAT_CACHE_MAX_CHARS = int(os.getenv('HEALME_CHAT_CACHE_MAX_CHARS', 280))
+HEALME_CHAT_CACHE_SIMILARITY = float(os.getenv('HEALME_CHAT_CACHE_SIMILARITY', 0))
+
+# Background AI jobs: 'thread' (in-process pool), 'eager' or 'worker' (manage.py run_ai_jobs)
+HEALME_JOB_MODE = os.getenv('HEALME_JOB_MODE', 'thread')
+HEALME_JOB_WORKERS = int(os.getenv('HEALME_JOB_WORKERS', 4))
+# Queued or running jobs untouched for this long are failed, the next request queues a new one
+HEALME_JOB_STALE_SECONDS = int(os.getenv('HEALME_JOB_STALE_SECONDS', 600))
+# Queue a fresh insight whenever mood/sleep/journal entries are written
+HEALME_PRECOMPUTE_INSIGHTS = os.getenv('HEALME_PRECOMPUTE_INSIGHTS', 'False') == 'True'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators